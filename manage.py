@@ -11,6 +11,8 @@ from src.cli.run import RunCommand, GunicornRunCommand
 from src.cli.test import RunTestsCommand, RunTestsXMLCommand
 from src.cli.config import GenerateSecretsCommand, InitConfigCommand
 from src.cli.user import CreateAdmin
+from src.cli.migrate import MigrateSensorStatus
+from src.cli.sweeper import SweepDevices
 
 MANAGER = Manager(create_app(os.getenv('FLASK_CONFIG') or 'dev'))
 
@@ -23,6 +25,10 @@ MANAGER.add_command('create_admin', CreateAdmin())
 
 # Perform database operations
 MANAGER.add_command('db', MigrateCommand)
+MANAGER.add_command('migrate_sensor_status', MigrateSensorStatus())
+
+# Record devices that stopped sending heartbeats as DOWN
+MANAGER.add_command('sweep_devices', SweepDevices())
 
 # Manage the 'jax-mba-service.config' file
 MANAGER.add_command('create_secrets', GenerateSecretsCommand)
@@ -0,0 +1,48 @@
+"""start large recording sessions in waves
+
+Revision ID: 0517bc64ff5a
+Revises: ad80b6a37e82
+Create Date: 2026-10-17 09:11:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0517bc64ff5a'
+down_revision = 'ad80b6a37e82'
+branch_labels = None
+depends_on = None
+
+
+# status columns of the tables, SQLite doesn't reflect the CHECK constraints of
+# the enums when downgrade() recreates the tables
+SESSION_STATUS = sa.Column('status', sa.Enum(
+    'IN_PROGRESS', 'COMPLETE', 'CANCELED', name='session_state'),
+                           nullable=False)
+DEVICE_STATUS = sa.Column('status', sa.Enum(
+    'PENDING', 'RECORDING', 'COMPLETE', 'FAILED', 'CANCELED',
+    name='device_session_state'), nullable=False)
+
+
+def upgrade():
+    op.add_column('recording_session',
+                  sa.Column('start_wave_size', sa.Integer()))
+    op.add_column('recording_session',
+                  sa.Column('start_wave_interval', sa.Integer()))
+    op.add_column('recording_session',
+                  sa.Column('start_waves', sa.Integer()))
+    op.add_column('session_device_status', sa.Column(
+        'start_wave', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table(
+            'session_device_status', reflect_args=[DEVICE_STATUS]) as batch_op:
+        batch_op.drop_column('start_wave')
+    with op.batch_alter_table(
+            'recording_session', reflect_args=[SESSION_STATUS]) as batch_op:
+        batch_op.drop_column('start_waves')
+        batch_op.drop_column('start_wave_interval')
+        batch_op.drop_column('start_wave_size')
@@ -0,0 +1,29 @@
+"""change counters versioning the API data
+
+Revision ID: 1b3ea11b664a
+Revises: 7080a2509868
+Create Date: 2026-10-17 09:04:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b3ea11b664a'
+down_revision = '7080a2509868'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    counters = op.create_table(
+        'change_counter',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('value', sa.BigInteger(), nullable=False,
+                  server_default='0'))
+    op.bulk_insert(counters, [{'name': 'revision', 'value': 0}])
+
+
+def downgrade():
+    op.drop_table('change_counter')
@@ -0,0 +1,26 @@
+"""index of the statuses of a session
+
+Revision ID: 26bd60b0dc97
+Revises: 270a5d52b603
+Create Date: 2026-10-17 09:09:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '26bd60b0dc97'
+down_revision = '270a5d52b603'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_session_device_status_session_id_status',
+                    'session_device_status', ['session_id', 'status'])
+
+
+def downgrade():
+    op.drop_index('ix_session_device_status_session_id_status',
+                  'session_device_status')
@@ -0,0 +1,51 @@
+"""per-status device counters on recording sessions
+
+Revision ID: 270a5d52b603
+Revises: fac61c26bbf6
+Create Date: 2026-10-17 09:08:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '270a5d52b603'
+down_revision = 'fac61c26bbf6'
+branch_labels = None
+depends_on = None
+
+
+STATUSES = ('PENDING', 'RECORDING', 'COMPLETE', 'FAILED', 'CANCELED')
+
+# SQLite doesn't reflect the CHECK constraint of the status enum, batch
+# operations recreating the table are given the column
+STATUS = sa.Column('status', sa.Enum(
+    'IN_PROGRESS', 'COMPLETE', 'CANCELED', name='session_state'),
+                   nullable=False)
+
+
+def upgrade():
+    for status in STATUSES:
+        op.add_column('recording_session', sa.Column(
+            f'{status.lower()}_count', sa.Integer(), nullable=False,
+            server_default='0'))
+
+    # count the statuses of existing sessions
+    sessions = sa.table('recording_session', sa.column('id'),
+                        *[sa.column(f'{s.lower()}_count') for s in STATUSES])
+    statuses = sa.table('session_device_status', sa.column('session_id'),
+                        sa.column('status'))
+    op.execute(sessions.update().values({
+        f'{status.lower()}_count': sa.select([sa.func.count()]).where(
+            sa.and_(statuses.c.session_id == sessions.c.id,
+                    statuses.c.status == status)).as_scalar()
+        for status in STATUSES
+    }))
+
+
+def downgrade():
+    with op.batch_alter_table(
+            'recording_session', reflect_args=[STATUS]) as batch_op:
+        for status in STATUSES:
+            batch_op.drop_column(f'{status.lower()}_count')
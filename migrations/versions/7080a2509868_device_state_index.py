@@ -0,0 +1,25 @@
+"""index used to find devices by state
+
+Revision ID: 7080a2509868
+Revises: c74edb5150c6
+Create Date: 2026-10-17 09:03:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7080a2509868'
+down_revision = 'c74edb5150c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_device_last_update_session_id', 'device',
+                    ['last_update', 'session_id'])
+
+
+def downgrade():
+    op.drop_index('ix_device_last_update_session_id', 'device')
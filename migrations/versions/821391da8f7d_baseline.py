@@ -0,0 +1,25 @@
+"""schema of the release before migrations were added
+
+Revision ID: 821391da8f7d
+Revises: 
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '821391da8f7d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases created by that release are stamped with this revision
+    pass
+
+
+def downgrade():
+    pass
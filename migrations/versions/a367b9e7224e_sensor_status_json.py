@@ -0,0 +1,40 @@
+"""store sensor_status as a JSON object
+
+Revision ID: a367b9e7224e
+Revises: 821391da8f7d
+Create Date: 2026-10-17 09:01:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a367b9e7224e'
+down_revision = '821391da8f7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # sensor_status used to be stored as a JSON encoded string inside the
+    # JSON column. convert existing values to JSON objects and, on
+    # PostgreSQL, convert the column to JSONB and index it
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        op.execute("UPDATE device SET sensor_status = "
+                   "json_extract(sensor_status, '$') "
+                   "WHERE json_type(sensor_status) = 'text'")
+        return
+    op.execute("ALTER TABLE device ALTER COLUMN sensor_status TYPE jsonb "
+               "USING CASE WHEN json_typeof(sensor_status) = 'string' "
+               "THEN (sensor_status #>> '{}')::jsonb "
+               "ELSE sensor_status::jsonb END")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_device_sensor_status ON device "
+               "USING gin (sensor_status jsonb_path_ops)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_device_sensor_status")
+        op.execute("ALTER TABLE device ALTER COLUMN sensor_status TYPE json")
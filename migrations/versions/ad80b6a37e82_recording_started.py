@@ -0,0 +1,34 @@
+"""compute recording times from when devices started
+
+Revision ID: ad80b6a37e82
+Revises: 26bd60b0dc97
+Create Date: 2026-10-17 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ad80b6a37e82'
+down_revision = '26bd60b0dc97'
+branch_labels = None
+depends_on = None
+
+
+# SQLite doesn't reflect the CHECK constraint of the status enum, batch
+# operations recreating the table are given the column
+STATUS = sa.Column('status', sa.Enum(
+    'PENDING', 'RECORDING', 'COMPLETE', 'FAILED', 'CANCELED',
+    name='device_session_state'), nullable=False)
+
+
+def upgrade():
+    op.add_column('session_device_status', sa.Column(
+        'recording_started', sa.TIMESTAMP(timezone=True)))
+
+
+def downgrade():
+    with op.batch_alter_table(
+            'session_device_status', reflect_args=[STATUS]) as batch_op:
+        batch_op.drop_column('recording_started')
@@ -0,0 +1,53 @@
+"""revision of the last change to each row
+
+Revision ID: aef574a2ebe9
+Revises: 1b3ea11b664a
+Create Date: 2026-10-17 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'aef574a2ebe9'
+down_revision = '1b3ea11b664a'
+branch_labels = None
+depends_on = None
+
+
+def status_column(table):
+    """
+    SQLite doesn't reflect the CHECK constraints of enums, the status column
+    is given to the batch operations recreating the table so it keeps them
+    :param table: name of the table
+    :return: list of the columns overriding the reflected ones
+    """
+    if table == 'recording_session':
+        status = sa.Enum('IN_PROGRESS', 'COMPLETE', 'CANCELED',
+                         name='session_state')
+    elif table == 'session_device_status':
+        status = sa.Enum('PENDING', 'RECORDING', 'COMPLETE', 'FAILED',
+                         'CANCELED', name='device_session_state')
+    else:
+        return []
+    return [sa.Column('status', status, nullable=False)]
+
+# tables whose rows have a revision maintained by the change counter
+TABLES = ('device', 'recording_session', 'session_device_status')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('revision', sa.BigInteger(),
+                                       nullable=False, server_default='0'))
+        op.create_index(f'ix_{table}_revision', table, ['revision'])
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_revision', table)
+        with op.batch_alter_table(
+                table,
+                reflect_args=status_column(table)) as batch_op:
+            batch_op.drop_column('revision')
@@ -0,0 +1,42 @@
+"""split the change counter into shards
+
+Revision ID: c4f4fb7677b4
+Revises: 0517bc64ff5a
+Create Date: 2026-10-17 14:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f4fb7677b4'
+down_revision = '0517bc64ff5a'
+branch_labels = None
+depends_on = None
+
+# ChangeCounter.SHARDS when the counter was split
+SHARDS = 16
+
+COUNTERS = sa.table('change_counter', sa.column('name'), sa.column('value'))
+
+
+def upgrade():
+    # revision R is shard R % SHARDS, increment R // SHARDS of that shard.
+    # Starting every shard from the old value keeps the existing revisions
+    # below the ones the shards return
+    value = op.get_bind().execute(
+        sa.select([COUNTERS.c.value])
+        .where(COUNTERS.c.name == 'revision')).scalar() or 0
+    op.bulk_insert(COUNTERS, [{'name': f'revision.{shard}', 'value': value}
+                              for shard in range(1, SHARDS)])
+
+
+def downgrade():
+    # the single counter must be above every revision the shards returned
+    value = op.get_bind().execute(
+        sa.select([sa.func.max(COUNTERS.c.value)])
+        .where(COUNTERS.c.name.like('revision%'))).scalar() or 0
+    op.execute(COUNTERS.delete().where(COUNTERS.c.name.like('revision.%')))
+    op.execute(COUNTERS.update().where(COUNTERS.c.name == 'revision')
+               .values(value=value * SHARDS + SHARDS - 1))
@@ -0,0 +1,44 @@
+"""per-device command outbox
+
+Revision ID: c74edb5150c6
+Revises: a367b9e7224e
+Create Date: 2026-10-17 09:02:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c74edb5150c6'
+down_revision = 'a367b9e7224e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'device_command',
+        sa.Column('device_id', sa.Integer(),
+                  sa.ForeignKey('device.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('seq', sa.Integer(), primary_key=True,
+                  autoincrement=False),
+        sa.Column('name', sa.Enum('START', 'STOP', 'STREAM',
+                                  name='device_command_name'),
+                  nullable=False),
+        sa.Column('parameters', sa.String()),
+        sa.Column('creation_time', sa.TIMESTAMP(timezone=True),
+                  nullable=False, server_default=sa.func.now()))
+    op.add_column('device', sa.Column('command_seq', sa.Integer(),
+                                      nullable=False, server_default='0'))
+    op.add_column('device', sa.Column('acked_seq', sa.Integer(),
+                                      nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.drop_column('acked_seq')
+        batch_op.drop_column('command_seq')
+    op.drop_table('device_command')
+    sa.Enum(name='device_command_name').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,31 @@
+"""record when devices went DOWN
+
+Revision ID: f59ca650ee18
+Revises: aef574a2ebe9
+Create Date: 2026-10-17 09:06:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f59ca650ee18'
+down_revision = 'aef574a2ebe9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('device', sa.Column('down_since',
+                                      sa.TIMESTAMP(timezone=True)))
+    # only devices not yet found DOWN are indexed
+    op.create_index('ix_device_live_last_update', 'device', ['last_update'],
+                    postgresql_where=sa.text('down_since IS NULL'),
+                    sqlite_where=sa.text('down_since IS NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_device_live_last_update', 'device')
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.drop_column('down_since')
@@ -0,0 +1,34 @@
+"""indexes listing live and archived sessions
+
+Revision ID: fac61c26bbf6
+Revises: f59ca650ee18
+Create Date: 2026-10-17 09:07:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fac61c26bbf6'
+down_revision = 'f59ca650ee18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_recording_session_archived_creation_time',
+                    'recording_session', ['creation_time', 'id'],
+                    postgresql_where=sa.text('archived = true'),
+                    sqlite_where=sa.text('archived = 1'))
+    op.create_index('ix_recording_session_live_creation_time',
+                    'recording_session', ['creation_time'],
+                    postgresql_where=sa.text('archived = false'),
+                    sqlite_where=sa.text('archived = 0'))
+
+
+def downgrade():
+    op.drop_index('ix_recording_session_live_creation_time',
+                  'recording_session')
+    op.drop_index('ix_recording_session_archived_creation_time',
+                  'recording_session')
@@ -9,7 +9,7 @@ from src import factory
 from .controller import API_BLUEPRINT, API
 from .model import MA, init_db, BASE
 from .utils import jwt as jwt_utils
-from .model import SESSION
+from .model import SESSION, DOWN_SWEEPER
 
 
 def _root():  # pylint: disable=W0612
@@ -50,6 +50,12 @@ def create_app(config_name=None, app=None, config_object=None):
         """ Redirect the root endpoint to the api blueprint """
         return redirect('/api')
 
+    @app.before_request
+    def start_down_sweeper():  # pylint: disable=W0612
+        # started on the first request, after any uWSGI/gunicorn fork
+        if app.config['DOWN_SWEEPER']:
+            DOWN_SWEEPER.start(app)
+
     @app.after_request
     def remove_session(response):
         SESSION.remove()
@@ -12,6 +12,8 @@ from .auth_controller import NS as auth_ns
 from .device_controller import NS as device_ns
 from .recording_session_controller import NS as rec_session_ns
 from .user_controller import NS as user_ns
+from .changes_controller import NS as changes_ns
+from .events_controller import NS as events_ns
 
 
 API_BLUEPRINT = Blueprint('api', __name__)
@@ -35,4 +37,6 @@ API.add_namespace(auth_ns)
 API.add_namespace(device_ns)
 API.add_namespace(rec_session_ns)
 API.add_namespace(user_ns)
+API.add_namespace(changes_ns)
+API.add_namespace(events_ns)
 
@@ -0,0 +1,96 @@
+"""
+controller for synchronizing changes to devices and recording sessions
+"""
+from flask_jwt_extended import jwt_required
+from flask_restplus import Resource, Namespace, abort, reqparse
+
+import src.app.model as model
+from .schemas import CHANGES_SCHEMA, CHANGED_SESSION_SCHEMA, \
+    CHANGED_DEVICE_STATUS_SCHEMA, DEVICE_SCHEMA, SYSINFO_SCHEMA, \
+    SENSOR_STATUS, CAMERA_STATUS, add_models_to_namespace
+from .utils.pagination import encode_cursor, decode_cursor
+from .utils.payload import parse_timestamp
+
+NS = Namespace('changes',
+               description='Endpoints for synchronizing changes')
+NS = add_models_to_namespace(NS, [
+    SYSINFO_SCHEMA,
+    CAMERA_STATUS,
+    SENSOR_STATUS,
+    DEVICE_SCHEMA,
+    CHANGED_SESSION_SCHEMA,
+    CHANGED_DEVICE_STATUS_SCHEMA,
+    CHANGES_SCHEMA
+])
+
+CHANGES_PARSER = reqparse.RequestParser()
+CHANGES_PARSER.add_argument(
+    'since', type=str,
+    help="cursor from a previous response, omit to get everything")
+
+
+def parse_since(cursor):
+    """
+    decode a change feed cursor, aborting with a 400 response if it is
+    invalid
+    :param cursor: cursor string, may be None
+    :return: tuple of the revisions (see ChangeCounter.get_revisions()) and
+        DOWN cutoff already seen, both None if cursor is None or from a
+        release that versioned the data differently, to get everything again
+    """
+    since = decode_cursor(cursor)
+    if since is None:
+        return None, None
+    try:
+        if 'revision' in since:
+            # cursor of a release with a single revision counter
+            return None, None
+        revisions = [int(revision) for revision in since['revisions']]
+        down_after = parse_timestamp(since['down_cutoff'])
+    except (TypeError, KeyError, ValueError):
+        abort(400, f"invalid cursor: {cursor}")
+    if len(revisions) != model.ChangeCounter.SHARDS:
+        # the counter has been split into a different number of shards
+        return None, None
+    return revisions, down_after
+
+
+@NS.route('')
+class Changes(Resource):
+    """ Endpoint for getting what changed since a previous request """
+
+    @jwt_required
+    @NS.doc(security='JWT Access')
+    @NS.expect(CHANGES_PARSER)
+    @NS.response(400, "invalid cursor")
+    @NS.marshal_with(CHANGES_SCHEMA)
+    def get(self):  # pylint: disable=R0201
+        """
+        get the devices, recording sessions and device session statuses that
+        changed since a previous request
+
+        Without since every device, session and status is returned. Pass the
+        cursor from the response as since in the next request to get only
+        what changed in between. Devices whose state changed to DOWN are
+        included even though nothing was written to them. Changes are
+        reported once, deleted rows are not reported.
+        """
+        since, down_after = parse_since(
+            CHANGES_PARSER.parse_args()['since'])
+
+        # every revision up to the current value of each shard of the counter
+        # is committed, so nothing up to it can be missed. later revisions
+        # are left for the next request
+        until = model.ChangeCounter.get_revisions()
+        down_cutoff = model.Device.down_cutoff()
+
+        return {
+            'cursor': encode_cursor({'revisions': until,
+                                     'down_cutoff': down_cutoff.isoformat()}),
+            'devices': model.Device.get_changed(since, until, down_after,
+                                                down_cutoff),
+            'recording_sessions': model.RecordingSession.get_changed(
+                since, until),
+            'device_statuses': model.DeviceRecordingStatus.get_changed(
+                since, until)
+        }
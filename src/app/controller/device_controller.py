@@ -1,19 +1,29 @@
 """
 controller for interacting with devices through the API
 """
-import dateutil.parser
-import json
+import time
+from datetime import datetime
 
+from flask import current_app, Response
 from flask_jwt_extended import jwt_required
-from flask_restplus import Resource, Namespace, abort
+from flask_restplus import Resource, Namespace, abort, reqparse, inputs, \
+    marshal
 
 from .schemas import HEARTBEAT_SCHEMA, DEVICE_SCHEMA, SYSINFO_SCHEMA, \
-    SENSOR_STATUS, CAMERA_STATUS, COMMAND_SCHEMA, \
-    add_models_to_namespace
+    SENSOR_STATUS, CAMERA_STATUS, COMMAND_SCHEMA, DEVICE_COMMAND_SCHEMA, \
+    COMMAND_PENDING_SCHEMA, QUEUED_COMMAND_SCHEMA, DEVICE_SUMMARY_SCHEMA, \
+    LOCATION_SUMMARY_SCHEMA, FLEET_SUMMARY_SCHEMA, add_models_to_namespace
 import src.app.model as model
+from src.app.model.utils import notify
+from src.app.model.utils.paginate import PaginationError
 from src.utils.exceptions import JaxMBAControlServiceException
 from src.utils.logging import get_module_logger
-from .utils.device_command import get_device_response
+from .utils.device_cache import DeviceSnapshotCache
+from .utils.device_command import get_device_response, get_device_responses
+from .utils.etag import make_etag, not_modified, etag_header
+from .utils.pagination import add_cursor_args, decode_cursor, encode_cursor
+from .utils.payload import CompiledValidator, parse_timestamp
+from .utils.ttl_cache import TTLCache
 
 NS = Namespace('device',
                description='Endpoints for interacting with devices')
@@ -23,12 +33,88 @@ models = [
     SYSINFO_SCHEMA,
     SENSOR_STATUS,
     CAMERA_STATUS,
-    COMMAND_SCHEMA
+    QUEUED_COMMAND_SCHEMA,
+    COMMAND_SCHEMA,
+    DEVICE_COMMAND_SCHEMA,
+    COMMAND_PENDING_SCHEMA,
+    DEVICE_SUMMARY_SCHEMA,
+    LOCATION_SUMMARY_SCHEMA,
+    FLEET_SUMMARY_SCHEMA
 ]
 NS = add_models_to_namespace(NS, models)
 
 LOGGER = get_module_logger()
 
+# heartbeats are validated with precompiled validators rather than by
+# flask_restplus (validate=True), which rebuilds its validator on every request
+HEARTBEAT_VALIDATOR = CompiledValidator(HEARTBEAT_SCHEMA)
+HEARTBEATS_VALIDATOR = CompiledValidator(HEARTBEAT_SCHEMA, as_list=True)
+
+# pre-rendered devices used to answer (frequently polled) device list requests
+DEVICE_CACHE = DeviceSnapshotCache(DEVICE_SCHEMA)
+
+DEVICE_LIST_PARSER = add_cursor_args(reqparse.RequestParser(),
+                                     default_limit=None)
+DEVICE_LIST_PARSER.add_argument(
+    'recording', type=inputs.boolean, default=False,
+    help="only list devices whose camera is recording")
+DEVICE_LIST_PARSER.add_argument(
+    'state', choices=[s.name for s in model.Device.State],
+    help="only list devices in this state")
+DEVICE_LIST_PARSER.add_argument(
+    'location', type=str,
+    help="only list devices whose location starts with this prefix")
+DEVICE_LIST_PARSER.add_argument(
+    'session_id', type=int,
+    help="only list devices assigned to this recording session")
+
+# maximum number of devices returned by one request to the device list
+MAX_DEVICE_PAGE_SIZE = 1000
+# devices per page when a cursor is given without a limit. Without either the
+# whole list is returned, as before the list was paginated
+DEVICE_PAGE_SIZE = 100
+
+# fleet summaries, polled by dashboards, are computed at most once every
+# SUMMARY_TTL seconds by each process
+SUMMARY_CACHE = TTLCache()
+
+SUMMARY_PARSER = reqparse.RequestParser()
+SUMMARY_PARSER.add_argument(
+    'by_location', type=inputs.boolean, default=False,
+    help="also summarize the devices of each location")
+
+COMMAND_WAIT_PARSER = reqparse.RequestParser()
+COMMAND_WAIT_PARSER.add_argument(
+    'wait', type=int, default=30,
+    help="maximum number of seconds to wait for a command")
+
+
+def heartbeat_values(data):
+    """
+    convert a heartbeat payload into the keyword arguments expected by
+    Device.update_from_heartbeat()
+    :param data: heartbeat payload
+    :return: dictionary of device attributes
+    """
+    try:
+        timestamp = parse_timestamp(data['timestamp'])
+    except ValueError:
+        abort(400, f"unable to parse timestamp: {data['timestamp']}")
+
+    return {
+        'name': data['name'],
+        'last_update': timestamp,  # pylint: disable=E0601
+        'uptime': data['system_info']['uptime'],
+        'total_ram': data['system_info']['total_ram'],
+        'free_ram': data['system_info']['free_ram'],
+        'load': data['system_info']['load'],
+        'sensor_status': data['sensor_status'],
+        'total_disk': data['system_info']['total_disk'],
+        'free_disk': data['system_info']['free_disk'],
+        'release': data['system_info']['release'],
+        'location': data.get('location')
+    }
+
 
 @NS.route('/heartbeat')
 class DeviceHeartbeat(Resource):
@@ -36,34 +122,111 @@ class DeviceHeartbeat(Resource):
 
     @NS.response(200, "success, no action")
     @NS.response(204, "success, action")
-    @NS.expect(HEARTBEAT_SCHEMA, validate=True)
+    @NS.expect(HEARTBEAT_SCHEMA, validate=False)
     @NS.marshal_with(COMMAND_SCHEMA)
     def post(self):
         data = NS.payload
+        HEARTBEAT_VALIDATOR.validate(data)
         device = None
+        values = heartbeat_values(data)
+
         try:
-            timestamp = dateutil.parser.parse(data['timestamp'])
-        except ValueError:
-            abort(400, f"unable to parse timestamp: {data['timestamp']}")
+            device = model.Device.update_from_heartbeat(**values)
+        except JaxMBAControlServiceException as err:
+            abort(400, f"error processing heartbeat {err}")
 
+        # the heartbeat is processed as one unit of work, any changes made
+        # while determining the response are committed together
+        response = get_device_response(device, data)
         try:
-            device = model.Device.update_from_heartbeat(
-                name=data['name'],
-                last_update=timestamp,  # pylint: disable=E0601
-                uptime=data['system_info']['uptime'],
-                total_ram=data['system_info']['total_ram'],
-                free_ram=data['system_info']['free_ram'],
-                load=data['system_info']['load'],
-                sensor_status=json.dumps(data['sensor_status']),
-                total_disk=data['system_info']['total_disk'],
-                free_disk=data['system_info']['free_disk'],
-                release=data['system_info']['release'],
-                location=data.get('location')
-            )
+            model.Device.finish_heartbeat(device)
         except JaxMBAControlServiceException as err:
             abort(400, f"error processing heartbeat {err}")
 
-        return get_device_response(device, data)
+        return response
+
+
+@NS.route('/heartbeats')
+class DeviceHeartbeats(Resource):
+    """ Endpoint for batches of device heartbeats """
+
+    @NS.response(200, "success")
+    @NS.expect([HEARTBEAT_SCHEMA], validate=False)
+    @NS.marshal_with(DEVICE_COMMAND_SCHEMA, as_list=True)
+    def post(self):  # pylint: disable=R0201
+        """
+        process heartbeats from multiple devices in a single request
+
+        This is intended for gateways or relays that collect heartbeats from
+        several devices. The payload is a list of heartbeat messages, the
+        response is a list containing one command per heartbeat, in the same
+        order. command_name is null for devices that have no pending command.
+        The whole batch is processed in a single database transaction.
+        """
+        payloads = NS.payload
+        HEARTBEATS_VALIDATOR.validate(payloads)
+        values = [heartbeat_values(data) for data in payloads]
+
+        try:
+            devices = model.Device.update_from_heartbeats(values)
+        except JaxMBAControlServiceException as err:
+            abort(400, f"error processing heartbeats {err}")
+
+        responses = get_device_responses(devices, payloads)
+        try:
+            model.Device.finish_heartbeats(devices)
+        except JaxMBAControlServiceException as err:
+            abort(400, f"error processing heartbeats {err}")
+
+        return responses
+
+
+@NS.route('/<string:name>/commands')
+class DeviceCommands(Resource):
+    """ Endpoint for devices to long-poll for new commands """
+
+    @NS.response(200, "a command is pending", COMMAND_PENDING_SCHEMA)
+    @NS.response(204, "no command became pending before the wait expired")
+    @NS.response(404, "device not found or long-polling is disabled")
+    @NS.expect(COMMAND_WAIT_PARSER)
+    def get(self, name):  # pylint: disable=R0201
+        """
+        wait for a command to become pending for a device
+
+        Commands are still delivered in the response to a heartbeat. A device
+        can keep a request to this endpoint open between heartbeats, when it
+        returns 200 the device should send a heartbeat immediately rather than
+        waiting for its heartbeat interval. The wait is limited to MAX_WAIT
+        in the [COMMANDS] section of the config file.
+        """
+        if not current_app.config['COMMAND_LONG_POLL']:
+            abort(404, "command long-polling is not enabled")
+
+        args = COMMAND_WAIT_PARSER.parse_args()
+        device = model.Device.get_by_name(name)
+        if not device:
+            abort(404, f"Device {name} Not Found")
+        device_id = device.id
+
+        # a command may have been queued before the wait started, and its
+        # notification missed (it expired, or was sent to another process).
+        # A START held back until the device's wave doesn't count, the
+        # device would only be sent nothing
+        status = device.active_status
+        held = status is not None and \
+            status.status == model.DeviceRecordingStatus.Status.PENDING and \
+            not device.recording_session.can_start(status)
+        pending = device.has_pending_commands() and not held
+
+        # don't hold on to a database connection while waiting
+        model.SESSION.remove()
+        if pending:
+            return {'pending': True}, 200
+
+        timeout = max(0, min(args['wait'], current_app.config['COMMAND_MAX_WAIT']))
+        if notify.wait(device_id, timeout):
+            return {'pending': True}, 200
+        return '', 204
 
 
 @NS.route('')
@@ -72,13 +235,95 @@ class DeviceList(Resource):
 
     @jwt_required
     @NS.doc(security='JWT Access')
-    @NS.marshal_with(DEVICE_SCHEMA, as_list=True)
+    @NS.expect(DEVICE_LIST_PARSER)
+    @NS.response(304, "no device has changed (If-None-Match)")
+    @NS.response(200, "success", [DEVICE_SCHEMA],
+                 headers={'X-Next-Cursor': "cursor for the next page, only "
+                                           "sent if there are more devices"})
+    @NS.response(400, "invalid cursor or filter")
     def get(self):
         """
         get list of known devices
 
+        Devices are listed in name order. Without a limit or cursor every
+        device is listed, otherwise limit at a time (100 by default). If there
+        are more devices the X-Next-Cursor response header contains a cursor
+        that returns the next page when passed as the cursor argument, along
+        with the same filters.
+
+        Responses include an ETag. Send it back in If-None-Match to get a 304
+        response if no device has changed.
         """
-        return model.Device.get_devices()
+        args = DEVICE_LIST_PARSER.parse_args()
+        etag = make_etag('device-list', model.Device.get_version(),
+                         sorted(args.items()))
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+
+        after = decode_cursor(args['cursor'])
+        if after is not None and not isinstance(after, str):
+            abort(400, f"invalid cursor: {args['cursor']}")
+        filters = {
+            'state': model.Device.State[args['state']] if args['state'] else None,
+            'location': args['location'],
+            'session_id': args['session_id'],
+            'recording': args['recording']
+        }
+
+        limit = args['limit']
+        if limit is None and after is not None:
+            limit = DEVICE_PAGE_SIZE
+        try:
+            page = model.Device.get_versions(
+                after, limit, max_limit=MAX_DEVICE_PAGE_SIZE, **filters)
+        except PaginationError as err:
+            abort(400, str(err))
+
+        complete = after is None and not page.has_next and \
+            not any(filters.values())
+        response = Response(DEVICE_CACHE.render(page.items, complete),
+                            mimetype='application/json')
+        if page.has_next:
+            response.headers['X-Next-Cursor'] = encode_cursor(page.next_key)
+        response.set_etag(etag)
+        return response
+
+
+def compute_summary(by_location):
+    """
+    compute and render the fleet summary
+    :param by_location: also summarize each location
+    :return: summary marshaled with FLEET_SUMMARY_SCHEMA
+    """
+    start = time.perf_counter()
+    summary = model.Device.get_summary(by_location)
+    summary['computed_at'] = datetime.utcnow()
+    summary['compute_time'] = (time.perf_counter() - start) * 1000
+    return marshal(summary, FLEET_SUMMARY_SCHEMA)
+
+
+@NS.route('/summary')
+class Summary(Resource):
+    """ Endpoint for a summary of the whole fleet of devices """
+
+    @jwt_required
+    @NS.doc(security='JWT Access')
+    @NS.expect(SUMMARY_PARSER)
+    @NS.response(200, "success", FLEET_SUMMARY_SCHEMA)
+    def get(self):  # pylint: disable=R0201
+        """
+        get the number of devices in each state, the number recording and the
+        total and free disk space of all devices
+
+        The summary is computed with a single aggregate query and cached for
+        SUMMARY_TTL seconds, so it can be polled frequently. computed_at and
+        compute_time tell how old the summary is and how long it took.
+        """
+        by_location = SUMMARY_PARSER.parse_args()['by_location']
+        return SUMMARY_CACHE.get(by_location,
+                                 current_app.config['SUMMARY_TTL'],
+                                 lambda: compute_summary(by_location))
 
 
 @NS.route('/<int:device_id>')
@@ -87,12 +332,23 @@ class ByID(Resource):
 
     @jwt_required
     @NS.doc(security='JWT Access')
+    @NS.response(200, "success", DEVICE_SCHEMA)
+    @NS.response(304, "device has not changed (If-None-Match)")
     @NS.response(404, "Device not found")
-    @NS.marshal_with(DEVICE_SCHEMA)
     def get(self, device_id):
         """ get a Device by ID """
+        version = model.Device.get_device_version(device_id)
+        if version is None:
+            abort(404, f"Device {device_id} Not Found")
+        etag = make_etag('device', *version)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+
         device = model.Device.get_by_id(device_id)
-        return device if device else abort(404, f"Device {device_id} Not Found")
+        if not device:
+            abort(404, f"Device {device_id} Not Found")
+        return marshal(device, DEVICE_SCHEMA), 200, etag_header(etag)
 
 
 @NS.route('/<string:name>')
@@ -0,0 +1,83 @@
+"""
+controller for the Server-Sent Events stream of device and session changes
+"""
+import json
+
+from flask import current_app, Response
+from flask_jwt_extended import jwt_required
+from flask_restplus import Resource, Namespace, abort
+
+import src.app.model as model
+from src.app.model.utils import notify
+
+NS = Namespace('events',
+               description='Server-Sent Events stream of state changes')
+
+
+def format_event(event):
+    """
+    :param event: event published by the model (see src.app.model.events)
+    :return: the event in text/event-stream format
+    """
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+def stream_events(subscription, keep_alive):
+    """
+    generate the event stream for a subscription, until the client
+    disconnects or the subscription overflows
+    :param subscription: notify.Subscription
+    :param keep_alive: seconds between comments sent while nothing happens
+    """
+    try:
+        while True:
+            events = subscription.get(keep_alive)
+            if subscription.overflowed:
+                yield format_event({'event': 'reset', 'data': {}})
+                return
+            if events:
+                yield "".join(format_event(e) for e in events)
+            else:
+                # lets the client and any proxies know the stream is alive,
+                # and finds out if the client went away
+                yield ": keep-alive\n\n"
+    finally:
+        subscription.close()
+
+
+@NS.route('')
+class Events(Resource):
+    """ Endpoint for subscribing to state changes """
+
+    @jwt_required
+    @NS.doc(security='JWT Access')
+    @NS.response(200, "text/event-stream of changes")
+    @NS.response(404, "the event stream is disabled")
+    def get(self):  # pylint: disable=R0201
+        """
+        stream device state transitions, device session status changes and
+        recording session status changes as they happen
+
+        The response is a text/event-stream with 'device' events (id, name,
+        state and session_id of a device whose state changed between IDLE,
+        BUSY and DOWN), 'device_status' events (device_id, session_id, status
+        and message) and 'session' events (id and status). Events carry the
+        new state and may be repeated. A 'reset' event means the client fell
+        too far behind and the stream is closed: get the current state, for
+        example from /api/changes, and subscribe again.
+
+        Each open stream holds a worker thread. The stream is enabled with
+        ENABLED in the [EVENTS] section of the config file.
+        """
+        config = current_app.config
+        if not config['EVENTS_ENABLED']:
+            abort(404, "the event stream is not enabled")
+
+        # don't hold on to a database connection while streaming
+        model.SESSION.remove()
+
+        subscription = notify.subscribe(config['EVENTS_QUEUE_SIZE'])
+        return Response(stream_events(subscription, config['EVENTS_KEEP_ALIVE']),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
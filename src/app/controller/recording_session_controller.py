@@ -2,12 +2,20 @@
 controller for interacting with recording sessions through the API
 """
 
-from flask_restplus import Resource, Namespace, reqparse, abort, inputs
+from flask import current_app
+from flask_restplus import Resource, Namespace, reqparse, abort, inputs, \
+    marshal
 from flask_jwt_extended import jwt_required
 
 import src.app.model as model
 from .schemas import RECORDING_SESSION_SCHEMA, DEVICE_SESSION_STATUS, \
-    NEW_RECORDING_SESSION_SCHEMA, DEVICE_SPECIFICATION_SCHEMA, add_models_to_namespace
+    NEW_RECORDING_SESSION_SCHEMA, DEVICE_SPECIFICATION_SCHEMA, \
+    RECORDING_SESSION_SUMMARY_SCHEMA, SESSION_STATUS_COUNTS_SCHEMA, \
+    BULK_SESSION_ACTION_SCHEMA, BULK_SESSION_RESULT_SCHEMA, \
+    START_WAVES_SCHEMA, add_models_to_namespace
+from .utils.etag import make_etag, not_modified, tagged, time_bucket
+from .utils.pagination import add_cursor_args, decode_cursor, encode_cursor
+from src.app.model.utils.paginate import PaginationError
 
 NS = Namespace('recording-session',
                description='Endpoints for interacting with recording sessions')
@@ -16,39 +24,127 @@ __schemas = [
     RECORDING_SESSION_SCHEMA,
     DEVICE_SESSION_STATUS,
     NEW_RECORDING_SESSION_SCHEMA,
-    DEVICE_SPECIFICATION_SCHEMA
+    DEVICE_SPECIFICATION_SCHEMA,
+    RECORDING_SESSION_SUMMARY_SCHEMA,
+    SESSION_STATUS_COUNTS_SCHEMA,
+    BULK_SESSION_ACTION_SCHEMA,
+    BULK_SESSION_RESULT_SCHEMA,
+    START_WAVES_SCHEMA
 ]
 
 NS = add_models_to_namespace(NS, __schemas)
 
+# device columns marshaled by DEVICE_SCHEMA, the only ones loaded with the
+# devices of a recording session's statuses
+SESSION_DEVICE_COLUMNS = (
+    'name', 'location', 'sensor_status', 'uptime', 'load', 'total_ram',
+    'free_ram', 'free_disk', 'total_disk', 'release', 'last_update',
+    'session_id', 'down_since'
+)
+
+
+# maximum number of archived sessions returned by one request
+MAX_ARCHIVED_PAGE_SIZE = 500
+
+
+def load_statuses():
+    """ loader option for marshaling sessions with RECORDING_SESSION_SCHEMA """
+    return model.RecordingSession.load_statuses(SESSION_DEVICE_COLUMNS)
+
 
 @NS.route('')
 class RecordingSession(Resource):
     """ Endpoint for recording sessions """
 
-    get_parser = reqparse.RequestParser(bundle_errors=True)
+    get_parser = add_cursor_args(reqparse.RequestParser(bundle_errors=True))
     get_parser.add_argument(
         'archived', type=inputs.boolean, location='args', default=False,
         help=("If True get archived recording sessions.")
     )
+    get_parser.add_argument(
+        'summary', type=inputs.boolean, location='args', default=False,
+        help="If True list the number of devices in each status instead of "
+             "the device statuses")
+    get_parser.add_argument(
+        'name', type=str, location='args',
+        help="only list archived sessions whose name contains this")
+    get_parser.add_argument(
+        'created_after', type=inputs.datetime_from_iso8601, location='args',
+        help="only list archived sessions created at or after this time")
+    get_parser.add_argument(
+        'created_before', type=inputs.datetime_from_iso8601, location='args',
+        help="only list archived sessions created before this time")
+    get_parser.add_argument(
+        'device_id', type=int, location='args',
+        help="only list archived sessions this device was part of")
 
     @jwt_required
     @NS.doc(security='JWT Access')
-    @NS.marshal_with(RECORDING_SESSION_SCHEMA, as_list=True)
+    @NS.response(200, "success", [RECORDING_SESSION_SCHEMA],
+                 headers={'X-Next-Cursor': "cursor for the next page of "
+                                           "archived sessions, only sent if "
+                                           "there are more"})
+    @NS.response(304, "no recording session has changed (If-None-Match)")
+    @NS.response(400, "invalid cursor or filter")
     @NS.expect(get_parser)
     def get(self):
         """
         get a list of recording sessions
+
+        With summary=true each session has the number of its devices in each
+        status instead of the device statuses (see
+        RECORDING_SESSION_SUMMARY_SCHEMA), which is read from the session
+        without loading its devices.
+
+        Sessions that aren't archived are all listed, newest first. Archived
+        sessions are listed newest first, limit at a time, and can be
+        filtered by name, creation time and device. If there are more
+        archived sessions the X-Next-Cursor response header contains a cursor
+        that returns the next page when passed as the cursor argument, along
+        with the same filters.
+
+        Responses include an ETag. Send it back in If-None-Match to get a 304
+        response if nothing has changed.
         """
 
         args = RecordingSession.get_parser.parse_args()
 
-        model.RecordingSession.check_for_complete()
-
-        if args['archived'] is True:
-            return model.RecordingSession.get_archived()
+        # the version is read before the sessions, so a response is never
+        # tagged with a newer version than the data it contains
+        version = model.Device.get_version(model.RecordingSession.live_since(
+            archived=args['archived'] is True))
+        etag = make_etag('session-list', version, time_bucket(version[-1]),
+                         sorted(args.items()))
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+
+        if args['summary']:
+            schema, options = RECORDING_SESSION_SUMMARY_SCHEMA, []
         else:
-            return model.RecordingSession.get()
+            schema, options = RECORDING_SESSION_SCHEMA, [load_statuses()]
+
+        if args['archived'] is not True:
+            sessions = model.RecordingSession.get(*options)
+            return tagged(marshal(sessions, schema), etag)
+
+        after = decode_cursor(args['cursor'])
+        if after is not None and not isinstance(after, int):
+            abort(400, f"invalid cursor: {args['cursor']}")
+        try:
+            page = model.RecordingSession.get_archived(
+                *options, after=after, limit=args['limit'],
+                max_limit=MAX_ARCHIVED_PAGE_SIZE, name=args['name'],
+                created_after=args['created_after'],
+                created_before=args['created_before'],
+                device_id=args['device_id'])
+        except PaginationError as err:
+            abort(400, str(err))
+
+        headers = {}
+        if page.has_next:
+            headers['X-Next-Cursor'] = encode_cursor(page.next_key[1])
+        return tagged(marshal(page.items, schema), etag, headers)
 
     @jwt_required
     @NS.doc(security='JWT Access')
@@ -57,28 +153,76 @@ class RecordingSession(Resource):
     def post(self):
         """
         create new recording session
+
+        With start_wave_size, devices are sent their START command
+        start_wave_size at a time, every start_wave_interval seconds
+        (START_WAVE_INTERVAL in the config file by default), instead of all
+        at once. start_waves in the response shows how many waves have been
+        reached and when the next one is.
         """
         data = NS.payload
 
-        bad_ids = []
-        device_spec = []
+        fragment = data.get('fragment_hourly')
+
+        wave_interval = None
+        if data.get('start_wave_size'):
+            wave_interval = data.get('start_wave_interval') or \
+                current_app.config['START_WAVE_INTERVAL']
 
-        # check to see if the IDs are invalid
-        for dev in data['device_spec']:
-            if model.Device.get_by_id(dev['device_id']) is None:
-                bad_ids.append(dev['device_id'])
-            else:
-                device_spec.append(dev)
-        if len(bad_ids) > 0:
-            abort(400, f"Invalid device IDs: {bad_ids}")
+        try:
+            session = model.RecordingSession.create(
+                data['device_spec'], data['duration'], data['name'], fragment,
+                data['target_fps'], data['apply_filter'],
+                start_wave_size=data.get('start_wave_size'),
+                start_wave_interval=wave_interval)
+        except model.UnknownDeviceException as err:
+            abort(400, str(err))
+        return model.RecordingSession.get_by_id(session.id, load_statuses())
 
-        fragment = data.get('fragment_hourly')
 
-        session = model.RecordingSession.create(device_spec, data['duration'],
-                                                data['name'], fragment,
-                                                data['target_fps'],
-                                                data['apply_filter'])
-        return session
+@NS.route('/bulk')
+class RecordingSessionBulk(Resource):
+    """ Endpoint for canceling and archiving many recording sessions """
+
+    @jwt_required
+    @NS.doc(security='JWT Access')
+    @NS.expect(BULK_SESSION_ACTION_SCHEMA, validate=True)
+    @NS.response(400, "invalid filter, or no sessions or action given")
+    @NS.marshal_with(BULK_SESSION_RESULT_SCHEMA)
+    def post(self):  # pylint: disable=R0201
+        """
+        cancel and/or archive the recording sessions in session_ids, or that
+        match the filters (e.g. every COMPLETE session created before a
+        date), in a single transaction
+
+        Canceling only affects sessions that are IN_PROGRESS, and queues a
+        STOP command for their devices that are still PENDING or RECORDING.
+        Returns the number of sessions that matched, and that were canceled
+        and archived, and the number of devices stopped.
+        """
+        data = NS.payload
+
+        filters = {}
+        for name in ('created_after', 'created_before'):
+            if data.get(name) is not None:
+                try:
+                    filters[name] = inputs.datetime_from_iso8601(data[name])
+                except ValueError:
+                    abort(400, f"invalid {name}: {data[name]}")
+        if data.get('status') is not None:
+            filters['status'] = model.RecordingSession.Status[data['status']]
+        for name in ('name', 'device_id'):
+            if data.get(name) is not None:
+                filters[name] = data[name]
+
+        if data.get('session_ids') is None and not filters:
+            abort(400, "session_ids or a filter is required")
+        if not data.get('cancel') and not data.get('archive'):
+            abort(400, "cancel and/or archive is required")
+
+        return model.RecordingSession.cancel_and_archive(
+            cancel=data.get('cancel'), archive=data.get('archive'),
+            session_ids=data.get('session_ids'), **filters)
 
 
 @NS.route('/<int:session_id>')
@@ -87,13 +231,26 @@ class RecordingSessionByID(Resource):
 
     @jwt_required
     @NS.doc(security='JWT Access')
+    @NS.response(200, "success", RECORDING_SESSION_SCHEMA)
+    @NS.response(304, "recording session has not changed (If-None-Match)")
     @NS.response(404, "Recording session not found")
-    @NS.marshal_with(RECORDING_SESSION_SCHEMA)
     def get(self, session_id):
         """
         return a recording session with a give session ID
         """
-        return model.RecordingSession.get_by_id(session_id)
+        version = model.Device.get_version(
+            model.RecordingSession.live_since(session_id))
+        etag = make_etag('session', session_id, version,
+                         time_bucket(version[-1]))
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+
+        session = model.RecordingSession.get_by_id(session_id,
+                                                   load_statuses())
+        if session is None:
+            abort(404, "recording session not found")
+        return tagged(marshal(session, RECORDING_SESSION_SCHEMA), etag)
 
     delete_parser = reqparse.RequestParser(bundle_errors=True)
     delete_parser.add_argument(
@@ -127,6 +284,49 @@ class RecordingSessionByID(Resource):
         return "", 204
 
 
+SESSION_DEVICES_PARSER = reqparse.RequestParser(bundle_errors=True)
+SESSION_DEVICES_PARSER.add_argument(
+    'status', action='append', location='args',
+    choices=[s.name for s in model.DeviceRecordingStatus.Status],
+    help="only list devices in this status, may be repeated")
+
+
+@NS.route('/<int:session_id>/devices')
+class RecordingSessionDevices(Resource):
+    """ Endpoint for the device statuses of a recording session """
+
+    @jwt_required
+    @NS.doc(security='JWT Access')
+    @NS.expect(SESSION_DEVICES_PARSER)
+    @NS.response(200, "success", [DEVICE_SESSION_STATUS])
+    @NS.response(304, "recording session has not changed (If-None-Match)")
+    @NS.response(404, "Recording session not found")
+    def get(self, session_id):  # pylint: disable=R0201
+        """
+        list the devices of a recording session with their status, in device
+        name order, optionally only those in the given statuses (e.g.
+        ?status=FAILED), without the rest of the session
+        """
+        args = SESSION_DEVICES_PARSER.parse_args()
+        statuses = [model.DeviceRecordingStatus.Status[s]
+                    for s in args['status'] or []]
+        version = model.Device.get_version(
+            model.RecordingSession.live_since(session_id))
+        etag = make_etag('session-devices', session_id, version,
+                         time_bucket(version[-1]),
+                         sorted(s.name for s in statuses))
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+
+        device_statuses = model.DeviceRecordingStatus.get_for_session(
+            session_id, statuses, SESSION_DEVICE_COLUMNS)
+        if not device_statuses and \
+                model.RecordingSession.get_by_id(session_id) is None:
+            abort(404, "recording session not found")
+        return tagged(marshal(device_statuses, DEVICE_SESSION_STATUS), etag)
+
+
 @NS.route('/<int:session_id>/device-status/<int:device_id>')
 class RecordingSessionDeviceStatus(Resource):
     """ Endpoint for getting a device's status for a session """
@@ -2,6 +2,7 @@ from .heartbeat import *
 from .device import *
 from .recording_sesson import *
 from .device_command import *
+from .changes import *
 
 
 def add_models_to_namespace(namespace, models):
@@ -0,0 +1,75 @@
+"""
+schemas of the changes feed (GET /api/changes)
+"""
+from flask_restplus import fields, Model
+from .device import DEVICE_SCHEMA
+from .recording_sesson import RECORDING_SESSION_BASE_SCHEMA
+
+__all__ = [
+    'CHANGED_SESSION_SCHEMA',
+    'CHANGED_DEVICE_STATUS_SCHEMA',
+    'CHANGES_SCHEMA'
+]
+
+CHANGED_SESSION_SCHEMA = RECORDING_SESSION_BASE_SCHEMA.clone('changed_session', {
+    'id': fields.Integer(
+        description="session ID"
+    ),
+    'creation_time': fields.DateTime(
+        description="iso8601 formatted datetime"
+    ),
+    'status': fields.String(
+        attribute=lambda s: s.status.name,
+        description="session status"
+    ),
+    'archived': fields.Boolean(
+        description="True if the session has been archived"
+    )
+})
+
+CHANGED_DEVICE_STATUS_SCHEMA = Model('changed_device_status', {
+    'device_id': fields.Integer(
+        description="device ID"
+    ),
+    'session_id': fields.Integer(
+        description="recording session ID"
+    ),
+    'filename_prefix': fields.String(
+        attribute='file_prefix',
+        description="filename prefix"
+    ),
+    'recording_time': fields.Integer(
+        description="how long (in seconds) the device has recorded as part of this session. "
+                    "while RECORDING it increases without the status changing"
+    ),
+    'recording_started': fields.DateTime(
+        description="when the device started recording as part of this session, "
+                    "null until it joins the session"
+    ),
+    'status': fields.String(
+        attribute=lambda s: s.status.name,
+        description="Status as a string (e.g. 'RECORDING', 'FAILED', 'COMPLETE', ...)"
+    ),
+    'message': fields.String(
+        description="additional status information. always set for FAILED."
+    )
+})
+
+CHANGES_SCHEMA = Model('changes', {
+    'cursor': fields.String(
+        required=True,
+        description="pass as since to get the changes made after these"
+    ),
+    'devices': fields.List(
+        fields.Nested(DEVICE_SCHEMA),
+        description="devices that changed, including devices that went DOWN"
+    ),
+    'recording_sessions': fields.List(
+        fields.Nested(CHANGED_SESSION_SCHEMA),
+        description="recording sessions that changed"
+    ),
+    'device_statuses': fields.List(
+        fields.Nested(CHANGED_DEVICE_STATUS_SCHEMA),
+        description="device session statuses that changed"
+    )
+})
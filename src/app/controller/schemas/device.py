@@ -1,12 +1,14 @@
 from flask_restplus import fields, Model
-import json
 
 __all__ = [
     'SYSINFO_SCHEMA',
     'CAMERA_STATUS',
     'SENSOR_STATUS',
     'DEVICE_SCHEMA',
-    'DEVICE_BASE_SCHEMA'
+    'DEVICE_BASE_SCHEMA',
+    'DEVICE_SUMMARY_SCHEMA',
+    'LOCATION_SUMMARY_SCHEMA',
+    'FLEET_SUMMARY_SCHEMA'
 ]
 
 SYSINFO_SCHEMA = Model('sysinfo', {
@@ -71,9 +73,7 @@ DEVICE_BASE_SCHEMA = Model('device_base', {
     'location': fields.String(
         description="location of device"
     ),
-    'sensor_status': fields.Nested(SENSOR_STATUS, required=True,
-                                   attribute=lambda d: json.loads(
-                                       d.sensor_status)),
+    'sensor_status': fields.Nested(SENSOR_STATUS, required=True),
     'system_info': fields.Nested(SYSINFO_SCHEMA, required=True,
                                  attribute=lambda d: {
                                      'uptime': d.uptime,
@@ -92,6 +92,10 @@ DEVICE_SCHEMA = DEVICE_BASE_SCHEMA.clone('device', {
     'session_id': fields.Integer(
         description="session ID of active recording session, null otherwise"
     ),
+    'down_since': fields.DateTime(
+        description="when the device went DOWN, null while it is up. Set "
+                    "shortly after the device goes DOWN"
+    ),
     'state': fields.String(
         enum=['IDLE', 'BUSY', 'DOWN'], required=True,
         attribute=lambda d: d.state().name,
@@ -99,4 +103,52 @@ DEVICE_SCHEMA = DEVICE_BASE_SCHEMA.clone('device', {
                      "recording), IDLE, or DOWN "
                      "(hasn't sent status update within expected time)"),
     )
-})
\ No newline at end of file
+})
+
+DEVICE_SUMMARY_SCHEMA = Model('device_summary', {
+    'devices': fields.Integer(required=True, description="number of devices"),
+    'idle': fields.Integer(required=True, description="IDLE devices"),
+    'busy': fields.Integer(required=True, description="BUSY devices"),
+    'down': fields.Integer(required=True, description="DOWN devices"),
+    'recording': fields.Integer(
+        required=True,
+        description="devices recording for their recording session"
+    ),
+    'pending': fields.Integer(
+        required=True,
+        description="devices that haven't started recording for their "
+                    "recording session yet"
+    ),
+    'camera_recording': fields.Integer(
+        required=True,
+        description="devices whose camera reports it is recording"
+    ),
+    'total_disk': fields.Integer(
+        required=True,
+        description="total disk space of the devices in megabytes"
+    ),
+    'free_disk': fields.Integer(
+        required=True,
+        description="free disk space of the devices in megabytes"
+    )
+})
+
+LOCATION_SUMMARY_SCHEMA = DEVICE_SUMMARY_SCHEMA.clone('location_summary', {
+    'location': fields.String(description="location of the devices")
+})
+
+FLEET_SUMMARY_SCHEMA = Model('fleet_summary', {
+    'computed_at': fields.DateTime(
+        required=True,
+        description="time the summary was computed, it is cached briefly"
+    ),
+    'compute_time': fields.Float(
+        required=True,
+        description="milliseconds it took to compute the summary"
+    ),
+    'total': fields.Nested(DEVICE_SUMMARY_SCHEMA, required=True),
+    'locations': fields.List(
+        fields.Nested(LOCATION_SUMMARY_SCHEMA),
+        description="summary of each location, only if by_location is set"
+    )
+})
@@ -1,9 +1,27 @@
 from flask_restplus import fields, Model
 
 __all__ = [
-    'COMMAND_SCHEMA'
+    'QUEUED_COMMAND_SCHEMA',
+    'COMMAND_SCHEMA',
+    'DEVICE_COMMAND_SCHEMA',
+    'COMMAND_PENDING_SCHEMA'
 ]
 
+QUEUED_COMMAND_SCHEMA = Model('queued_command', {
+    'seq': fields.Integer(
+        required=True,
+        description="command sequence number, acknowledged with ack_seq"
+    ),
+    'command_name': fields.String(
+        required=True,
+        attribute=lambda c: c.name.value,
+        description="command name"
+    ),
+    'parameters': fields.String(
+        description="command parameters; JSON object specific to command type"
+    )
+})
+
 COMMAND_SCHEMA = Model('command', {
     'command_name': fields.String(
         required=True,
@@ -11,5 +29,29 @@ COMMAND_SCHEMA = Model('command', {
     ),
     'parameters': fields.String(
         description="command parameters; JSON object specific to command type"
+    ),
+    'commands': fields.List(
+        fields.Nested(QUEUED_COMMAND_SCHEMA),
+        description=("all queued commands the device hasn't acknowledged, in "
+                     "order. Only sent to devices that send ack_seq, "
+                     "command_name and parameters are those of the first one")
+    )
+})
+
+DEVICE_COMMAND_SCHEMA = COMMAND_SCHEMA.clone('device_command', {
+    'name': fields.String(
+        required=True,
+        description="name of the device the command is for"
+    ),
+    'command_name': fields.String(
+        description="command name, null if there is no command for the device"
+    )
+})
+
+COMMAND_PENDING_SCHEMA = Model('command_pending', {
+    'pending': fields.Boolean(
+        required=True,
+        description=("a command is pending, the device should send a "
+                     "heartbeat now to receive it")
     )
 })
@@ -13,5 +13,11 @@ HEARTBEAT_SCHEMA = DEVICE_BASE_SCHEMA.clone('heartbeat', {
     ),
     'err_msg': fields.String(
         description="optional error message if the device was unable to process the last command"
+    ),
+    'ack_seq': fields.Integer(
+        description=("sequence number of the last queued command the device "
+                     "received. Devices that send this get commands from "
+                     "their command queue, see the commands field of the "
+                     "response")
     )
 })
@@ -6,6 +6,11 @@ __all__ = [
     'RECORDING_SESSION_BASE_SCHEMA',
     'NEW_RECORDING_SESSION_SCHEMA',
     'RECORDING_SESSION_SCHEMA',
+    'RECORDING_SESSION_SUMMARY_SCHEMA',
+    'SESSION_STATUS_COUNTS_SCHEMA',
+    'START_WAVES_SCHEMA',
+    'BULK_SESSION_ACTION_SCHEMA',
+    'BULK_SESSION_RESULT_SCHEMA',
     'DEVICE_SPECIFICATION_SCHEMA'
 ]
 
@@ -20,12 +25,19 @@ DEVICE_SESSION_STATUS = Model('device_session_status', {
     'recording_time': fields.Integer(
         description="how long (in seconds) the device has recorded as part of this session"
     ),
+    'recording_started': fields.DateTime(
+        description="when the device started recording as part of this session, "
+                    "null until it joins the session"
+    ),
     'status': fields.String(
         attribute=lambda s: s.status.name,
         description="Status as a string (e.g. 'RECORDING', 'FAILED', 'COMPLETE', ...)"
     ),
     'message': fields.String(
         description="additional status information. always set for FAILED."
+    ),
+    'start_wave': fields.Integer(
+        description="START wave of the device, 0 if it was started right away"
     )
 })
 
@@ -40,6 +52,45 @@ DEVICE_SPECIFICATION_SCHEMA = Model('device_spec', {
     )
 })
 
+SESSION_STATUS_COUNTS_SCHEMA = Model('session_status_counts', {
+    'pending': fields.Integer(
+        attribute='pending_count',
+        description="number of devices that haven't started recording yet"
+    ),
+    'recording': fields.Integer(
+        attribute='recording_count',
+        description="number of devices recording"
+    ),
+    'complete': fields.Integer(
+        attribute='complete_count',
+        description="number of devices that recorded for the whole duration"
+    ),
+    'failed': fields.Integer(
+        attribute='failed_count',
+        description="number of devices that failed"
+    ),
+    'canceled': fields.Integer(
+        attribute='canceled_count',
+        description="number of devices whose recording was canceled"
+    )
+})
+
+START_WAVES_SCHEMA = Model('start_waves', {
+    'total': fields.Integer(
+        attribute='start_waves',
+        description="number of START waves"
+    ),
+    'started': fields.Integer(
+        attribute='started_waves',
+        description="number of START waves reached, their devices have been "
+                    "(or will be with their next heartbeat) sent START"
+    ),
+    'next_wave_time': fields.DateTime(
+        description="when the next START wave is reached, null once every "
+                    "wave has been reached"
+    )
+})
+
 RECORDING_SESSION_BASE_SCHEMA = Model('session_base', {
     'name': fields.String(
         required=True,
@@ -60,6 +111,15 @@ RECORDING_SESSION_BASE_SCHEMA = Model('session_base', {
     'apply_filter': fields.Boolean(
         description="enable filtering during video encoding",
         required=True
+    ),
+    'start_wave_size': fields.Integer(
+        min=1,
+        description="send START to this many devices at a time rather than "
+                    "to every device at once"
+    ),
+    'start_wave_interval': fields.Integer(
+        min=1,
+        description="seconds between START waves"
     )
 })
 
@@ -72,19 +132,80 @@ NEW_RECORDING_SESSION_SCHEMA = RECORDING_SESSION_BASE_SCHEMA.clone(
     }
 )
 
-RECORDING_SESSION_SCHEMA = RECORDING_SESSION_BASE_SCHEMA.clone('active_session', {
+RECORDING_SESSION_SUMMARY_SCHEMA = RECORDING_SESSION_BASE_SCHEMA.clone('session_summary', {
     'id': fields.Integer(
         description="session ID"
     ),
     'creation_time': fields.DateTime(
         description="iso8601 formatted datetime"
     ),
+    'status': fields.String(
+        attribute=lambda s: s.status.name,
+        description="session status"
+    ),
+    'status_counts': fields.Nested(
+        SESSION_STATUS_COUNTS_SCHEMA,
+        attribute=lambda s: s,
+        description="number of devices in each status"
+    ),
+    'start_waves': fields.Nested(
+        START_WAVES_SCHEMA,
+        attribute=lambda s: s if s.start_waves else None,
+        allow_null=True,
+        description="progress of the START waves, null if the devices "
+                    "weren't started in waves"
+    )
+})
+
+RECORDING_SESSION_SCHEMA = RECORDING_SESSION_SUMMARY_SCHEMA.clone('active_session', {
     'device_statuses': fields.List(
         fields.Nested(DEVICE_SESSION_STATUS),
         description="status of devices assigned to recording session"
+    )
+})
+
+BULK_SESSION_ACTION_SCHEMA = Model('bulk_session_action', {
+    'cancel': fields.Boolean(
+        default=False,
+        description="cancel the sessions that are in progress"
+    ),
+    'archive': fields.Boolean(
+        default=False,
+        description="archive the sessions"
+    ),
+    'session_ids': fields.List(
+        fields.Integer,
+        description="only include these sessions"
     ),
     'status': fields.String(
-        attribute=lambda s: s.status.name,
-        description="session status"
+        enum=['IN_PROGRESS', 'COMPLETE', 'CANCELED'],
+        description="only include sessions in this status"
+    ),
+    'name': fields.String(
+        description="only include sessions whose name contains this"
+    ),
+    'created_after': fields.DateTime(
+        description="only include sessions created at or after this time"
+    ),
+    'created_before': fields.DateTime(
+        description="only include sessions created before this time"
+    ),
+    'device_id': fields.Integer(
+        description="only include sessions this device was part of"
+    )
+})
+
+BULK_SESSION_RESULT_SCHEMA = Model('bulk_session_result', {
+    'matched': fields.Integer(
+        description="number of sessions that matched"
+    ),
+    'canceled': fields.Integer(
+        description="number of sessions that were canceled"
+    ),
+    'archived': fields.Integer(
+        description="number of sessions that were archived"
+    ),
+    'stopped': fields.Integer(
+        description="number of devices whose recording was canceled"
     )
 })
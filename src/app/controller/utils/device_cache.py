@@ -0,0 +1,95 @@
+"""
+cache of pre-rendered device JSON used to answer requests for the device list
+"""
+import json
+import threading
+
+from flask_restplus import marshal
+
+import src.app.model as model
+
+
+class DeviceSnapshotCache:
+    """
+    caches each device rendered with a flask_restplus model as a JSON
+    fragment, so listing devices doesn't have to load and marshal every
+    device row.
+
+    Fragments are versioned with the device's last_update, session_id and
+    down_since (see Device.get_versions()). update_from_heartbeat() changes
+    last_update, joining or leaving a session changes session_id and the DOWN
+    sweeper sets down_since, so a fragment is invalidated whenever any of
+    them touches the device. Checking versions is a
+    single narrow query, which also keeps every process's cache consistent
+    with the database without any coordination between processes.
+
+    The state field is left out of the fragments. DOWN depends on the time of
+    the request, so the state is derived from the cached last_update and
+    session_id each time the list is assembled.
+    """
+
+    def __init__(self, schema):
+        """
+        :param schema: flask_restplus Model the devices are rendered with, its
+            'state' field is derived when a response is assembled
+        """
+        self.schema = schema
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # device id -> (version, last_update, session_id, fragment)
+        self._fragments = {}
+
+    def render(self, versions, complete=False):
+        """
+        render a list of devices as a JSON array
+        :param versions: (id, name, last_update, session_id, down_since) of
+            the devices to render, as returned by Device.get_versions()
+        :param complete: True if versions includes every device, cached
+            fragments of devices that aren't included are discarded
+        :return: JSON encoded list of devices, in the same order as versions
+        """
+        with self._lock:
+            entries = {v.id: self._fragments.get(v.id) for v in versions}
+
+        stale = [v.id for v in versions if entries[v.id] is None or
+                 entries[v.id][0] != (v.last_update, v.session_id,
+                                      v.down_since)]
+        if stale:
+            for device in model.Device.get_by_ids(stale):
+                entries[device.id] = self._render_device(device)
+
+        with self._lock:
+            self.hits += len(versions) - len(stale)
+            self.misses += len(stale)
+            for device_id in stale:
+                if entries[device_id] is not None:
+                    self._fragments[device_id] = entries[device_id]
+            if complete:
+                # forget devices that no longer exist
+                self._fragments = {device_id: self._fragments[device_id]
+                                   for device_id in entries
+                                   if device_id in self._fragments}
+
+        fragments = []
+        for version in versions:
+            entry = entries[version.id]
+            if entry is None:
+                # device was removed after its version was read
+                continue
+            _, last_update, session_id, fragment = entry
+            state = model.Device.derive_state(last_update, session_id)
+            fragments.append(f'{{"state": "{state.name}", {fragment}}}')
+        return f"[{', '.join(fragments)}]"
+
+    def clear(self):
+        """ discard all cached fragments """
+        with self._lock:
+            self._fragments = {}
+
+    def _render_device(self, device):
+        data = marshal(device, self.schema)
+        del data['state']
+        # fragment is the JSON object without its enclosing braces
+        return ((device.last_update, device.session_id, device.down_since),
+                device.last_update, device.session_id, json.dumps(data)[1:-1])
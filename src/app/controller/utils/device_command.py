@@ -3,8 +3,9 @@ this utilty file contains functions related to processing a device's state as
 and determining if we need to reply with a command for the device client
 """
 import enum
-import json
+from flask import current_app
 from flask_restplus import abort
+from flask_restplus.utils import unpack
 
 import src.app.model as model
 from src.utils.exceptions import JaxMBAControlServiceException
@@ -12,6 +13,45 @@ from src.utils.logging import get_module_logger
 
 LOGGER = get_module_logger()
 
+# worst case number of SQL statements issued while processing a heartbeat from
+# a registered device:
+#   1. SELECT ... FOR UPDATE of the device joined to its session status and
+#      recording session
+#   2. UPDATE of the device row
+#   3. UPDATE of the device's session status row, only when its status
+#      changes or the recording duration reported by the device drifts from
+#      the one computed from when it started (see RECORDING_TIME_DRIFT)
+#   4. UPDATE of the change counters (see model.ChangeCounter)
+# followed by a single COMMIT. get_device_response() must not commit or issue
+# any queries of its own, everything it needs is loaded by
+# Device.update_from_heartbeat()
+#
+# heartbeats from devices that acknowledge queued commands (send ack_seq) add
+# a SELECT of the device's command queue, but only while it has commands the
+# device hasn't acknowledged. Idle devices with an empty queue skip the
+# session state machine entirely, see get_device_response()
+#
+# a device's first heartbeat registers it (see Device.register()). On
+# PostgreSQL that is one INSERT ... ON CONFLICT ... RETURNING of the device
+# along with its heartbeat values, followed by the UPDATE of its revision.
+# SQLite needs an INSERT OR IGNORE, another SELECT and the UPDATE, so one
+# statement over budget
+#
+# heartbeats that change the device's session status (when it joins and when
+# it finishes its part of a recording session) also UPDATE the status
+# counters of the session. That happens twice per device and session, so it
+# is budgeted separately
+#
+# the heartbeat that finishes a device's part of a recording session (its
+# status leaves PENDING/RECORDING) also checks whether the session is complete
+# (see RecordingSession.complete_finished()): a SELECT ... FOR UPDATE of the
+# session if none of its devices is unfinished and, for the last device, an
+# UPDATE of the session. That happens once per device and session, so it is
+# budgeted separately
+HEARTBEAT_STATEMENT_BUDGET = 4
+STATUS_CHANGE_STATEMENTS = 1
+SESSION_COMPLETION_STATEMENTS = 2
+
 
 class Command(enum.Enum):
     START = "START"
@@ -19,15 +59,57 @@ class Command(enum.Enum):
     COMPLETE = "COMPLETE"
     STREAM = "STREAM"
 
+def get_queued_response(device):
+    """
+    response containing the commands queued for a device that it hasn't
+    acknowledged yet
+    :param device: device that sent the heartbeat
+    :return: response body and status code
+    """
+    commands = model.DeviceCommand.get_pending(device)
+    if not commands:
+        return '', 204
+    return {
+        'command_name': commands[0].name.value,
+        'parameters': commands[0].parameters,
+        'commands': commands
+    }, 200
+
+
 def get_device_response(device, client_data):
+    """
+    determine which command, if any, to send to a device in response to a
+    heartbeat, updating the device and its session status as needed.
+
+    Devices that send ack_seq get START, STOP and STREAM commands from their
+    command queue (see model.DeviceCommand). Older devices get them derived
+    from the state of their recording session every heartbeat, and anything
+    in their queue is considered delivered.
+
+    changes are made to the device and its session status but not committed,
+    the caller is responsible for committing them (see
+    Device.finish_heartbeat()) once the response has been determined
+    :param device: device returned by Device.update_from_heartbeat()
+    :param client_data: heartbeat payload
+    :return: response body and status code
+    """
     # get session ID included in message if present
     client_session = client_data.get('session_id')
 
+    ack_seq = client_data.get('ack_seq')
+    queued = ack_seq is not None
+    if queued:
+        device.acknowledge_commands(ack_seq)
+        # nothing to do for an idle device with an empty queue
+        if not device.session_id and not device.has_pending_commands():
+            return '', 204
+    else:
+        device.acknowledge_commands(device.command_seq)
+
     # has the device been assigned to a recording session?
     if device.session_id:
 
-        device_session_status = model.DeviceRecordingStatus.get(device,
-                                                                device.recording_session)
+        device_session_status = device.active_status
 
         # this is an extra sanity check
         if not device_session_status:
@@ -36,51 +118,43 @@ def get_device_response(device, client_data):
             # DeviceRecordingStatus
             LOGGER.error("device doesn't have corresponding "
                          f"DeviceRecordingStatus for session {device.session_id}")
-            try:
-                device.clear_session()
-            except JaxMBAControlServiceException:
-                # for now pass, it should try again next heartbeat
-                pass
+            device.clear_session(commit=False)
             return '', 204
 
         # device doesn't know it's been assigned to the session yet
         if not client_session:
             if device_session_status.status == model.DeviceRecordingStatus.Status.PENDING:
-                # we were waiting to hear from device to tell it to start
+                # we were waiting to hear from device to tell it to start,
+                # unless its START wave hasn't been reached yet. a queued
+                # device gets nothing, its START stays in the queue
+                if not device.recording_session.can_start(
+                        device_session_status):
+                    return '', 204
+                if queued:
+                    return get_queued_response(device)
                 return {
                            'command_name': Command.START.value,
-                           'parameters': json.dumps({
-                               'session_id': device.session_id,
-                               'duration': device.recording_session.duration,
-                               'fragment_hourly': device.recording_session.fragment_hourly,
-                               'file_prefix': device_session_status.file_prefix,
-                               'target_fps': device.recording_session.target_fps,
-                               'apply_filter': device.recording_session.apply_filter
-                           })
+                           'parameters': device.recording_session.start_parameters(
+                               device_session_status)
                        }, 200
             elif device_session_status.status == model.DeviceRecordingStatus.Status.CANCELED:
                 # device appears to have successfully canceled, clear its
                 # active session so it is available to be included in a
-                # new session
-                try:
-                    device.clear_session()
-                except JaxMBAControlServiceException:
-                    # for now pass, it should try again next heartbeat
-                    pass
+                # new session. a queued device still gets the STOP in case
+                # it received the START without acknowledging it
+                device.clear_session(commit=False)
+                if queued:
+                    return get_queued_response(device)
                 return '', 204
             else:
                 # device is unexpectedly idle after it had previously
                 # joined the recording session.
-                try:
-                    device_session_status.update_status(
-                        model.DeviceRecordingStatus.Status.FAILED,
-                        "device unexpectedly left recording session"
-                    )
-                    device.clear_session()
-                except JaxMBAControlServiceException:
-                    # couldn't update the status for some reason
-                    # don't treat this as fatal, we'll try again next time
-                    pass
+                device_session_status.update_status(
+                    model.DeviceRecordingStatus.Status.FAILED,
+                    "device unexpectedly left recording session",
+                    commit=False
+                )
+                device.clear_session(commit=False)
 
         else:
             # device already knows it is part of a session
@@ -98,63 +172,82 @@ def get_device_response(device, client_data):
                 # check to see if there was an error
                 err_msg = client_data.get('err_msg')
 
-                try:
-                    if err_msg:
-                        # handle error case
+                if err_msg:
+                    # handle error case
+                    device_session_status.update_status(
+                        model.DeviceRecordingStatus.Status.FAILED,
+                        err_msg,
+                        commit=False
+                    )
+                else:
+                    # no error, this means the device finished recording
+                    duration = client_data['sensor_status']['camera'].get(
+                        'duration', 0)
+                    device_session_status.update_recording_time(
+                        duration, commit=False)
+                    if device_session_status.status == model.DeviceRecordingStatus.Status.RECORDING:
                         device_session_status.update_status(
-                            model.DeviceRecordingStatus.Status.FAILED,
-                            err_msg
+                            model.DeviceRecordingStatus.Status.COMPLETE,
+                            commit=False
                         )
-                    else:
-                        # no error, this means the device finished recording
-                        duration = client_data['sensor_status']['camera'].get(
-                            'duration', 0)
-                        device_session_status.update_recording_time(
-                            duration)
-                        if device_session_status.status == model.DeviceRecordingStatus.Status.RECORDING:
-                            device_session_status.update_status(
-                                model.DeviceRecordingStatus.Status.COMPLETE
-                            )
-
-                    device.clear_session()
-                    return {'command_name': Command.COMPLETE.value}, 200
-
-                except JaxMBAControlServiceException:
-                    # couldn't update the device for some reason
-                    # don't treat this as fatal. we will try again next time
-                    # device sends us a status update
-                    pass
+
+                device.clear_session(commit=False)
+                return {'command_name': Command.COMPLETE.value}, 200
 
             elif device_session_status.status == model.DeviceRecordingStatus.Status.CANCELED:
                 # we have a cancel request for this device,
-                # tell it to stop recording
+                # tell it to stop recording. until it does, keep the time it
+                # recorded up to date, only writing it if it has drifted
+                device_session_status.update_recording_time(
+                    client_data['sensor_status']['camera'].get('duration', 0),
+                    drift=current_app.config['RECORDING_TIME_DRIFT'],
+                    commit=False)
+                if queued:
+                    return get_queued_response(device)
                 return {'command_name': Command.STOP.value}, 200
             elif device_session_status.status == model.DeviceRecordingStatus.Status.RECORDING:
-                # device is recording, update our recording status with
-                # the current recording duration
-                try:
-                    device_session_status.update_recording_time(
-                        client_data['sensor_status']['camera']['duration'])
-                except JaxMBAControlServiceException:
-                    # couldn't update the device time for some reason
-                    # don't treat this as fatal.
-                    pass
+                # device is recording, its recording time is computed from
+                # when it started so the status is only updated if the
+                # duration it reports has drifted from that
+                device_session_status.update_recording_time(
+                    client_data['sensor_status']['camera'].get('duration', 0),
+                    drift=current_app.config['RECORDING_TIME_DRIFT'],
+                    commit=False)
                 # device is recording. should it also stream?
+                if queued:
+                    return get_queued_response(device)
                 if device.is_stream_active():
                     return {'command_name': Command.STREAM.value}
             elif device_session_status.status == model.DeviceRecordingStatus.Status.PENDING:
                 # device is sending first update after joining the session
                 try:
-                    device.join_session(
-                        device_session_status.session)
+                    device.join_session(device.recording_session,
+                                        commit=False)
                 except JaxMBAControlServiceException as err:
                     abort(400, f"error joining session {err}")
 
-                try:
-                    device_session_status.update_recording_time(
-                        client_data['sensor_status']['camera']['duration'])
-                except JaxMBAControlServiceException:
-                    # couldn't update the device time for some reason
-                    # don't treat this as fatal.
-                    pass
+                device_session_status.update_recording_time(
+                    client_data['sensor_status']['camera'].get('duration', 0),
+                    commit=False)
+    if queued:
+        return get_queued_response(device)
     return '', 204
+
+
+def get_device_responses(devices, payloads):
+    """
+    determine the command to send to each device in a batch of heartbeats.
+    as with get_device_response(), changes are left for the caller to commit
+    :param devices: devices returned by Device.update_from_heartbeats()
+    :param payloads: heartbeat payloads, in the same order as devices
+    :return: list of dictionaries containing the device name and its command
+        (command_name is None if there is nothing for the device to do)
+    """
+    responses = []
+    for device, client_data in zip(devices, payloads):
+        command, _, _ = unpack(get_device_response(device, client_data))
+        response = {'name': device.name}
+        if command:
+            response.update(command)
+        responses.append(response)
+    return responses
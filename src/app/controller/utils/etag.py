@@ -0,0 +1,67 @@
+"""
+ETag and conditional GET helpers
+"""
+import hashlib
+import time
+
+from flask import current_app, request, Response
+from werkzeug.http import quote_etag
+
+
+def make_etag(*version):
+    """
+    make a strong ETag from the version of the data a response is built from
+    :param version: values identifying the version, must have a stable repr()
+    :return: unquoted ETag
+    """
+    return hashlib.sha1(repr(version).encode()).hexdigest()
+
+
+def not_modified(etag):
+    """
+    check the request's If-None-Match header against an ETag
+    :param etag: unquoted ETag of the current version of the resource
+    :return: 304 response if the client already has this version, None
+        otherwise
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def etag_header(etag):
+    """
+    :param etag: unquoted ETag
+    :return: headers to add to a response
+    """
+    return {'ETag': quote_etag(etag)}
+
+
+def time_bucket(live_since):
+    """
+    coarse version of the current time, for responses with fields computed
+    from it (e.g. the recording time of a RECORDING device) that the version
+    of the data doesn't cover. Their ETag changes every TIMED_ETAG_INTERVAL
+    seconds, so a 304 response is at most that much out of date
+    :param live_since: time the fields are computed from, None if the
+        response doesn't have any
+    :return: number of the current interval, None if live_since is None
+    """
+    if live_since is None:
+        return None
+    return int(time.time() // current_app.config['TIMED_ETAG_INTERVAL'])
+
+
+def tagged(body, etag, headers=None):
+    """
+    respond with a marshaled body tagged with its ETag
+    :param body: marshaled body
+    :param etag: unquoted ETag of the version the body is built from
+    :param headers: other headers to add to the response
+    :return: response tuple
+    """
+    response_headers = etag_header(etag)
+    response_headers.update(headers or {})
+    return body, 200, response_headers
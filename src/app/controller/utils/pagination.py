@@ -2,8 +2,10 @@
 Controller Pagination Utilities
 """
 
+import base64
+import json
 from functools import wraps
-from flask_restplus import reqparse
+from flask_restplus import abort, reqparse
 
 
 def add_pagination_args(parser):
@@ -48,3 +50,45 @@ def parse_pagination_args(fnc):
         }
         return fnc(*args, **kwargs)
     return wrapper
+
+
+def add_cursor_args(parser, default_limit=100):
+    """
+    Add keyset (cursor) pagination args to a parser
+    :param parser: Initialized parser to add args to
+    :param default_limit: number of items per page if limit isn't given,
+        None to leave the default to the endpoint
+    :return:
+    """
+    parser.add_argument('cursor', type=str, required=False,
+                        help='Opaque cursor from the X-Next-Cursor header of '
+                             'the previous page, omit for the first page')
+    parser.add_argument('limit', type=int, default=default_limit,
+                        required=False, help='Items per page')
+    return parser
+
+
+def encode_cursor(key):
+    """
+    Encode the key of the last item on a page as an opaque cursor
+    :param key: JSON serializable key
+    :return: cursor string, None if key is None
+    """
+    if key is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by encode_cursor, aborting with a 400 response if
+    it is invalid
+    :param cursor: cursor string, may be None
+    :return: key, None if cursor is None
+    """
+    if cursor is None:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        abort(400, f"invalid cursor: {cursor}")
@@ -0,0 +1,165 @@
+"""
+Fast validation and parsing of request payloads for high volume endpoints
+"""
+from datetime import datetime
+
+import dateutil.parser
+from flask_restplus import abort, fields
+from flask_restplus.model import instance
+from jsonschema import Draft4Validator
+
+
+# JSON schema (draft 4) types
+_TYPES = {
+    'string': lambda v: isinstance(v, str),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, list),
+    'null': lambda v: v is None
+}
+
+# keywords that don't affect validation (formats are only checked when a
+# FormatChecker is used, which the API doesn't do)
+_ANNOTATIONS = {'description', 'title', 'example', 'default', 'readOnly',
+                'format'}
+
+
+def _nested_models(model, models=None):
+    """
+    find a model and every model nested in it
+    :param model: flask_restplus Model
+    :param models: dictionary of models found so far
+    :return: dictionary mapping model name to model
+    """
+    models = {} if models is None else models
+    models[model.name] = model
+    for field in model.values():
+        field = instance(field)
+        if isinstance(field, fields.List):
+            field = field.container
+        if isinstance(field, fields.Nested) and field.nested.name not in models:
+            _nested_models(field.nested, models)
+    return models
+
+
+def _inline_refs(schema, definitions):
+    """
+    replace every '#/definitions/<name>' reference in a schema with the
+    (inlined) schema it refers to
+    """
+    if isinstance(schema, list):
+        return [_inline_refs(s, definitions) for s in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    inlined = {}
+    for key, value in schema.items():
+        if key == '$ref':
+            name = value.rsplit('/', 1)[-1]
+            inlined.update(_inline_refs(definitions[name], definitions))
+        else:
+            inlined[key] = _inline_refs(value, definitions)
+    return inlined
+
+
+def _compile(schema):
+    """
+    compile a schema into a function that returns True if a value is valid.
+    the keywords flask_restplus models use are compiled to plain python
+    checks, a schema using any other keyword is checked with jsonschema
+    :param schema: JSON schema with no references
+    :return: function taking a value and returning a bool
+    """
+    checks = []
+    for keyword, value in schema.items():
+        if keyword in _ANNOTATIONS:
+            continue
+        if keyword == 'type':
+            types = [value] if isinstance(value, str) else value
+            type_checks = [_TYPES[t] for t in types]
+            checks.append(
+                lambda v, type_checks=type_checks: any(c(v) for c in type_checks))
+        elif keyword == 'required':
+            # value is bound as a default argument when the lambda is created
+            # pylint: disable=cell-var-from-loop
+            checks.append(lambda v, required=tuple(value): (
+                not isinstance(v, dict) or all(k in v for k in required)))
+        elif keyword == 'properties':
+            properties = [(k, _compile(s)) for k, s in value.items()]
+            checks.append(lambda v, properties=properties: (
+                not isinstance(v, dict) or
+                all(check(v[k]) for k, check in properties if k in v)))
+        elif keyword == 'items' and isinstance(value, dict):
+            # the item check is compiled when the lambda is created
+            # pylint: disable=cell-var-from-loop
+            checks.append(lambda v, item=_compile(value): (
+                not isinstance(v, list) or all(item(i) for i in v)))
+        elif keyword == 'allOf':
+            checks.extend(_compile(s) for s in value)
+        else:
+            return Draft4Validator(schema).is_valid
+
+    if len(checks) == 1:
+        return checks[0]
+    return lambda v: all(check(v) for check in checks)
+
+
+class CompiledValidator:  # pylint: disable=R0903
+    """
+    validates payloads against a flask_restplus Model.
+
+    Model.validate(), used by @NS.expect(model, validate=True), rebuilds the
+    model's JSON schema and a new validator on every request and resolves
+    nested models through the API's RefResolver. This builds the schema, with
+    nested models inlined, once and compiles it to plain python checks.
+    jsonschema is only used to describe the errors in an invalid payload,
+    which is rejected with the same 400 response flask_restplus returns.
+    """
+
+    def __init__(self, model, as_list=False):
+        """
+        :param model: flask_restplus Model to validate against
+        :param as_list: if True payloads are lists of model objects
+        """
+        self.model = model
+        definitions = {name: m.__schema__
+                       for name, m in _nested_models(model).items()}
+        schema = _inline_refs(model.__schema__, definitions)
+        if as_list:
+            schema = {'type': 'array', 'items': schema}
+        Draft4Validator.check_schema(schema)
+        self.schema = schema
+        self._check = _compile(schema)
+        self._validator = Draft4Validator(schema)
+
+    def validate(self, data):
+        """
+        validate a payload, aborting with a 400 response if it is invalid
+        :param data: decoded JSON payload
+        """
+        if not self._check(data):
+            abort(400, message='Input payload validation failed',
+                  errors=dict(self.model.format_error(e)
+                              for e in self._validator.iter_errors(data)))
+
+
+def parse_timestamp(value):
+    """
+    parse an ISO 8601 timestamp.
+
+    devices send timestamps produced by datetime.isoformat(), which
+    datetime.fromisoformat() parses much faster than dateutil. A trailing 'Z'
+    is accepted as UTC. Anything fromisoformat() doesn't understand is passed
+    on to dateutil.
+    :param value: timestamp string
+    :return: datetime, naive if the timestamp doesn't include a timezone
+    :raises ValueError: if the timestamp can't be parsed
+    """
+    try:
+        if value.endswith('Z'):
+            return datetime.fromisoformat(value[:-1] + '+00:00')
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
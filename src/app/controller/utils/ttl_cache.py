@@ -0,0 +1,70 @@
+"""
+short lived cache for responses that are expensive to compute but may be a
+little stale, e.g. aggregates polled by dashboards
+"""
+import threading
+import time
+
+
+class TTLCache:
+    """
+    caches computed values for a number of seconds. Concurrent requests for
+    a missing or expired value wait for a single computation rather than
+    each computing it, so the cost doesn't grow with the number of pollers.
+    Each key has its own lock, so computing one value doesn't hold up
+    requests for the others
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # guards the dicts and counters, never held while computing
+        self._lock = threading.Lock()
+        # key -> (time the value was computed, value)
+        self._values = {}
+        # key -> lock held while computing the value of that key
+        self._key_locks = {}
+
+    def _fresh(self, key, ttl):
+        """
+        :return: (True, value) if the cached value of key is fresh,
+            (False, None) otherwise. Must be called holding self._lock
+        """
+        cached = self._values.get(key)
+        if cached is not None and time.monotonic() - cached[0] < ttl:
+            self.hits += 1
+            return True, cached[1]
+        return False, None
+
+    def get(self, key, ttl, compute):
+        """
+        get a cached value, computing it if it is missing or expired
+        :param key: cache key
+        :param ttl: number of seconds a computed value is used for
+        :param compute: function without arguments that computes the value
+        :return: the value
+        """
+        with self._lock:
+            fresh, value = self._fresh(key, ttl)
+            if fresh:
+                return value
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # another request may have computed it while this one waited
+            with self._lock:
+                fresh, value = self._fresh(key, ttl)
+                if fresh:
+                    return value
+                self.misses += 1
+
+            computed_at = time.monotonic()
+            value = compute()
+            with self._lock:
+                self._values[key] = (computed_at, value)
+            return value
+
+    def clear(self):
+        """ forget every cached value """
+        with self._lock:
+            self._values.clear()
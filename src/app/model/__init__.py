@@ -1,6 +1,8 @@
 """
 The root of our sqlalchemy code
 """
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
@@ -21,15 +23,29 @@ class JaxMBADatabaseException(JaxMBAControlServiceException):
     """ Base exception class for exceptions defined in the model module """
 
 
+class UnknownDeviceException(JaxMBADatabaseException):
+    """ devices referenced by a request don't exist """
+
+    def __init__(self, device_ids):
+        super().__init__(f"Invalid device IDs: {device_ids}")
+        self.device_ids = device_ids
+
+
 class PasswordFormatException(JaxMBAControlServiceException):
     """password doesn't meet our requirements"""
 
 # this needs to be imported after the BASE/SESSION and exceptions are setup
 # pylint: disable=wrong-import-position
-from .device_model import Device
-from .recording_session_model import RecordingSession, DeviceRecordingStatus
+from .change_counter_model import ChangeCounter
+from .device_model import Device, TELEMETRY_BUFFER, migrate_sensor_status
+from .recording_session_model import RecordingSession, DeviceRecordingStatus, \
+    recount_statuses
+from .device_command_model import DeviceCommand
 from .user_model import User
 from .simple_auth_model import SimpleAuth, MIN_PASSWORD_LEN
+from . import events  # registers the flush listener publishing events
+from .sweeper import DOWN_SWEEPER
+from .utils.notify import configure_notifier
 # pylint: enable=wrong-import-position
 
 
@@ -42,16 +58,72 @@ def init_db(app):
     :param app: The flask app returned from app_factory
     :return: sqlalchemy engine, just in case you want it
     """
-    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    engine_options = {}
+    if uri.startswith('postgres'):
+        # batches of heartbeats update many rows with the same statement, let
+        # psycopg2 send those executemany() calls in batches rather than one
+        # round trip per row
+        engine_options['use_batch_mode'] = True
+    engine = create_engine(uri, **engine_options)
     SESSION_FACTORY.configure(bind=engine)
-    create_all(engine)
+    init_schema(app, engine)
+    init_write_behind(app, engine)
+    configure_notifier(app)
     return engine
 
 
+def init_schema(app, engine):
+    """
+    create the tables of a new database and stamp it with the latest alembic
+    revision. The schema of an existing database is left alone, it is
+    upgraded with 'manage.py db upgrade'
+    :param app: The flask app returned from app_factory
+    :param engine: sqlalchemy engine
+    :return: None
+    """
+    directory = app.extensions['migrate'].directory
+    with engine.begin() as conn:
+        context = MigrationContext.configure(conn)
+        if not engine.dialect.has_table(conn, Device.__tablename__):
+            create_all(conn)
+            context.stamp(ScriptDirectory(directory), 'head')
+        elif context.get_current_revision() is None:
+            app.logger.warning(
+                "database has no alembic revision, see the README to upgrade "
+                "databases created by older releases")
+
+
+def init_write_behind(app, engine):
+    """
+    configure write-behind buffering of device telemetry from the app config
+    :param app: The flask app returned from app_factory
+    :param engine: sqlalchemy engine used to flush the buffer
+    :return: None
+    """
+    max_staleness = app.config['TELEMETRY_MAX_STALENESS']
+    if app.config['TELEMETRY_WRITE_BEHIND'] and \
+            max_staleness >= app.config['DOWN_DEVICE_THRESHOLD']:
+        # buffered last_update timestamps must be written before a device
+        # would be considered down
+        max_staleness = app.config['DOWN_DEVICE_THRESHOLD'] // 2
+        app.logger.warning(
+            "TELEMETRY MAX_STALENESS must be less than DOWN_DEVICE_THRESHOLD, "
+            f"using {max_staleness}")
+
+    TELEMETRY_BUFFER.configure(
+        engine,
+        enabled=app.config['TELEMETRY_WRITE_BEHIND'],
+        flush_interval=min(app.config['TELEMETRY_FLUSH_INTERVAL'], max_staleness),
+        max_staleness=max_staleness,
+        metrics_interval=app.config['TELEMETRY_METRICS_INTERVAL']
+    )
+
+
 def create_all(engine):
     """
     Create all the sqlalchemy tables
-    :param engine:
+    :param engine: engine or connection
     :return: None
     """
     BASE.metadata.create_all(engine, checkfirst=True)
@@ -0,0 +1,206 @@
+"""
+counters incremented by every transaction that changes the devices or
+recording sessions, used to version the data served by the API
+"""
+import random
+
+from sqlalchemy import Column, String, BigInteger, event, select, text, \
+    func, and_, or_, inspect
+
+from . import BASE, SESSION, SESSION_FACTORY
+
+# session.info key of the counters already incremented by a transaction
+_BUMPED = 'bumped_counters'
+
+
+class ChangeCounter(BASE):
+    """
+    counters incremented by every transaction that changes a group of tables.
+    Used as a cheap version of the data the API serves (see
+    ChangeCounter.get_version()), for example to generate ETags, without
+    reading the data itself
+
+    Each counter is split into SHARDS rows. A transaction increments one of
+    them, picked at random, and the row stays locked until it commits, so
+    concurrent writers only wait for each other when they pick the same row
+    (1 in SHARDS for two writers), rather than every write transaction
+    waiting for the one before it. The counter's value is the total of its
+    shards.
+
+    The REVISION counter is incremented by every transaction that changes a
+    device, recording session or device session status, and the revision it
+    returns (the new value of the shard times SHARDS, plus the shard) is
+    written to the revision column of every row the transaction inserts or
+    updates. The revisions of a shard are committed in order: once a shard's
+    value can be read, every row with a revision of that shard up to it has
+    been committed (see get_revisions() and changed()). Device telemetry
+    written by heartbeats isn't counted, see Device.UNVERSIONED_COLUMNS.
+
+    ORM changes are counted automatically when they are flushed. Changes
+    made with Core statements (bulk inserts and updates) must call bump() or
+    bump_session() and set the revision of the rows they change to the
+    value it returns
+    """
+    __tablename__ = 'change_counter'
+
+    REVISION = 'revision'
+
+    # number of rows each counter is split into. Changing it needs a
+    # migration adding or merging the rows
+    SHARDS = 16
+
+    # tables whose rows have a revision column maintained by this counter
+    TRACKED_TABLES = {'device', 'recording_session', 'session_device_status'}
+
+    name = Column(String, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0, server_default='0')
+
+    @classmethod
+    def shard_names(cls, name=REVISION):
+        """
+        :param name: name of the counter
+        :return: list of the names of the counter's rows, in shard order
+        """
+        return [name] + [f"{name}.{shard}" for shard in range(1, cls.SHARDS)]
+
+    @classmethod
+    def bump(cls, connection, name=REVISION):
+        """
+        increment a counter as part of a transaction. Rows of the tracked
+        tables must be locked before the counter, so transactions that lock
+        rows (e.g. SELECT ... FOR UPDATE) must do so before calling this
+        :param connection: connection or session of the transaction
+        :param name: name of the counter to increment
+        :return: revision identifying the increment, unique and increasing
+            within the shard that was incremented
+        """
+        shard = random.randrange(cls.SHARDS)
+        shard_name = cls.shard_names(name)[shard]
+        dialect = connection.get_bind().dialect \
+            if hasattr(connection, 'get_bind') else connection.dialect
+        if dialect.name == 'postgresql' or (
+                dialect.name == 'sqlite' and
+                dialect.dbapi.sqlite_version_info >= (3, 35)):
+            value = connection.execute(
+                text("UPDATE change_counter SET value = value + 1 "
+                     "WHERE name = :name RETURNING value"),
+                {'name': shard_name}).scalar()
+        else:
+            connection.execute(cls.__table__.update()
+                               .where(cls.__table__.c.name == shard_name)
+                               .values(value=cls.__table__.c.value + 1))
+            value = connection.execute(select([cls.__table__.c.value]).where(
+                cls.__table__.c.name == shard_name)).scalar()
+        return value * cls.SHARDS + shard
+
+    @classmethod
+    def bump_session(cls, session, name=REVISION):
+        """
+        increment a counter as part of the session's current transaction.
+        The counter is only incremented once per transaction
+        :param session: sqlalchemy session
+        :param name: name of the counter to increment
+        :return: value of the counter for this transaction
+        """
+        bumped = session.info.setdefault(_BUMPED, {})
+        if name not in bumped:
+            bumped[name] = cls.bump(session, name)
+        return bumped[name]
+
+    @classmethod
+    def current(cls, name=REVISION):
+        """
+        SQL expression for the value of a counter, the total of its shards
+        """
+        return select([func.sum(cls.value)]).where(
+            cls.name.in_(cls.shard_names(name))).as_scalar()
+
+    @classmethod
+    def get_version(cls, *extra):
+        """
+        get the current revision with a single query
+        :param extra: scalar subqueries whose values are added to the version
+        :return: tuple of the revision followed by the extra values
+        """
+        return tuple(SESSION.execute(
+            select([cls.current()] + list(extra))).first())
+
+    @classmethod
+    def get_revisions(cls, name=REVISION):
+        """
+        get the value of each shard of a counter with a single query
+        :param name: name of the counter
+        :return: list of values, in shard order
+        """
+        names = cls.shard_names(name)
+        values = dict(SESSION.query(cls.name, cls.value)
+                      .filter(cls.name.in_(names)).all())
+        return [values.get(shard_name, 0) for shard_name in names]
+
+    @classmethod
+    def changed(cls, column, since, until):
+        """
+        SQL expression that is true for rows whose revision was set by an
+        increment after since, up to and including until
+        :param column: revision column
+        :param since: get_revisions() already seen, None to include every
+            revision up to until
+        :param until: get_revisions() of the last increments to include
+        :return: sql expression
+        """
+        shards = []
+        for shard, value in enumerate(until):
+            condition = [column % cls.SHARDS == shard,
+                         column <= value * cls.SHARDS + shard]
+            if since is not None:
+                condition.append(column > since[shard] * cls.SHARDS + shard)
+            shards.append(and_(*condition))
+
+        # the range of all the shards lets the index on the column narrow
+        # down the rows tested
+        bounds = [column <= max(until) * cls.SHARDS + cls.SHARDS - 1]
+        if since is not None:
+            bounds.append(column > min(since) * cls.SHARDS)
+        return and_(*bounds, or_(*shards))
+
+
+@event.listens_for(ChangeCounter.__table__, 'after_create')
+def _create_counters(table, connection, **kwargs):  # pylint: disable=W0613
+    connection.execute(table.insert(), [
+        {'name': name, 'value': 0} for name in ChangeCounter.shard_names()])
+
+
+def _versioned_change(obj):
+    """
+    :return: True if the object has changes to attributes other than its
+        UNVERSIONED_COLUMNS
+    """
+    state = inspect(obj)
+    unversioned = getattr(obj, 'UNVERSIONED_COLUMNS', ())
+    return any(state.attrs[attr.key].history.has_changes()
+               for attr in state.mapper.column_attrs
+               if attr.key not in unversioned)
+
+
+@event.listens_for(SESSION_FACTORY, 'before_flush')
+def _set_revisions(session, flush_context, instances):  # pylint: disable=W0613
+    changed = [obj for obj in session.new
+               if obj.__tablename__ in ChangeCounter.TRACKED_TABLES]
+    # objects are dirty when any attribute is set, even to its old value
+    changed.extend(obj for obj in session.dirty
+                   if obj.__tablename__ in ChangeCounter.TRACKED_TABLES and
+                   _versioned_change(obj))
+    deleted = any(obj.__tablename__ in ChangeCounter.TRACKED_TABLES
+                  for obj in session.deleted)
+    if not changed and not deleted:
+        return
+
+    revision = ChangeCounter.bump_session(session)
+    for obj in changed:
+        obj.revision = revision
+
+
+@event.listens_for(SESSION_FACTORY, 'after_commit')
+@event.listens_for(SESSION_FACTORY, 'after_rollback')
+def _end_transaction(session):
+    session.info.pop(_BUMPED, None)
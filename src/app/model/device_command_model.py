@@ -0,0 +1,100 @@
+"""
+per-device outbox of the commands sent to devices in heartbeat responses
+"""
+from sqlalchemy import Column, String, Integer, Enum, TIMESTAMP, func, \
+    ForeignKey, select
+import enum
+
+from . import BASE, SESSION
+from .device_model import Device
+
+
+class DeviceCommand(BASE):
+    """
+    per-device outbox of commands waiting to be delivered to the device
+
+    Commands are numbered with a per-device sequence number
+    (Device.command_seq). Devices that acknowledge commands send the sequence
+    number of the last command they received in each heartbeat
+    (Device.acked_seq); acknowledged commands are removed the next time a
+    command is enqueued for the device.
+    """
+    __tablename__ = "device_command"
+
+    class Name(enum.Enum):
+        """ commands that are queued for a device """
+        START = "START"
+        STOP = "STOP"
+        STREAM = "STREAM"
+
+    device_id = Column(Integer, ForeignKey('device.id', ondelete='CASCADE'),
+                       primary_key=True)
+    seq = Column(Integer, primary_key=True, autoincrement=False)
+
+    name = Column(Enum(Name, name="device_command_name"), nullable=False)
+
+    # JSON encoded command parameters, sent to the device as is
+    parameters = Column(String)
+
+    creation_time = Column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+    @classmethod
+    def enqueue(cls, devices, name, parameters=None):
+        """
+        add a command to the outbox of each device. The device rows must be
+        locked (SELECT ... FOR UPDATE) by the caller, which is also
+        responsible for committing
+        :param devices: list of Device
+        :param name: DeviceCommand.Name
+        :param parameters: optional dictionary mapping device id to the
+            command's JSON encoded parameters
+        """
+        if not devices:
+            return
+        parameters = parameters or {}
+
+        # remove commands the devices have already acknowledged
+        acked_seq = select([Device.acked_seq]) \
+            .where(Device.id == cls.device_id).as_scalar()
+        SESSION.query(cls) \
+            .filter(cls.device_id.in_([d.id for d in devices]),
+                    cls.seq <= acked_seq) \
+            .delete(synchronize_session=False)
+
+        for device in devices:
+            device.command_seq += 1
+            SESSION.add(cls(device_id=device.id, seq=device.command_seq,
+                            name=name, parameters=parameters.get(device.id)))
+
+    @classmethod
+    def withdraw(cls, devices, name):
+        """
+        remove commands the devices haven't received yet from their outboxes
+        :param devices: list of Device
+        :param name: DeviceCommand.Name of the commands to remove
+        """
+        if not devices:
+            return
+        acked_seq = select([Device.acked_seq]) \
+            .where(Device.id == cls.device_id).as_scalar()
+        SESSION.query(cls) \
+            .filter(cls.device_id.in_([d.id for d in devices]),
+                    cls.seq > acked_seq, cls.name == name) \
+            .delete(synchronize_session=False)
+
+    @classmethod
+    def get_pending(cls, device):
+        """
+        get the commands the device hasn't acknowledged, in order
+        :param device: Device
+        :return: list of DeviceCommand
+        """
+        if not device.has_pending_commands():
+            return []
+        return SESSION.query(cls) \
+            .filter(cls.device_id == device.id, cls.seq > device.acked_seq) \
+            .order_by(cls.seq).all()
@@ -1,14 +1,21 @@
 import enum
 import pytz
 from sqlalchemy import Column, BigInteger, String, Integer, Float, \
-    TIMESTAMP, func, JSON, ForeignKey
+    TIMESTAMP, func, JSON, ForeignKey, DDL, event, type_coerce, and_, or_, \
+    case, Enum, Index, select
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.ext.hybrid import hybrid_method
 from datetime import datetime, timedelta
 import flask
-import json
 
-from . import BASE, MA, SESSION
+from . import BASE, MA, SESSION, SESSION_FACTORY
 from .utils.unique import UniqueMixin
+from .utils.write_behind import WriteBehindBuffer
+from .utils.notify import notify_after_commit
+from .utils.paginate import keyset_paginate
+from .change_counter_model import ChangeCounter
 from . import JaxMBADatabaseException
 from src.utils.exceptions import JaxMBAControlServiceException
 from src.utils.logging import get_module_logger
@@ -17,6 +24,13 @@ from src.app import model
 
 LOGGER = get_module_logger()
 
+# device columns that are rewritten by every heartbeat. When write-behind is
+# enabled (see the [TELEMETRY] section of the config file) these are buffered
+# and written in bulk, rather than by each heartbeat's transaction.
+# sensor_status isn't buffered, the camera state is read by the API (e.g. the
+# recording filter and the summary) and must not lag behind the device
+TELEMETRY_COLUMNS = ('last_update', 'load', 'free_ram', 'uptime', 'free_disk')
+
 
 class Device(UniqueMixin, BASE):
     """ model representing a data acquisition device """
@@ -43,6 +57,11 @@ class Device(UniqueMixin, BASE):
     # if the device is recording, this stores the ID of the recording session
     session_id = Column(Integer, ForeignKey('recording_session.id'))
 
+    # when the device went DOWN, recorded by the DOWN sweeper (see
+    # Device.sweep_down()) and cleared by the device's next heartbeat. Null
+    # while the device is up or until the sweeper notices it is DOWN
+    down_since = Column(TIMESTAMP(timezone=True))
+
     # last stream request -- this timestamp records the last time a client
     # requested the live stream for this device. If we don't get a request
     # after a specified duration, the device will stop streaming
@@ -63,7 +82,24 @@ class Device(UniqueMixin, BASE):
     uptime = Column(BigInteger)         # system uptime in seconds
     free_disk = Column(BigInteger)      # free disk space in megabytes
     total_disk = Column(BigInteger)     # total disk space in megabytes
-    sensor_status = Column(JSON)        # JSON encoded sensor status
+    # sensor status object sent by the device, stored as JSONB on PostgreSQL
+    sensor_status = Column(JSON().with_variant(postgresql.JSONB, 'postgresql'))
+
+    # sequence number of the last command added to the device's outbox (see
+    # DeviceCommand) and of the last command the device acknowledged
+    command_seq = Column(Integer, nullable=False, default=0, server_default='0')
+    acked_seq = Column(Integer, nullable=False, default=0, server_default='0')
+
+    # revision of the last change to the device (see ChangeCounter).
+    # Heartbeats that only rewrite the telemetry don't change it, unless the
+    # device was DOWN (see update_from_heartbeats())
+    revision = Column(BigInteger, nullable=False, default=0,
+                      server_default='0', index=True)
+    UNVERSIONED_COLUMNS = TELEMETRY_COLUMNS
+
+    # revision of devices inserted by register() until the transaction
+    # inserting them sets their revision
+    UNREGISTERED = -1
 
     @classmethod
     def unique_filter(cls, query, name):  # pylint: disable=W0222
@@ -78,6 +114,252 @@ class Device(UniqueMixin, BASE):
         """ get list of known devices """
         return SESSION.query(cls).order_by(cls.name).all()
 
+    @classmethod
+    def filter_devices(cls, query, state=None, location=None,
+                       session_id=None, recording=False):
+        """
+        filter a query of devices. All filters are evaluated in SQL
+        :param query: sqlalchemy query selecting from the device table
+        :param state: only include devices in this Device.State
+        :param location: only include devices whose location starts with this
+        :param session_id: only include devices assigned to this session
+        :param recording: if True only include devices whose camera is
+            recording
+        :return: filtered query
+        """
+        if state is not None:
+            query = query.filter(cls.in_state(state))
+        if location:
+            query = query.filter(cls.location.startswith(location,
+                                                         autoescape=True))
+        if session_id is not None:
+            query = query.filter(cls.session_id == session_id)
+        if recording:
+            query = query.filter(cls.camera_recording())
+        return query
+
+    @classmethod
+    def get_versions(cls, after=None, limit=None, max_limit=None, **filters):
+        """
+        get the id, name, last_update, session_id and down_since of devices,
+        without loading the rest of the row. A device's last_update changes
+        with every heartbeat, its session_id when it joins or leaves a
+        session and down_since when it is found to be DOWN, so together they
+        identify a version of the device
+        :param after: name of the last device of the previous page
+        :param limit: maximum number of devices, None for no limit
+        :param max_limit: will use the min of max_limit and limit if set
+        :param filters: filters passed to filter_devices()
+        :return: KeysetPage of (id, name, last_update, session_id, down_since)
+            tuples, in name order
+        """
+        query = cls.filter_devices(
+            SESSION.query(cls.id, cls.name, cls.last_update, cls.session_id,
+                          cls.down_since),
+            **filters)
+        return keyset_paginate(query, cls.name, after, limit, max_limit)
+
+    @classmethod
+    def get_changed(cls, since, until, down_after=None, down_before=None):
+        """
+        get devices changed by the revisions after since, up to and including
+        until. Devices don't change when they go DOWN, if down_after is given
+        devices that went DOWN between the two cutoffs are also included
+        :param since: ChangeCounter.get_revisions() already seen, None to get
+            every device
+        :param until: ChangeCounter.get_revisions() of the last revisions to
+            include
+        :param down_after: DOWN cutoff (see Device.down_cutoff()) when the
+            changes were last checked
+        :param down_before: current DOWN cutoff, defaults to down_cutoff()
+        :return: list of Device, in name order
+        """
+        changed = ChangeCounter.changed(cls.revision, since, until)
+        if down_after is not None:
+            down_before = down_before or cls.down_cutoff()
+            changed = or_(changed, and_(cls.last_update >= down_after,
+                                        cls.last_update < down_before))
+        return SESSION.query(cls).filter(changed).order_by(cls.name).all()
+
+    @classmethod
+    def get_by_ids(cls, device_ids):
+        """ get the devices with the given IDs """
+        return SESSION.query(cls).filter(cls.id.in_(device_ids)).all()
+
+    @classmethod
+    def camera_recording(cls):
+        """
+        SQL expression that is true for devices whose camera is recording.
+        On PostgreSQL this is a JSONB containment test, which can use the GIN
+        index on sensor_status
+        """
+        if SESSION.get_bind().dialect.name == 'postgresql':
+            return type_coerce(cls.sensor_status, postgresql.JSONB).contains(
+                {'camera': {'recording': True}})
+        return func.json_extract(cls.sensor_status, '$.camera.recording') == 1
+
+    @classmethod
+    def in_state(cls, state):
+        """
+        SQL expression that is true for devices in the given state, matching
+        Device.state(). Written as range and null tests rather than comparing
+        Device.state(), so it can use the index on (last_update, session_id)
+        :param state: Device.State
+        """
+        cutoff = cls.down_cutoff()
+        if state == cls.State.DOWN:
+            return cls.last_update < cutoff
+        if state == cls.State.BUSY:
+            return and_(cls.last_update >= cutoff, cls.session_id.isnot(None))
+        return and_(cls.last_update >= cutoff, cls.session_id.is_(None))
+
+    @classmethod
+    def get_version(cls, *extra):
+        """
+        cheap version of the devices and recording sessions, for ETags. It
+        changes whenever a device or session is changed, whenever telemetry
+        is written (which doesn't change the revision, but always changes the
+        latest last_update) and, because DOWN depends on the time rather than
+        on any change, whenever another device is DOWN. One query, using the
+        index on last_update
+        :param extra: scalar subqueries whose values are added to the version
+        :return: tuple
+        """
+        down = select([func.count()]).select_from(cls.__table__) \
+            .where(cls.in_state(cls.State.DOWN)).as_scalar()
+        latest = select([func.max(cls.last_update)]).as_scalar()
+        return ChangeCounter.get_version(down, latest, *extra)
+
+    @classmethod
+    def get_device_version(cls, device_id):
+        """
+        cheap version of a single device, for ETags, like get_version(): the
+        revision changes whenever the device is changed, last_update whenever
+        its telemetry is written, and whether it is DOWN depends on the time
+        :param device_id: device ID
+        :return: tuple, None if the device doesn't exist
+        """
+        row = SESSION.query(cls.revision, cls.last_update) \
+            .filter(cls.id == device_id).one_or_none()
+        if row is None:
+            return None
+        down = cls.__add_tz(row.last_update) < cls.down_cutoff()
+        return device_id, row.revision, row.last_update, down
+
+    @classmethod
+    def count_by_state(cls):
+        """
+        count devices in each state with a single query
+        :return: dictionary mapping every Device.State to a number of devices
+        """
+        # the same expression object must be selected and grouped by, so both
+        # are rendered with the same bind parameters. state is a hybrid
+        # method, called on the class it returns its SQL expression
+        state = cls.state()  # pylint: disable=E1120
+        counts = dict.fromkeys(cls.State, 0)
+        counts.update(SESSION.query(state, func.count(cls.id))
+                      .group_by(state).all())
+        return counts
+
+    @classmethod
+    def get_summary(cls, by_location=False):
+        """
+        summarize the fleet with a single GROUP BY query over the devices and
+        the statuses of their current recording sessions
+        :param by_location: also summarize the devices of each location
+        :return: dictionary with the 'total' summary and, if by_location, a
+            list of 'locations' summaries (each with a 'location', in location
+            order). A summary counts the devices in each state, the devices
+            recording or waiting to start recording for their session, the
+            devices whose camera is recording and adds up their disk space
+        """
+        status = model.DeviceRecordingStatus
+        # hybrid method, called on the class it returns its SQL expression
+        state = cls.state()  # pylint: disable=E1120
+        group_by = [state, cls.location] if by_location else [state]
+        rows = SESSION.query(
+            *group_by,
+            func.count(cls.id),
+            func.count(case([(status.status == status.Status.RECORDING, 1)])),
+            func.count(case([(status.status == status.Status.PENDING, 1)])),
+            func.count(case([(cls.camera_recording(), 1)])),
+            func.coalesce(func.sum(cls.total_disk), 0),
+            func.coalesce(func.sum(cls.free_disk), 0)
+        ).outerjoin(cls.active_status).group_by(*group_by).all()
+
+        keys = ('devices', 'recording', 'pending', 'camera_recording',
+                'total_disk', 'free_disk')
+
+        def empty():
+            summary = dict.fromkeys(keys, 0)
+            summary.update({s.name.lower(): 0 for s in cls.State})
+            return summary
+
+        total = empty()
+        locations = {}
+        for row in rows:
+            summaries = [total]
+            if by_location:
+                summaries.append(locations.setdefault(row[1], empty()))
+            values = row[len(group_by):]
+            for summary in summaries:
+                summary[row[0].name.lower()] += values[0]
+                for key, value in zip(keys, values):
+                    summary[key] += value
+
+        result = {'total': total}
+        if by_location:
+            # devices without a location sort first
+            result['locations'] = [
+                dict(locations[location], location=location)
+                for location in sorted(locations,
+                                       key=lambda l: (l is not None, l))
+            ]
+        return result
+
+    @classmethod
+    def sweep_down(cls):
+        """
+        record the devices that went DOWN since the last sweep, by setting
+        their down_since to the time their last heartbeat became older than
+        DOWN_DEVICE_THRESHOLD. The changes are committed, which publishes a
+        device event for each of them.
+
+        Devices found DOWN by an earlier sweep are excluded by the partial
+        index on last_update, so a sweep that finds nothing is a single
+        short index scan. Rows locked by a concurrent heartbeat (or sweeper)
+        are skipped, they are picked up by the next sweep if still DOWN
+        :return: list of (name, session_id, down_since) of the devices
+        """
+        threshold = timedelta(
+            seconds=flask.current_app.config['DOWN_DEVICE_THRESHOLD'])
+        devices = SESSION.query(cls) \
+            .filter(cls.down_since.is_(None),
+                    cls.last_update < cls.down_cutoff()) \
+            .order_by(cls.id) \
+            .with_for_update(skip_locked=True) \
+            .all()
+        swept = []
+        for device in devices:
+            device.down_since = cls.__add_tz(device.last_update) + threshold
+            swept.append((device.name, device.session_id, device.down_since))
+        if not swept:
+            SESSION.rollback()
+            return swept
+
+        try:
+            SESSION.commit()
+        except SQLAlchemyError:
+            SESSION.rollback()
+            raise JaxMBADatabaseException("Unable to record DOWN devices")
+        return swept
+
+    @classmethod
+    def get_recording_devices(cls):
+        """ get list of devices whose camera is recording """
+        return SESSION.query(cls).filter(cls.camera_recording()) \
+            .order_by(cls.name).all()
+
     @classmethod
     def get_by_id(cls, device_id):
         """ get a device by its ID """
@@ -108,62 +390,234 @@ class Device(UniqueMixin, BASE):
             return dt.replace(tzinfo=pytz.UTC)
         return dt
 
+    @classmethod
+    def lock_for_heartbeats(cls, names):
+        """
+        select devices by name along with the status row and recording
+        session for their active session (if any) in a single query. The
+        device rows are locked for update to guard against a possible race
+        condition where multiple users attempt to add a device to a recording
+        session at the same time. Rows are locked in id order so concurrent
+        batches of heartbeats (and telemetry flushes) can't deadlock each
+        other.
+        :param names: device names
+        :return: dictionary mapping name to Device for the devices that exist
+        """
+        devices = SESSION.query(cls) \
+            .outerjoin(cls.active_status) \
+            .outerjoin(cls.recording_session) \
+            .options(contains_eager(cls.active_status),
+                     contains_eager(cls.recording_session)) \
+            .filter(cls.name.in_(names)) \
+            .order_by(cls.id) \
+            .with_for_update(of=cls) \
+            .all()
+        return {d.name: d for d in devices}
+
+    @classmethod
+    def lock(cls, device_ids):
+        """
+        select devices by id and lock them for update, refreshing any that are
+        already loaded. Used before changes that must not race with the
+        device's heartbeats, such as adding commands to its outbox
+        :param device_ids: device ids, or a select returning them
+        :return: list of Device, in id order
+        """
+        return SESSION.query(cls) \
+            .filter(cls.id.in_(device_ids)) \
+            .order_by(cls.id) \
+            .with_for_update() \
+            .populate_existing() \
+            .all()
+
+    @classmethod
+    def register(cls, devices):
+        """
+        insert new devices. Concurrent first heartbeats from a device can both
+        find that it doesn't exist yet, so this must not fail if another
+        transaction inserted the device first, in that case the existing row
+        is returned instead.
+
+        PostgreSQL does this with a single INSERT ... ON CONFLICT (name) DO
+        UPDATE ... RETURNING, which also locks rows that already existed.
+        SQLite serializes writers, so existing rows are ignored and the devices
+        are selected again afterwards.
+
+        The device rows are locked before the change counter, so the rows are
+        inserted with a placeholder revision that tells them apart from
+        devices that already existed, and the revision of the new devices is
+        set once the counter has been incremented
+        :param devices: dictionary mapping the name of each new device to the
+            column values to insert
+        :return: dictionary mapping name to Device
+        """
+        rows = [dict(values, name=name, revision=cls.UNREGISTERED)
+                for name, values in sorted(devices.items())]
+
+        if SESSION.get_bind().dialect.name == 'postgresql':
+            stmt = postgresql.insert(cls.__table__).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[cls.__table__.c.name],
+                set_={'name': stmt.excluded.name}
+            ).returning(*cls.__table__.c)
+            registered = {d.name: d for d in SESSION.query(cls).instances(
+                SESSION.execute(stmt))}
+        else:
+            SESSION.execute(
+                cls.__table__.insert().prefix_with('OR IGNORE').values(rows))
+            registered = cls.lock_for_heartbeats(sorted(devices))
+
+        # rows inserted by other transactions already have their revision
+        inserted = [d for d in registered.values()
+                    if d.revision == cls.UNREGISTERED]
+        if inserted:
+            revision = ChangeCounter.bump_session(SESSION)
+            for device in inserted:
+                device.revision = revision
+        model.events.publish_registered(inserted)
+        return registered
+
     @staticmethod
     def update_from_heartbeat(**kwargs):
         """
         this method is used to update a device from information sent in a
         "heartbeat" message
+
+        The changes are not committed. The heartbeat is processed as a single
+        unit of work: the caller decides which command to send back to the
+        device, which may make further changes to the device and its session
+        status, and then calls finish_heartbeat() to commit everything at once
         """
-        name = kwargs.pop('name')
-        device, new_device = Device.as_unique(name=name)
-        heartbeat_timestamp = Device.__add_tz(kwargs.pop('last_update'))
-
-        # when we make updates to a device, we lock it to guard against a
-        # possible race condition where multiple users attempt to add the
-        # device to a recording session at the same time
-        if not new_device:
-            device = SESSION.query(Device).filter(Device.id == device.id).with_for_update().first()
-
-        # right now we are only comparing the timestamp in the heartbeat
-        # with the last_update timestamp to check for clock skew.
-        # the database doesn't store the heartbeat timestamp, but it does update
-        # the column automatically on update
-        if device.last_update is not None:
-            last_update = Device.__add_tz(device.last_update)
-            if last_update > heartbeat_timestamp:
-                # TODO consider time skew?
-                # do we want to check the timestamp contained in the hearbeat
-                # with the last update timestamp in the database? otherwise we
-                # should probably just get rid of the timestamp in the heartbeat
-                # payload and just let the database update the last_update
-                # column automatically
-                LOGGER.warning(
-                    "time skew detected: heartbeat has timestamp "
-                    f"{heartbeat_timestamp.isoformat()} but last update was "
-                    f"{last_update.isoformat()}"
-                )
-
-        device.last_update = Device.__add_tz(datetime.utcnow())
-        for attr in kwargs:
-            setattr(device, attr, kwargs[attr])
+        return Device.update_from_heartbeats([kwargs])[0]
+
+    @staticmethod
+    def update_from_heartbeats(heartbeats):
+        """
+        update a batch of devices from the information sent in their heartbeat
+        messages. All devices are loaded (and locked) with a single query, and
+        any changes are left for the caller to commit with finish_heartbeats()
+
+        If write-behind is enabled, the volatile telemetry of known devices
+        (TELEMETRY_COLUMNS) is not set on the device but added to
+        TELEMETRY_BUFFER when the heartbeats commit, to be written in bulk
+        later. Telemetry doesn't change the revision of the device, except
+        for devices that were DOWN, which are written straight away and get
+        a new revision so the change feed reports they are back
+        :param heartbeats: list of dictionaries, each one containing the
+            keyword arguments that would be passed to update_from_heartbeat()
+        :return: list of devices, in the same order as heartbeats
+        """
+        now = Device.__add_tz(datetime.utcnow())
+        values = []
+        for heartbeat in heartbeats:
+            kwargs = dict(heartbeat)
+            name = kwargs.pop('name')
+            heartbeat_timestamp = Device.__add_tz(kwargs.pop('last_update'))
+            kwargs['last_update'] = now
+            values.append((name, heartbeat_timestamp, kwargs))
+
+        devices = Device.lock_for_heartbeats(
+            sorted({name for name, _, _ in values}))
+
+        # devices we haven't heard from before are inserted along with the
+        # values from their (first) heartbeat
+        new_devices = {name: kwargs for name, _, kwargs in reversed(values)
+                       if name not in devices}
+        if new_devices:
+            devices.update(Device.register(new_devices))
+
+        # devices that were DOWN are back
+        back = {name for name, device in devices.items()
+                if name not in new_devices and (
+                    device.down_since is not None or
+                    device.state() == Device.State.DOWN)}
+
+        updated = []
+        for name, heartbeat_timestamp, kwargs in values:
+            device = devices[name]
+
+            # right now we are only comparing the timestamp in the heartbeat
+            # with the last_update timestamp to check for clock skew.
+            # the database doesn't store the heartbeat timestamp, but it does
+            # update the column automatically on update
+            if name not in new_devices and device.last_update is not None:
+                last_update = Device.__add_tz(device.last_update)
+                if last_update > heartbeat_timestamp:
+                    # TODO consider time skew?
+                    # do we want to check the timestamp contained in the
+                    # hearbeat with the last update timestamp in the database?
+                    # otherwise we should probably just get rid of the
+                    # timestamp in the heartbeat payload and just let the
+                    # database update the last_update column automatically
+                    LOGGER.warning(
+                        "time skew detected: heartbeat has timestamp "
+                        f"{heartbeat_timestamp.isoformat()} but last update was "
+                        f"{last_update.isoformat()}"
+                    )
+
+            if TELEMETRY_BUFFER.enabled and name not in new_devices and \
+                    name not in back:
+                kwargs = dict(kwargs)
+                TELEMETRY_BUFFER.add_after_commit(SESSION, device.id, {
+                    c: kwargs.pop(c) for c in TELEMETRY_COLUMNS if c in kwargs
+                })
+
+            for attr in kwargs:
+                setattr(device, attr, kwargs[attr])
+            if name in back:
+                # this is written synchronously even with write-behind so the
+                # change is seen straight away. Telemetry alone doesn't change
+                # the revision, so it is set here
+                device.down_since = None
+                device.revision = ChangeCounter.bump_session(SESSION)
+            updated.append(device)
+
+        return updated
+
+    @staticmethod
+    def finish_heartbeat(device):
+        """
+        commit all changes made while processing a heartbeat from a device
+        :param device: device that sent the heartbeat
+        """
+        Device.finish_heartbeats([device])
+
+    @staticmethod
+    def finish_heartbeats(devices):
+        """
+        commit all changes made while processing a batch of heartbeats
+
+        heartbeats that change a device row (for example its session) are
+        written synchronously, so with write-behind enabled their buffered
+        telemetry is taken out of the buffer and written along with them
+        :param devices: devices that sent the heartbeats
+        """
+        if TELEMETRY_BUFFER.enabled:
+            for device in devices:
+                if device.id is not None and SESSION.is_modified(device):
+                    telemetry = TELEMETRY_BUFFER.pop(device.id) or {}
+                    telemetry.update(TELEMETRY_BUFFER.pop_uncommitted(
+                        SESSION, device.id) or {})
+                    for attr, value in telemetry.items():
+                        setattr(device, attr, value)
         try:
             SESSION.commit()
         except SQLAlchemyError:
             SESSION.rollback()
-            raise JaxMBADatabaseException(f"Unable to update device {name}")
-
-        return device
+            names = ", ".join(sorted({d.name for d in devices}))
+            raise JaxMBADatabaseException(f"Unable to update devices {names}")
 
-    def clear_session(self):
+    def clear_session(self, commit=True):
         """ clear session info from device """
         self.session_id = None
-        try:
-            SESSION.commit()
-        except SQLAlchemyError:
-            SESSION.rollback()
-            raise JaxMBADatabaseException("Unable to clear session_id")
+        if commit:
+            try:
+                SESSION.commit()
+            except SQLAlchemyError:
+                SESSION.rollback()
+                raise JaxMBADatabaseException("Unable to clear session_id")
 
-    def join_session(self, session):
+    def join_session(self, session, commit=True):
         """
         change device's session status from PENDING to RECORDING
 
@@ -174,29 +628,51 @@ class Device(UniqueMixin, BASE):
         this is called after a device starts recording to transition its state
         from PENDING to RECORDING
         :param session: session this device will join
+        :param commit: if False the change is left for the caller to commit
         :return: no return value
         """
         if self.session_id == session.id:
-            status = model.DeviceRecordingStatus.get(self, session)
-            self.session_id = session.id
+            status = self.active_status
             status.status = model.DeviceRecordingStatus.Status.RECORDING
-            try:
-                SESSION.commit()
-            except SQLAlchemyError:
-                SESSION.rollback()
-                raise JaxMBADatabaseException("Unable to join session")
+            if commit:
+                try:
+                    SESSION.commit()
+                except SQLAlchemyError:
+                    SESSION.rollback()
+                    raise JaxMBADatabaseException("Unable to join session")
         else:
             raise JaxMBAControlServiceException(
                 "device already part of another session")
 
+    def has_pending_commands(self):
+        """ True if the device has commands it hasn't acknowledged """
+        return self.command_seq > self.acked_seq
+
+    def acknowledge_commands(self, seq):
+        """
+        record that the device received the commands in its outbox up to seq
+        :param seq: sequence number of the last command received
+        """
+        seq = min(seq, self.command_seq)
+        if seq > self.acked_seq:
+            self.acked_seq = seq
+
     def request_live_stream(self):
         """ Request that this device stream live video """
         # currently we can only enable live streaming if the device is recording
-        camera_status = json.loads(self.sensor_status).get('camera')
+        camera_status = (self.sensor_status or {}).get('camera')
         if not camera_status or not camera_status.get('recording'):
             raise JaxMBAControlServiceException("device camera is not active")
 
+        Device.lock([self.id])
         self.last_stream_request = Device.__add_tz(datetime.utcnow())
+
+        # the stream is requested repeatedly while it is being watched, only
+        # queue a STREAM command if the device doesn't already have one
+        pending = model.DeviceCommand.get_pending(self)
+        if not any(c.name == model.DeviceCommand.Name.STREAM for c in pending):
+            model.DeviceCommand.enqueue([self], model.DeviceCommand.Name.STREAM)
+        notify_after_commit(SESSION, [self.id])
         try:
             SESSION.commit()
         except SQLAlchemyError:
@@ -204,6 +680,8 @@ class Device(UniqueMixin, BASE):
             raise JaxMBADatabaseException("Unable to request live stream")
 
     def is_stream_active(self):
+        if self.last_stream_request is None:
+            return False
         try:
             delta = datetime.utcnow() - self.last_stream_request
         except TypeError:
@@ -212,16 +690,133 @@ class Device(UniqueMixin, BASE):
             return False
         return True
 
+    @hybrid_method
     def state(self):
-        cutoff = self.__add_tz(datetime.utcnow() - timedelta(
+        """
+        the device's state. Used on the class, Device.state() is the
+        equivalent SQL expression, which can be used in filter(), order_by()
+        and group_by(). To filter on a single state prefer in_state(), which
+        can use the index on (last_update, session_id)
+        """
+        return Device.derive_state(self.last_update, self.session_id)
+
+    @state.expression
+    def state(cls):  # pylint: disable=E0213
+        return type_coerce(
+            case([(cls.last_update < cls.down_cutoff(), cls.State.DOWN.name),
+                  (cls.session_id.isnot(None), cls.State.BUSY.name)],
+                 else_=cls.State.IDLE.name),
+            Enum(cls.State, native_enum=False, create_constraint=False))
+
+    @staticmethod
+    def down_cutoff():
+        """ devices that haven't sent a heartbeat since this time are DOWN """
+        return Device.__add_tz(datetime.utcnow() - timedelta(
             seconds=flask.current_app.config['DOWN_DEVICE_THRESHOLD']))
 
-        if self.__add_tz(self.last_update) < cutoff:
-            return self.State.DOWN
-        elif self.session_id:
-            return self.State.BUSY
+    @staticmethod
+    def derive_state(last_update, session_id, down_cutoff=None):
+        """
+        state of a device with the given last_update and session_id. DOWN
+        depends on the current time, so it is always derived when needed
+        rather than stored
+        :param down_cutoff: result of down_cutoff(), to avoid recomputing it
+            when deriving the state of many devices
+        """
+        if down_cutoff is None:
+            down_cutoff = Device.down_cutoff()
+        if Device.__add_tz(last_update) < down_cutoff:
+            return Device.State.DOWN
+        elif session_id:
+            return Device.State.BUSY
+        else:
+            return Device.State.IDLE
+
+
+def _telemetry_written(conn, device_ids):
+    """
+    buffered telemetry includes last_update, so devices recorded as DOWN
+    since it was buffered are back. Those get a new revision, telemetry alone
+    doesn't change it (see Device.UNVERSIONED_COLUMNS)
+    """
+    table = Device.__table__
+    back = [row.id for row in conn.execute(
+        select([table.c.id]).where(and_(table.c.id.in_(device_ids),
+                                        table.c.down_since.isnot(None))))]
+    if back:
+        revision = ChangeCounter.bump(conn)
+        conn.execute(table.update().where(table.c.id.in_(back))
+                     .values(revision=revision, down_since=None))
+
+
+TELEMETRY_BUFFER = WriteBehindBuffer(Device.__table__, TELEMETRY_COLUMNS,
+                                     version_column='last_update',
+                                     after_write=_telemetry_written)
+TELEMETRY_BUFFER.listen(SESSION_FACTORY)
+
+# used to find devices in a state (see Device.in_state), DOWN devices by a
+# range scan on last_update
+Index('ix_device_last_update_session_id', Device.last_update,
+      Device.session_id)
+
+# used by Device.sweep_down() to find devices that went DOWN. Only devices not
+# yet found DOWN are indexed, so the sweep doesn't rescan devices that have
+# been DOWN for a long time
+Index('ix_device_live_last_update', Device.last_update,
+      postgresql_where=Device.down_since.is_(None),
+      sqlite_where=Device.down_since.is_(None))
+
+# GIN index used by Device.camera_recording() and other containment (@>)
+# queries on sensor_status. PostgreSQL only, see migrate_sensor_status for
+# existing databases
+SENSOR_STATUS_INDEX = DDL(
+    "CREATE INDEX IF NOT EXISTS ix_device_sensor_status ON device "
+    "USING gin (sensor_status jsonb_path_ops)"
+).execute_if(dialect='postgresql')
+event.listen(Device.__table__, 'after_create', SENSOR_STATUS_INDEX)
+
+
+def migrate_sensor_status(engine):
+    """
+    sensor_status used to be stored as a JSON encoded string inside the JSON
+    column. convert existing values to JSON objects and, on PostgreSQL,
+    convert the column to JSONB and create its index. Safe to run more than
+    once
+    :param engine: sqlalchemy engine
+    :return: number of rows converted
+    """
+    with engine.begin() as conn:
+        if engine.dialect.name != 'postgresql':
+            return conn.execute(
+                "UPDATE device SET sensor_status = "
+                "json_extract(sensor_status, '$') "
+                "WHERE json_type(sensor_status) = 'text'"
+            ).rowcount
+
+        column_type = conn.execute(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = 'device' AND column_name = 'sensor_status'"
+        ).scalar()
+        converted = 0
+        if column_type == 'json':
+            converted = conn.execute(
+                "SELECT count(*) FROM device "
+                "WHERE json_typeof(sensor_status) = 'string'"
+            ).scalar()
+            conn.execute(
+                "ALTER TABLE device ALTER COLUMN sensor_status TYPE jsonb "
+                "USING CASE WHEN json_typeof(sensor_status) = 'string' "
+                "THEN (sensor_status #>> '{}')::jsonb "
+                "ELSE sensor_status::jsonb END"
+            )
         else:
-            return self.State.IDLE
+            converted = conn.execute(
+                "UPDATE device SET sensor_status = "
+                "(sensor_status #>> '{}')::jsonb "
+                "WHERE jsonb_typeof(sensor_status) = 'string'"
+            ).rowcount
+        SENSOR_STATUS_INDEX.execute(bind=conn)
+        return converted
 
 
 class DeviceSchema(MA.ModelSchema):
@@ -0,0 +1,146 @@
+"""
+Events published to subscribers of the event stream (GET /api/events) when
+the state of a device, a device session status or a recording session
+changes. See src.app.model.utils.notify for how events are delivered.
+
+Each event is a dictionary with the event type ('device', 'device_status' or
+'session') and its data. Events carry the new state, not the change, so
+receiving an event more than once is harmless.
+
+Devices go DOWN without anything being written, their DOWN events are
+published by the DOWN sweeper (see src.app.model.sweeper) when it records
+them. Devices that were DOWN are written by their next heartbeat, even with
+write-behind, so coming back up is seen by the flush listener.
+"""
+import flask
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
+
+from . import SESSION, SESSION_FACTORY
+from .device_model import Device
+from .recording_session_model import RecordingSession, DeviceRecordingStatus
+from .utils.notify import publish_after_commit
+
+
+def device_event(device, state):
+    """
+    event for a device whose state changed
+    :param device: Device, or a row with its id, name, session_id and
+        down_since
+    :param state: the device's new Device.State
+    """
+    down_since = device.down_since.isoformat() if device.down_since else None
+    return {'event': 'device',
+            'data': {'id': device.id, 'name': device.name, 'state': state.name,
+                     'session_id': device.session_id,
+                     'down_since': down_since}}
+
+
+def device_status_event(status):
+    """ event for a changed DeviceRecordingStatus """
+    return {'event': 'device_status',
+            'data': {'device_id': status.device_id,
+                     'session_id': status.session_id,
+                     'status': status.status.name,
+                     'message': status.message}}
+
+
+def session_event(session):
+    """ event for a RecordingSession whose status changed """
+    return {'event': 'session',
+            'data': {'id': session.id, 'status': session.status.name}}
+
+
+def events_enabled():
+    """ :return: True if the event stream is enabled in the app config """
+    return flask.has_app_context() and \
+        flask.current_app.config['EVENTS_ENABLED']
+
+
+def _old_value(obj, attr):
+    history = get_history(obj, attr)
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attr)
+
+
+def _changed(obj, *attrs):
+    return any(get_history(obj, attr).has_changes() for attr in attrs)
+
+
+@event.listens_for(SESSION_FACTORY, 'after_flush')
+def _collect_events(session, flush_context):  # pylint: disable=W0613
+    if not events_enabled():
+        return
+
+    down_cutoff = Device.down_cutoff()
+    events = []
+    for obj in session.new:
+        if isinstance(obj, RecordingSession):
+            events.append(session_event(obj))
+        elif isinstance(obj, DeviceRecordingStatus):
+            events.append(device_status_event(obj))
+
+    for obj in session.dirty:
+        if isinstance(obj, Device):
+            if not _changed(obj, 'last_update', 'session_id', 'down_since'):
+                continue
+            old_state = Device.derive_state(_old_value(obj, 'last_update'),
+                                            _old_value(obj, 'session_id'),
+                                            down_cutoff)
+            state = Device.derive_state(obj.last_update, obj.session_id,
+                                        down_cutoff)
+            # the DOWN sweeper records devices that are already DOWN
+            if state != old_state or _changed(obj, 'down_since'):
+                events.append(device_event(obj, state))
+        elif isinstance(obj, DeviceRecordingStatus):
+            if _changed(obj, 'status', 'message'):
+                events.append(device_status_event(obj))
+        elif isinstance(obj, RecordingSession):
+            if _changed(obj, 'status'):
+                events.append(session_event(obj))
+
+    if events:
+        publish_after_commit(session, events)
+
+
+def publish_registered(devices):
+    """
+    publish events for devices that were just registered (inserted with Core
+    statements, so they aren't seen by the flush listener). The events are
+    published when the session commits
+    :param devices: list of Device
+    """
+    if not events_enabled():
+        return
+    down_cutoff = Device.down_cutoff()
+    publish_after_commit(SESSION, [
+        device_event(d, Device.derive_state(d.last_update, d.session_id,
+                                            down_cutoff))
+        for d in devices
+    ])
+
+
+def publish_canceled(session_ids, statuses):
+    """
+    publish events for sessions and device statuses that were canceled with
+    set based UPDATEs (so they aren't seen by the flush listener). The events
+    are published when the session commits
+    :param session_ids: IDs of the canceled sessions
+    :param statuses: rows with the device_id, session_id and message of the
+        canceled device statuses
+    """
+    if not events_enabled():
+        return
+    publish_after_commit(SESSION, [
+        {'event': 'session',
+         'data': {'id': session_id,
+                  'status': RecordingSession.Status.CANCELED.name}}
+        for session_id in session_ids
+    ] + [
+        {'event': 'device_status',
+         'data': {'device_id': s.device_id, 'session_id': s.session_id,
+                  'status': DeviceRecordingStatus.Status.CANCELED.name,
+                  'message': s.message}}
+        for s in statuses
+    ])
@@ -1,16 +1,33 @@
-from sqlalchemy import Column, String, Integer, Enum, \
-    TIMESTAMP, func, ForeignKey, Boolean, select
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import relationship, deferred
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
 import enum
+import json
+
+from sqlalchemy import Column, String, Integer, BigInteger, Enum, \
+    TIMESTAMP, func, ForeignKey, Boolean, select, and_, or_, event, exists, \
+    Index, case, null, union_all
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import relationship, deferred, foreign, selectinload, \
+    column_property, contains_eager
+from sqlalchemy.orm.attributes import get_history
+import pytz
 
-from . import BASE, MA, SESSION
-from . import JaxMBADatabaseException
+from src.app import model
 from src.utils.logging import get_module_logger
+from . import BASE, MA, SESSION, SESSION_FACTORY
+from . import JaxMBADatabaseException, UnknownDeviceException
+from .utils.notify import notify_after_commit
 from .device_model import Device
+from .device_command_model import DeviceCommand
+from .change_counter_model import ChangeCounter
+from .utils.paginate import keyset_paginate
 
 LOGGER = get_module_logger()
 
+# session.info key of the objects flushed by a transaction whose recording
+# session may have become complete
+_FINISHED = 'finished_recording_sessions'
+
 
 class RecordingSession(BASE):
     """
@@ -59,6 +76,33 @@ class RecordingSession(BASE):
     # target frame capture rate
     target_fps = Column(Integer, nullable=False)
 
+    # revision of the last change to the session (see ChangeCounter)
+    revision = Column(BigInteger, nullable=False, default=0,
+                      server_default='0', index=True)
+
+    # number of the session's device statuses in each
+    # DeviceRecordingStatus.Status, maintained on every status change (see
+    # _count_statuses) so they can be read without loading the statuses
+    pending_count = Column(Integer, nullable=False, default=0,
+                           server_default='0')
+    recording_count = Column(Integer, nullable=False, default=0,
+                             server_default='0')
+    complete_count = Column(Integer, nullable=False, default=0,
+                            server_default='0')
+    failed_count = Column(Integer, nullable=False, default=0,
+                          server_default='0')
+    canceled_count = Column(Integer, nullable=False, default=0,
+                            server_default='0')
+
+    # devices are sent their START command in waves of start_wave_size
+    # devices, start_wave_interval seconds apart, so they don't all join the
+    # session at the same time. Null if every device is started right away
+    start_wave_size = Column(Integer)
+    start_wave_interval = Column(Integer)
+
+    # number of START waves, null if the devices aren't started in waves
+    start_waves = Column(Integer)
+
     # devices associated with this recording session
     devices = relationship("Device", backref="recording_session")
     device_statuses = relationship("DeviceRecordingStatus",
@@ -66,6 +110,70 @@ class RecordingSession(BASE):
                                    cascade="all, delete, delete-orphan",
                                    order_by="DeviceRecordingStatus.device_name")
 
+    def start_parameters(self, status):
+        """
+        parameters of the START command for a device in this session
+        :param status: the device's DeviceRecordingStatus for this session
+        :return: JSON encoded parameters
+        """
+        return json.dumps({
+            'session_id': self.id,
+            'duration': self.duration,
+            'fragment_hourly': self.fragment_hourly,
+            'file_prefix': status.file_prefix,
+            'target_fps': self.target_fps,
+            'apply_filter': self.apply_filter
+        })
+
+    def wave_start_time(self, wave):
+        """
+        when the devices of a START wave are sent their START command
+        :param wave: wave number, 0 for the devices started right away
+        :return: timezone aware datetime
+        """
+        start = self.creation_time
+        if start.tzinfo is None:
+            # SQLite returns the UTC timestamp without tzinfo
+            start = start.replace(tzinfo=pytz.UTC)
+        return start + timedelta(
+            seconds=wave * (self.start_wave_interval or 0))
+
+    def can_start(self, status, now=None):
+        """
+        has the START wave of a device been reached
+        :param status: the device's DeviceRecordingStatus for this session
+        :param now: timezone aware datetime, defaults to the current time
+        :return: True if the device may be sent its START command
+        """
+        if not status.start_wave:
+            return True
+        return self.wave_start_time(status.start_wave) <= \
+            (now or datetime.now(pytz.UTC))
+
+    @property
+    def started_waves(self):
+        """
+        number of START waves that have been reached, None if the devices
+        aren't started in waves
+        """
+        if not self.start_waves or not self.start_wave_interval:
+            return None
+        elapsed = (datetime.now(pytz.UTC) -
+                   self.wave_start_time(0)).total_seconds()
+        return max(0, min(self.start_waves,
+                          int(elapsed // self.start_wave_interval) + 1))
+
+    @property
+    def next_wave_time(self):
+        """
+        when the next START wave is reached, None if every wave has been
+        reached or the devices aren't started in waves
+        """
+        started = self.started_waves
+        if started is None or started >= self.start_waves:
+            return None
+        return self.wave_start_time(started)
+
     def archive(self):
         self.archived = True
 
@@ -76,9 +184,12 @@ class RecordingSession(BASE):
             raise JaxMBADatabaseException("unable to archive recording session")
 
     def cancel(self):
+        canceled = []
         for ds in self.device_statuses:
             if ds.status == DeviceRecordingStatus.Status.PENDING or ds.status == DeviceRecordingStatus.Status.RECORDING:
                 ds.status = DeviceRecordingStatus.Status.CANCELED
+                canceled.append(ds.device_id)
+        queue_stop(canceled)
         self.status = self.Status.CANCELED
         try:
             SESSION.commit()
@@ -86,76 +197,329 @@ class RecordingSession(BASE):
             SESSION.rollback()
             raise JaxMBADatabaseException("unable to cancel recording session")
 
-    def update_status(self):
-        if self.status == self.Status.IN_PROGRESS:
-            for ds in self.device_statuses:
-                if ds.status in [DeviceRecordingStatus.Status.RECORDING, DeviceRecordingStatus.Status.PENDING]:
-                    # still in progress
-                    return
-            self.status = self.Status.COMPLETE
-            try:
-                SESSION.commit()
-            except SQLAlchemyError:
-                SESSION.rollback()
-                raise JaxMBADatabaseException(
-                    "unable to cancel recording session")
+    @classmethod
+    def cancel_and_archive(cls, cancel=False, archive=False, session_ids=None,
+                           **filters):
+        """
+        cancel and/or archive many sessions with a few set based statements,
+        in a single transaction. Canceling marks the IN_PROGRESS sessions
+        CANCELED, along with their PENDING and RECORDING devices, and queues a
+        STOP command for those devices
+        :param cancel: cancel the sessions that are IN_PROGRESS
+        :param archive: archive the sessions that aren't archived yet
+        :param session_ids: only include sessions with these IDs
+        :param filters: filters passed to filter_sessions()
+        :return: dictionary with the number of sessions that 'matched' and
+            that were 'canceled' and 'archived', and the number of devices
+            'stopped'
+        """
+        query = cls.filter_sessions(SESSION.query(cls.id), **filters)
+        if session_ids is not None:
+            query = query.filter(cls.id.in_(session_ids))
+        matching = query.subquery()
+        counts = {
+            'matched': SESSION.query(func.count()).select_from(matching)
+                       .scalar(),
+            'canceled': 0, 'archived': 0, 'stopped': 0
+        }
+        matching = select([matching.c.id])
+
+        canceled, stopped = [], []
+        if cancel:
+            canceled = [session_id for session_id, in SESSION.query(cls.id)
+                        .filter(cls.id.in_(matching),
+                                cls.status == cls.Status.IN_PROGRESS)]
+        if canceled:
+            # devices are locked before the change counter and the sessions
+            stopped = stop_active_devices(canceled)
+
+        if not canceled and not archive:
+            SESSION.rollback()
+            return counts
+
+        # these statements bypass the ORM, so they set the revisions and
+        # status counters that the flush listeners maintain
+        revision = ChangeCounter.bump_session(SESSION)
+        # archived first, the filters may no longer match canceled sessions
+        if archive:
+            counts['archived'] = SESSION.query(cls).filter(
+                cls.id.in_(matching), cls.archived.is_(False)
+            ).update({cls.archived: True, cls.revision: revision},
+                     synchronize_session=False)
+        if canceled:
+            values = {
+                DeviceRecordingStatus.status:
+                    DeviceRecordingStatus.Status.CANCELED,
+                DeviceRecordingStatus.revision: revision
+            }
+            # the recording time is only computed while a device is
+            # RECORDING (see _stop_recording_time), write the time recorded
+            # so far. A device is only active in one session, so its id
+            # identifies its status
+            now = datetime.now(pytz.UTC)
+            recorded = {
+                s.device_id: DeviceRecordingStatus.time_recorded(s, now)
+                for s in stopped
+                if s.status == DeviceRecordingStatus.Status.RECORDING
+            }
+            if recorded:
+                values[DeviceRecordingStatus.reported_time] = case(
+                    recorded, value=DeviceRecordingStatus.device_id,
+                    else_=DeviceRecordingStatus.reported_time)
+            SESSION.query(DeviceRecordingStatus).filter(
+                DeviceRecordingStatus.session_id.in_(canceled),
+                DeviceRecordingStatus.status.in_(DeviceRecordingStatus.ACTIVE)
+            ).update(values, synchronize_session=False)
+            counts['canceled'] = SESSION.query(cls).filter(
+                cls.id.in_(canceled), cls.status == cls.Status.IN_PROGRESS
+            ).update({
+                cls.status: cls.Status.CANCELED,
+                cls.canceled_count: cls.canceled_count + cls.pending_count +
+                                    cls.recording_count,
+                cls.pending_count: 0,
+                cls.recording_count: 0,
+                cls.revision: revision
+            }, synchronize_session=False)
+            counts['stopped'] = len(stopped)
+            model.events.publish_canceled(canceled, stopped)
+
+        try:
+            SESSION.commit()
+        except SQLAlchemyError:
+            SESSION.rollback()
+            raise JaxMBADatabaseException(
+                "unable to cancel or archive recording sessions")
+        return counts
 
     @classmethod
-    def get(cls):
-        return SESSION.query(cls).filter(cls.archived == False).order_by(cls.creation_time.desc()).all()
+    def live_since(cls, session_id=None, archived=False):
+        """
+        SQL expression for the latest time that fields of sessions changing
+        with time alone are computed from: the recording times of RECORDING
+        devices are computed from when they started recording, the START
+        waves of IN_PROGRESS sessions from when the session was created
+        :param session_id: session ID, None for every session that isn't
+            archived
+        :param archived: True for archived sessions, none of their fields
+            change with time
+        :return: scalar subquery, NULL if no field changes with time
+        """
+        if archived:
+            return null()
+        status = DeviceRecordingStatus
+        started = select([status.recording_started.label('since')]).where(
+            and_(status.status == status.Status.RECORDING,
+                 status.recording_started.isnot(None)))
+        waves = select([cls.creation_time.label('since')]).where(
+            and_(cls.status == cls.Status.IN_PROGRESS, cls.start_waves > 1))
+        if session_id is not None:
+            started = started.where(status.session_id == session_id)
+            waves = waves.where(cls.id == session_id)
+        else:
+            started = started.where(status.session_id.in_(
+                select([cls.id]).where(cls.archived.is_(False))))
+            waves = waves.where(cls.archived.is_(False))
+        since = union_all(started, waves).alias()
+        return select([func.max(since.c.since)]).as_scalar()
 
     @classmethod
-    def get_archived(cls):
-        return SESSION.query(cls).filter(cls.archived).order_by(
-            cls.creation_time.desc()).all()
+    def get(cls, *options):
+        """
+        :param options: loader options, e.g. load_statuses()
+        :return: list of sessions that aren't archived, newest first
+        """
+        return SESSION.query(cls).options(*options) \
+            .filter(cls.archived == False) \
+            .order_by(cls.creation_time.desc()).all()
+
+    @classmethod
+    def get_archived(cls, *options, after=None, limit=None, max_limit=None,
+                     **filters):
+        """
+        get a page of archived sessions, newest first
+        :param options: loader options, e.g. load_statuses()
+        :param after: id of the last session of the previous page
+        :param limit: maximum number of sessions, None for no limit
+        :param max_limit: will use the min of max_limit and limit if set
+        :param filters: filters passed to filter_sessions()
+        :return: KeysetPage of RecordingSession, its next_key is the
+            (creation_time, id) of the last session
+        """
+        query = cls.filter_sessions(
+            SESSION.query(cls).options(*options).filter(cls.archived),
+            **filters)
+        if after is not None:
+            # continue from the creation_time stored in the database, rather
+            # than one passed in, so the comparison doesn't depend on how the
+            # database stores or rounds timestamps
+            after = (select([cls.creation_time]).where(cls.id == after)
+                     .as_scalar(), after)
+        return keyset_paginate(query, (cls.creation_time, cls.id), after,
+                               limit, max_limit, descending=True)
+
+    @classmethod
+    def filter_sessions(cls, query, name=None, created_after=None,  # pylint: disable=R0913
+                        created_before=None, device_id=None, status=None):
+        """
+        filter a query of recording sessions. All filters are evaluated in SQL
+        :param query: sqlalchemy query selecting from the recording_session
+            table
+        :param name: only include sessions whose name contains this (case
+            insensitive)
+        :param created_after: only include sessions created at or after this
+            datetime
+        :param created_before: only include sessions created before this
+            datetime
+        :param device_id: only include sessions this device was part of
+        :param status: only include sessions in this RecordingSession.Status
+        :return: filtered query
+        """
+        if name:
+            query = query.filter(func.lower(cls.name).contains(
+                name.lower(), autoescape=True))
+        if created_after is not None:
+            query = query.filter(cls.creation_time >= created_after)
+        if created_before is not None:
+            query = query.filter(cls.creation_time < created_before)
+        if device_id is not None:
+            # uses the primary key of device_recording_status, which starts
+            # with device_id
+            query = query.filter(exists().where(and_(
+                DeviceRecordingStatus.session_id == cls.id,
+                DeviceRecordingStatus.device_id == device_id)))
+        if status is not None:
+            query = query.filter(cls.status == status)
+        return query
 
     @classmethod
-    def get_by_id(cls, session_id):
-        return SESSION.query(cls).get(session_id)
+    def get_by_id(cls, session_id, *options):
+        """
+        :param session_id: session ID
+        :param options: loader options, e.g. load_statuses()
+        :return: RecordingSession, None if it doesn't exist
+        """
+        # a query rather than get(), which would return a session already in
+        # the identity map without applying the options
+        return SESSION.query(cls).options(*options) \
+            .filter(cls.id == session_id).one_or_none()
 
     @staticmethod
-    def create(device_spec, duration, name, fragment_hourly, target_fps,
-               apply_filter):
+    def load_statuses(device_columns=None):
+        """
+        loader option that loads the device statuses of the sessions a query
+        returns, along with their devices, with a single extra query rather
+        than a query per session and another per device
+        :param device_columns: names of the device attributes to load, None
+            to load every column
+        """
+        option = selectinload(RecordingSession.device_statuses) \
+            .joinedload(DeviceRecordingStatus.device)
+        if device_columns is not None:
+            option = option.load_only(*device_columns)
+        return option
+
+    @classmethod
+    def get_changed(cls, since, until):
+        """
+        get sessions changed by the revisions after since, up to and
+        including until
+        :param since: ChangeCounter.get_revisions() already seen, None to
+            get every session
+        :param until: ChangeCounter.get_revisions() of the last revisions to
+            include
+        :return: list of RecordingSession
+        """
+        return SESSION.query(cls).filter(
+            ChangeCounter.changed(cls.revision, since, until)) \
+            .order_by(cls.id).all()
 
+    @staticmethod
+    def create(device_spec, duration, name, fragment_hourly, target_fps,  # pylint: disable=R0913
+               apply_filter, start_wave_size=None, start_wave_interval=None):
+        """
+        create a recording session and queue a START command for each of its
+        devices. Devices already in a session get a FAILED status instead.
+        If start_wave_size is given the devices are assigned to START waves in
+        id order, and only get their START command once their wave is reached
+        (see can_start())
+        :param device_spec: list of dictionaries with a device_id and
+            filename_prefix
+        :param duration: recording duration in seconds
+        :param name: session name
+        :param fragment_hourly: should the devices fragment files hourly
+        :param target_fps: target frame rate
+        :param apply_filter: pass frames through the filter graph
+        :param start_wave_size: number of devices sent START at a time, None
+            to start every device right away
+        :param start_wave_interval: seconds between START waves
+        :return: the new RecordingSession
+        :raises UnknownDeviceException: if any of the devices doesn't exist,
+            nothing is created
+        """
         new_session = RecordingSession(
             duration=duration,
             fragment_hourly=fragment_hourly,
             target_fps=target_fps,
             apply_filter=apply_filter,
-            name=name
+            name=name,
+            start_wave_size=start_wave_size,
+            start_wave_interval=start_wave_interval if start_wave_size else None
         )
 
-        # select the devices and lock them for update to avoid race conditions
-        # adding devices to multiple recording sessions at the same time
-        device_ids = [d['device_id'] for d in device_spec]
-        file_prefixes = {}
-        for spec in device_spec:
-            file_prefixes[spec['device_id']] = spec['filename_prefix']
-        devices = SESSION.query(Device).filter(Device.id.in_(device_ids)).with_for_update().all()
-
-        for device in devices:
-            if device.session_id is None:
-                status = DeviceRecordingStatus(
-                    device_id=device.id,
-                    file_prefix=file_prefixes[device.id],
-                    status=DeviceRecordingStatus.Status.PENDING
-                )
-                # only add the device to the session if it wasn't already
-                # assigned to a session
-                new_session.devices.append(device)
-            else:
-                # device already in use, don't make the relationship from the
-                # session to the device, but we still record a failed status 
-                status = DeviceRecordingStatus(
-                    device_id=device.id,
-                    status=DeviceRecordingStatus.Status.FAILED,
-                    message=f"device {device.name} is already assigned to a recording session ({device.session_id})"
-                )
-
-            new_session.device_statuses.append(status)
+        file_prefixes = {spec['device_id']: spec['filename_prefix']
+                         for spec in device_spec}
+
+        # validate, select and lock the devices with a single query, to avoid
+        # race conditions adding devices to multiple recording sessions at the
+        # same time. Locking in id order keeps concurrent sessions sharing
+        # devices from deadlocking
+        devices = SESSION.query(Device) \
+            .filter(Device.id.in_(file_prefixes)) \
+            .order_by(Device.id).with_for_update().all()
+        if len(devices) != len(file_prefixes):
+            unknown = sorted(set(file_prefixes) - {d.id for d in devices})
+            SESSION.rollback()
+            raise UnknownDeviceException(unknown)
+
+        # only add devices that weren't already assigned to a session, the
+        # others still get a failed status
+        available = [d for d in devices if d.session_id is None]
+        waves = {}
+        if start_wave_size:
+            waves = {d.id: i // start_wave_size
+                     for i, d in enumerate(available)}
+            new_session.start_waves = -(-len(available) // start_wave_size)
+        # assigning whole collections, rather than appending to them one at a
+        # time, and flushing them as one INSERT (and UPDATE of the devices)
+        # per table
+        new_session.devices = available
+        new_session.device_statuses = [
+            DeviceRecordingStatus(
+                device_id=device.id,
+                file_prefix=file_prefixes[device.id],
+                status=DeviceRecordingStatus.Status.PENDING,
+                start_wave=waves.get(device.id, 0)
+            ) if device.session_id is None else DeviceRecordingStatus(
+                device_id=device.id,
+                status=DeviceRecordingStatus.Status.FAILED,
+                message=f"device {device.name} is already assigned to a "
+                        f"recording session ({device.session_id})"
+            )
+            for device in devices
+        ]
 
         SESSION.add(new_session)
         try:
+            # queue a START command for the devices added to the session
+            SESSION.flush()
+            DeviceCommand.enqueue(new_session.devices, DeviceCommand.Name.START, {
+                s.device_id: new_session.start_parameters(s)
+                for s in new_session.device_statuses
+            })
+            # devices of later waves pick up their START with the heartbeat
+            # after their wave is reached
+            notify_after_commit(SESSION, [d.id for d in new_session.devices
+                                          if not waves.get(d.id)])
             SESSION.commit()
         except SQLAlchemyError:
             SESSION.rollback()
@@ -163,15 +527,86 @@ class RecordingSession(BASE):
 
         return new_session
 
+    @staticmethod
+    def counter(status):
+        """
+        :param status: DeviceRecordingStatus.Status
+        :return: name of the column counting device statuses in status
+        """
+        return f"{status.name.lower()}_count"
+
+    @classmethod
+    def complete_finished(cls, session_ids=None):
+        """
+        mark IN_PROGRESS sessions COMPLETE once none of their devices is
+        PENDING or RECORDING. This is done automatically when a transaction
+        changes the status of a device for a session, so it only needs to be
+        called to repair sessions that were missed. The changes are not
+        committed
+        :param session_ids: only check these sessions, using their status
+            counters. None to check every IN_PROGRESS session against the
+            device statuses themselves with a single query
+        :return: list of the sessions marked COMPLETE
+        """
+        query = SESSION.query(cls).filter(cls.status == cls.Status.IN_PROGRESS)
+        if session_ids is None:
+            sessions = query.filter(~exists().where(and_(
+                DeviceRecordingStatus.session_id == cls.id,
+                DeviceRecordingStatus.status.in_(DeviceRecordingStatus.ACTIVE)
+            ))).order_by(cls.id).all()
+        else:
+            # the transaction changing the statuses has already updated, and
+            # so locked, the counters of the sessions. When two transactions
+            # finish the last devices of a session the one that updates the
+            # counters second sees the changes of the first
+            sessions = query.filter(
+                cls.id.in_(session_ids),
+                cls.pending_count + cls.recording_count == 0
+            ).order_by(cls.id).with_for_update().all()
+
+        for session in sessions:
+            session.status = cls.Status.COMPLETE
+        return sessions
+
     @classmethod
-    def check_for_complete(cls):
+    def repair_completion(cls):
         """
-        check for sessions that should have their state changed to complete
+        mark every IN_PROGRESS session without PENDING or RECORDING devices
+        COMPLETE (see complete_finished()) and commit
+        :return: IDs of the sessions marked COMPLETE
         """
+        session_ids = [s.id for s in cls.complete_finished()]
+        if not session_ids:
+            return session_ids
+        try:
+            SESSION.commit()
+        except SQLAlchemyError:
+            SESSION.rollback()
+            raise JaxMBADatabaseException(
+                "unable to complete recording sessions")
+        return session_ids
 
-        sessions = SESSION.query(cls).filter(cls.status == cls.Status.IN_PROGRESS)
-        for s in sessions:
-            s.update_status()
+
+def recount_statuses(engine):
+    """
+    set the status counters of every recording session from its device
+    statuses, e.g. after the counters were added to an existing database.
+    Safe to run more than once
+    :param engine: sqlalchemy engine
+    :return: number of sessions whose counters changed
+    """
+    table = RecordingSession.__table__
+    statuses = DeviceRecordingStatus.__table__
+    counts = {
+        RecordingSession.counter(status): select([func.count()]).where(and_(
+            statuses.c.session_id == table.c.id,
+            statuses.c.status == status)).as_scalar()
+        for status in DeviceRecordingStatus.Status
+    }
+    differs = [table.c[name] != count for name, count in counts.items()]
+    with engine.begin() as conn:
+        return conn.execute(table.update().where(or_(*differs))
+                            .values(counts)).rowcount
 
 
 class DeviceRecordingStatus(BASE):
@@ -190,6 +625,9 @@ class DeviceRecordingStatus(BASE):
         FAILED = enum.auto()     # device encountered a failure during recording
         CANCELED = enum.auto()   # user manually stopped recording on device
 
+    # statuses of devices that haven't finished their part of the session
+    ACTIVE = (Status.PENDING, Status.RECORDING)
+
     # device id and session id form a composite primary key
     device_id = Column(Integer, ForeignKey('device.id'), primary_key=True)
     session_id = Column(Integer,
@@ -199,16 +637,34 @@ class DeviceRecordingStatus(BASE):
     # device's file prefix for this recording session
     file_prefix = Column(String)
 
-    # status of device for this session
-    status = Column(Enum(Status, name="device_session_state"), nullable=False)
+    # status of device for this session. The old status is loaded when a new
+    # one is set, so the session's status counters can be updated
+    status = column_property(
+        Column(Enum(Status, name="device_session_state"), nullable=False),
+        active_history=True)
+
+    # how long (in seconds) the device had recorded as part of this session
+    # when this was last written. Written when the device joins and leaves
+    # the session and when its clock drifts from recording_started, not every
+    # heartbeat, see recording_time
+    reported_time = Column('recording_time', Integer, default=0)
 
-    # how long (in seconds) the device has recorded as part of this session
-    recording_time = Column(Integer, default=0)
+    # when the device started recording as part of this session, derived
+    # from the duration it reported. Null until the device joins the session
+    recording_started = Column(TIMESTAMP(timezone=True))
+
+    # START wave of the device (see RecordingSession.can_start()), 0 if the
+    # device is started right away
+    start_wave = Column(Integer, nullable=False, default=0, server_default='0')
 
     # message, if any, sent from device regarding current status
     # for example -- may contain an error message if status == FAILED
     message = Column(String)
 
+    # revision of the last change to the status (see ChangeCounter)
+    revision = Column(BigInteger, nullable=False, default=0,
+                      server_default='0', index=True)
+
     device = relationship("Device")
     session = relationship("RecordingSession",
                            back_populates="device_statuses")
@@ -216,58 +672,311 @@ class DeviceRecordingStatus(BASE):
     # so the RecordingSession can sort DeviceRecordingSessionStatus by name
     device_name = deferred(select([Device.name]).where(Device.id == device_id))
 
-    def update_recording_time(self, duration):
-        self.recording_time = duration
-        try:
-            SESSION.commit()
-        except SQLAlchemyError:
-            SESSION.rollback()
-            raise JaxMBADatabaseException("unable to update recording_time")
+    @property
+    def recording_time(self):
+        """
+        how long (in seconds) the device has recorded as part of this session.
+        While the device is RECORDING this is computed from recording_started,
+        otherwise it is the time written when it stopped
+        """
+        return self.recording_time_at(datetime.now(pytz.UTC))
 
-    def update_status(self, new_status, message=None):
+    def recording_time_at(self, now):
+        """
+        how long (in seconds) the device had recorded as part of this session
+        at a point in time
+        :param now: timezone aware datetime
+        :return: seconds
+        """
+        return self.time_recorded(self, now)
+
+    @classmethod
+    def time_recorded(cls, row, now):
+        """
+        how long (in seconds) a device had recorded as part of a session at a
+        point in time, for rows that aren't loaded as DeviceRecordingStatus
+        :param row: object with the status, recording_started and
+            reported_time of a device status
+        :param now: timezone aware datetime
+        :return: seconds
+        """
+        if row.status != cls.Status.RECORDING or row.recording_started is None:
+            return row.reported_time
+        started = row.recording_started
+        if started.tzinfo is None:
+            # SQLite returns the UTC timestamp without tzinfo
+            started = started.replace(tzinfo=pytz.UTC)
+        return max(row.reported_time, int((now - started).total_seconds()))
+
+    def update_recording_time(self, duration, drift=None, commit=True):
+        """
+        record how long the device has recorded as part of this session
+        :param duration: seconds of recording reported by the device
+        :param drift: if set, the status is only changed if recording_time
+            differs from duration by more than drift seconds, so heartbeats
+            from a device recording steadily don't write anything
+        :param commit: if False the change is left for the caller to commit
+        :return: no return value
+        """
+        now = datetime.now(pytz.UTC)
+        if drift is not None and self.recording_started is not None and \
+                abs(self.recording_time_at(now) - duration) <= drift:
+            return
+        self.reported_time = duration
+        self.recording_started = now - timedelta(seconds=duration)
+        if commit:
+            try:
+                SESSION.commit()
+            except SQLAlchemyError:
+                SESSION.rollback()
+                raise JaxMBADatabaseException("unable to update recording_time")
+
+    def update_status(self, new_status, message=None, commit=True):
         self.status = new_status
         self.message = message
-        try:
-            SESSION.commit()
-        except SQLAlchemyError:
-            SESSION.rollback()
-            raise JaxMBADatabaseException("unable to update status")
+        if commit:
+            try:
+                SESSION.commit()
+            except SQLAlchemyError:
+                SESSION.rollback()
+                raise JaxMBADatabaseException("unable to update status")
 
     def remove_from_session(self):
         if self.status == self.Status.RECORDING or self.status == self.Status.PENDING:
+            queue_stop([self.device_id])
             self.update_status(self.Status.CANCELED)
 
     @classmethod
-    def get_failed(cls):
+    def get_for_session(cls, session_id, statuses=None, device_columns=None):
+        """
+        get the device statuses of a recording session along with their
+        devices, with a single query
+        :param session_id: recording session ID
+        :param statuses: only include statuses in this list of
+            DeviceRecordingStatus.Status, None for every status
+        :param device_columns: names of the device attributes to load, None
+            to load every column
+        :return: list of DeviceRecordingStatus, in device name order
+        """
+        device = contains_eager(cls.device)
+        if device_columns is not None:
+            device = device.load_only(*device_columns)
+        query = SESSION.query(cls).join(cls.device).options(device) \
+            .filter(cls.session_id == session_id)
+        if statuses:
+            query = query.filter(cls.status.in_(statuses))
+        return query.order_by(Device.name).all()
+
+    @classmethod
+    def get_failed(cls, session_id):
         """
-        get all devices with a FAILED state for this recording session
+        get all devices with a FAILED state for a recording session
+        :param session_id: recording session ID
         :return: list of Device objects
         """
-        failures = SESSION.query(cls).filter(
-            cls.status == cls.Status.FAILED).all_or_none()
-        return [f.device for f in failures]
+        return [s.device for s in
+                cls.get_for_session(session_id, [cls.Status.FAILED])]
 
     @classmethod
-    def get_complete(cls):
+    def get_complete(cls, session_id):
         """
-        get all devices with a COMPLETE state for this recording session
+        get all devices with a COMPLETE state for a recording session
+        :param session_id: recording session ID
         :return: list of Device objects
         """
-        completed = SESSION.query(cls).filter(
-            cls.status == cls.Status.COMPLETE).all_or_none()
-        return [c.device for c in completed]
+        return [s.device for s in
+                cls.get_for_session(session_id, [cls.Status.COMPLETE])]
 
     @classmethod
-    def get_recording(cls):
+    def get_recording(cls, session_id):
         """
-        get all devices with a RECORDING state for this recording session
+        get all devices with a RECORDING state for a recording session
+        :param session_id: recording session ID
         :return: list of Device objects
         """
-        recording = SESSION.query(cls).filter(
-            cls.status == cls.Status.RECORDING).all_or_none()
-        return [r.device for r in recording]
+        return [s.device for s in
+                cls.get_for_session(session_id, [cls.Status.RECORDING])]
+
+    @classmethod
+    def get_changed(cls, since, until):
+        """
+        get device session statuses changed by the revisions after since, up
+        to and including until
+        :param since: ChangeCounter.get_revisions() already seen, None to
+            get every status
+        :param until: ChangeCounter.get_revisions() of the last revisions to
+            include
+        :return: list of DeviceRecordingStatus
+        """
+        return SESSION.query(cls).filter(
+            ChangeCounter.changed(cls.revision, since, until)) \
+            .order_by(cls.session_id, cls.device_id).all()
 
     @classmethod
     def get(cls, device, session):
         return SESSION.query(cls).filter(cls.device_id == device.id,
                                          cls.session_id == session.id).one_or_none()
+
+
+def queue_stop(device_ids, devices=None):
+    """
+    queue a STOP command for devices that were removed from their recording
+    session, withdrawing any START command they haven't received yet. The
+    caller is responsible for committing
+    :param device_ids: ids of the devices
+    :param devices: the devices, if the caller has already locked them
+    """
+    if devices is None:
+        devices = Device.lock(device_ids) if device_ids else []
+    DeviceCommand.withdraw(devices, DeviceCommand.Name.START)
+    DeviceCommand.enqueue(devices, DeviceCommand.Name.STOP)
+    notify_after_commit(SESSION, device_ids)
+
+
+def stop_active_devices(session_ids):
+    """
+    queue a STOP command for the PENDING and RECORDING devices of sessions
+    that are being canceled. The devices are locked before their statuses
+    are read, in id order like create(), so their heartbeats can't change the
+    statuses until the caller commits
+    :param session_ids: ids of the sessions
+    :return: the statuses of the active devices
+    """
+    devices = Device.lock(
+        select([DeviceRecordingStatus.device_id])
+        .where(DeviceRecordingStatus.session_id.in_(session_ids)))
+    stopped = SESSION.query(
+        DeviceRecordingStatus.device_id,
+        DeviceRecordingStatus.session_id,
+        DeviceRecordingStatus.message,
+        DeviceRecordingStatus.status,
+        DeviceRecordingStatus.recording_started,
+        DeviceRecordingStatus.reported_time
+    ).filter(
+        DeviceRecordingStatus.session_id.in_(session_ids),
+        DeviceRecordingStatus.status.in_(DeviceRecordingStatus.ACTIVE)
+    ).all()
+    device_ids = {s.device_id for s in stopped}
+    queue_stop(sorted(device_ids), [d for d in devices if d.id in device_ids])
+    return stopped
+
+
+# status row for the recording session a device is currently assigned to. this
+# lets the heartbeat load the device, its session status and its session
+# together in a single query (see Device.lock_for_heartbeat)
+Device.active_status = relationship(
+    DeviceRecordingStatus,
+    primaryjoin=and_(
+        Device.id == foreign(DeviceRecordingStatus.device_id),
+        Device.session_id == foreign(DeviceRecordingStatus.session_id)
+    ),
+    uselist=False,
+    viewonly=True
+)
+
+
+# the partial index predicates compare archived with == rather than IS, like
+# the queries they serve, so the planner can match the queries to them
+# pylint: disable=C0121
+
+# used to list archived sessions newest first (see get_archived()), only
+# archived sessions are indexed
+Index('ix_recording_session_archived_creation_time',
+      RecordingSession.creation_time, RecordingSession.id,
+      postgresql_where=RecordingSession.archived == True,
+      sqlite_where=RecordingSession.archived == True)
+
+# used to list the sessions that aren't archived, which are few, without
+# scanning the archive
+Index('ix_recording_session_live_creation_time',
+      RecordingSession.creation_time,
+      postgresql_where=RecordingSession.archived == False,
+      sqlite_where=RecordingSession.archived == False)
+
+# pylint: enable=C0121
+
+# used to find the statuses of a session, optionally in a status (see
+# DeviceRecordingStatus.get_for_session() and the completion checks). The
+# primary key starts with device_id, so it can't be used for these
+Index('ix_session_device_status_session_id_status',
+      DeviceRecordingStatus.session_id, DeviceRecordingStatus.status)
+
+
+# inserted ahead of ChangeCounter's listener, so sessions whose counters
+# change get a new revision
+@event.listens_for(DeviceRecordingStatus.status, 'set')
+def _stop_recording_time(status, value, oldvalue, initiator):  # pylint: disable=W0613
+    """
+    write the recording time of a device status that leaves RECORDING, since
+    it is only computed while the device is RECORDING
+    """
+    if oldvalue == DeviceRecordingStatus.Status.RECORDING and \
+            value != oldvalue:
+        status.reported_time = status.recording_time
+
+
+@event.listens_for(SESSION_FACTORY, 'before_flush', insert=True)
+def _count_statuses(session, flush_context, instances):  # pylint: disable=W0613
+    """
+    update the status counters of the recording sessions whose device
+    statuses are added or change status. Counters of existing sessions are
+    incremented in SQL, so concurrent changes to the same session add up.
+    Statuses are only deleted along with their session, so deletes aren't
+    counted
+    """
+    deltas = defaultdict(Counter)
+    for obj in session.new:
+        if isinstance(obj, DeviceRecordingStatus):
+            deltas[obj.session][obj.status] += 1
+    for obj in session.dirty:
+        if isinstance(obj, DeviceRecordingStatus):
+            history = get_history(obj, 'status')
+            if history.has_changes() and history.deleted:
+                deltas[obj.session][history.deleted[0]] -= 1
+                deltas[obj.session][obj.status] += 1
+
+    for recording_session, counts in deltas.items():
+        for status, delta in counts.items():
+            if not delta:
+                continue
+            counter = RecordingSession.counter(status)
+            if recording_session in session.new:
+                setattr(recording_session, counter,
+                        (getattr(recording_session, counter) or 0) + delta)
+            else:
+                setattr(recording_session, counter,
+                        getattr(RecordingSession, counter) + delta)
+
+
+@event.listens_for(SESSION_FACTORY, 'before_flush')
+def _find_finished(session, flush_context, instances):  # pylint: disable=W0613
+    """
+    remember new sessions and device statuses that leave PENDING/RECORDING,
+    their sessions are checked for completion once they have been flushed
+    """
+    finished = [obj for obj in session.new
+                if isinstance(obj, RecordingSession) or (
+                    isinstance(obj, DeviceRecordingStatus) and
+                    obj.status not in DeviceRecordingStatus.ACTIVE)]
+    finished.extend(obj for obj in session.dirty
+                    if isinstance(obj, DeviceRecordingStatus) and
+                    obj.status not in DeviceRecordingStatus.ACTIVE and
+                    get_history(obj, 'status').has_changes())
+    if finished:
+        session.info.setdefault(_FINISHED, []).extend(finished)
+
+
+@event.listens_for(SESSION_FACTORY, 'after_flush_postexec')
+def _complete_finished(session, flush_context):  # pylint: disable=W0613
+    # sessions marked COMPLETE here are written by the next flush, which
+    # commit() does before committing
+    finished = session.info.pop(_FINISHED, None)
+    if finished:
+        RecordingSession.complete_finished(
+            {obj.id if isinstance(obj, RecordingSession) else obj.session_id
+             for obj in finished})
+
+
+@event.listens_for(SESSION_FACTORY, 'after_rollback')
+def _end_transaction(session):
+    session.info.pop(_FINISHED, None)
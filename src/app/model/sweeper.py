@@ -0,0 +1,106 @@
+"""
+background sweeper recording devices that stop sending heartbeats as DOWN
+and repairing recording sessions whose completion was missed
+"""
+import os
+import threading
+import time
+
+from . import SESSION
+from .device_model import Device
+from .recording_session_model import RecordingSession
+from src.utils.logging import get_module_logger
+
+LOGGER = get_module_logger()
+
+
+class DownSweeper:
+    """
+    calls Device.sweep_down() every DOWN_SWEEP_INTERVAL seconds, so devices
+    are recorded as DOWN (and an event published) shortly after their last
+    heartbeat becomes older than DOWN_DEVICE_THRESHOLD, rather than only being
+    derived as DOWN when someone reads them. Each sweep also completes any
+    recording session whose devices have all finished but that is still
+    IN_PROGRESS (see RecordingSession.repair_completion()).
+
+    The sweeper runs in its own process with manage.py sweep_devices or, if
+    enabled, as a thread of each process serving requests, started lazily
+    after the process forks. Sweeps in different processes skip rows locked
+    by each other, so running more than one is wasteful but safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self, app):
+        """
+        start the sweeper thread of this process if it isn't running yet
+        :param app: flask app, the sweeper runs in its app context
+        """
+        # threads don't survive a fork, each process needs its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self.run, args=(app,),
+                             name="down-sweeper", daemon=True).start()
+            self._pid = os.getpid()
+
+    def run(self, app):
+        """
+        sweep forever
+        :param app: flask app, the sweeper runs in its app context
+        """
+        with app.app_context():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as err:  # pylint: disable=W0703
+                    # keep sweeping, the next sweep may well succeed
+                    LOGGER.error("error sweeping devices: %s", err)
+                    SESSION.remove()
+                time.sleep(app.config['DOWN_SWEEP_INTERVAL'])
+
+    @staticmethod
+    def sweep():
+        """
+        record devices that went DOWN since the last sweep, warning about
+        those that were in a recording session, and repair recording session
+        completion
+        :return: list of (name, session_id, down_since) of the devices
+        """
+        # any error, such as a dropped database connection, is logged rather
+        # than raised so the sweeper thread keeps running
+        try:
+            completed = RecordingSession.repair_completion()
+            if completed:
+                LOGGER.warning("completed recording sessions %s", completed)
+        except Exception as err:  # pylint: disable=W0703
+            SESSION.rollback()
+            LOGGER.error("error completing recording sessions: %s", err)
+        finally:
+            SESSION.remove()
+
+        try:
+            swept = Device.sweep_down()
+        except Exception as err:  # pylint: disable=W0703
+            SESSION.rollback()
+            LOGGER.error("error recording DOWN devices: %s", err)
+            return []
+        finally:
+            SESSION.remove()
+
+        for name, session_id, down_since in swept:
+            if session_id is not None:
+                LOGGER.warning("device %s went DOWN at %s during recording "
+                               "session %s", name, down_since.isoformat(),
+                               session_id)
+            else:
+                LOGGER.info("device %s went DOWN at %s", name,
+                            down_since.isoformat())
+        return swept
+
+
+DOWN_SWEEPER = DownSweeper()
@@ -0,0 +1,382 @@
+"""
+Notifications used to wake up requests waiting for something to happen to a
+device, e.g. a device long-polling for commands, and events published to
+subscribers of the event stream (GET /api/events)
+"""
+import atexit
+import collections
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import event
+
+from src.app.model import SESSION_FACTORY
+from src.utils.logging import get_module_logger
+
+LOGGER = get_module_logger()
+
+# session.info keys used to collect notifications and events until the
+# session commits
+_PENDING = 'pending_notifications'
+_PENDING_EVENTS = 'pending_events'
+
+
+class Subscription:
+    """
+    queue of the events published to one subscriber. A subscriber that falls
+    more than maxsize events behind is dropped: its queue is emptied and
+    overflowed is set, the subscriber has to resynchronize and subscribe
+    again
+    """
+
+    def __init__(self, notifier, maxsize):
+        self.maxsize = maxsize
+        self.overflowed = False
+        self._notifier = notifier
+        self._condition = threading.Condition()
+        self._events = collections.deque()
+
+    def get(self, timeout):
+        """
+        wait for events
+        :param timeout: maximum number of seconds to wait
+        :return: list of the events published since the last call, empty if
+            the wait timed out or the subscription overflowed
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._events or self.overflowed, timeout)
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+    def close(self):
+        """ stop receiving events """
+        self._notifier.unsubscribe(self)
+
+    def _put(self, events):
+        with self._condition:
+            if self.overflowed:
+                return
+            if len(self._events) + len(events) > self.maxsize:
+                self.overflowed = True
+                self._events.clear()
+            else:
+                self._events.extend(events)
+            self._condition.notify_all()
+
+
+class LocalNotifier:
+    """
+    wakes up threads of this process that are waiting on a key, and delivers
+    published events to the subscribers in this process.
+
+    A notification for a key nobody is waiting on is remembered for
+    pending_ttl seconds, so a waiter that arrives shortly after the
+    notification returns straight away instead of missing it. Events are only
+    delivered to subscribers that subscribed before they were published.
+    """
+
+    def __init__(self, pending_ttl=60):
+        self.pending_ttl = pending_ttl
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+
+    def notify(self, keys):
+        """
+        notify everyone waiting on any of the keys
+        :param keys: iterable of keys
+        """
+        self._notify_local(keys)
+
+    def wait(self, key, timeout):
+        """
+        wait until a key is notified
+        :param key: key to wait on
+        :param timeout: maximum number of seconds to wait
+        :return: True if the key was notified, False if the wait timed out
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                notified_at = self._pending.pop(key, None)
+                if notified_at is not None and \
+                        time.monotonic() - notified_at <= self.pending_ttl:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+
+    def publish(self, events):
+        """
+        deliver events to every subscriber
+        :param events: list of JSON serializable events
+        """
+        self.publish_local(events)
+
+    def publish_local(self, events):
+        """
+        deliver events to the subscribers in this process only
+        :param events: list of JSON serializable events
+        """
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber._put(events)  # pylint: disable=W0212
+
+    def subscribe(self, maxsize=1000):
+        """
+        start receiving published events
+        :param maxsize: maximum number of events waiting to be read before
+            the subscriber is dropped
+        :return: Subscription, close it to stop receiving events
+        """
+        subscription = Subscription(self, maxsize)
+        with self._subscribers_lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """ stop delivering events to a subscription """
+        with self._subscribers_lock:
+            self._subscribers.discard(subscription)
+
+    def has_subscribers(self):
+        """ :return: True if anyone in this process is subscribed """
+        return bool(self._subscribers)
+
+    def _notify_local(self, keys):
+        now = time.monotonic()
+        with self._condition:
+            # forget notifications nobody picked up
+            self._pending = {k: t for k, t in self._pending.items()
+                             if now - t <= self.pending_ttl}
+            for key in keys:
+                self._pending[key] = now
+            self._condition.notify_all()
+
+
+class SocketNotifier(LocalNotifier):
+    """
+    notifies waiters in every process on this host, for example every uWSGI
+    worker. Each process binds a unix datagram socket in a shared directory
+    and notifications are sent to all of the sockets found there. This is a
+    local stand-in for a message broker, it doesn't work across hosts.
+    """
+
+    # maximum number of keys or events sent in one datagram
+    BATCH_SIZE = 1000
+    EVENT_BATCH_SIZE = 100
+    # maximum size of a datagram, batches are split further to stay below it
+    # and the listener receives up to this many bytes
+    MAX_MESSAGE_SIZE = 65536
+
+    def __init__(self, directory, pending_ttl=60):
+        super().__init__(pending_ttl)
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._path = None
+        self._sender = None
+
+    def notify(self, keys):
+        self._ensure_listener()
+        for message in self._messages(keys, self.BATCH_SIZE, b'[', b']'):
+            for name in os.listdir(self.directory):
+                if name.endswith('.sock'):
+                    self._send(os.path.join(self.directory, name), message)
+
+    def wait(self, key, timeout):
+        self._ensure_listener()
+        return super().wait(key, timeout)
+
+    def publish(self, events):
+        self._ensure_listener()
+        for message in self._messages(events, self.EVENT_BATCH_SIZE,
+                                      b'{"events": [', b']}'):
+            for name in os.listdir(self.directory):
+                if name.endswith('.sock'):
+                    self._send(os.path.join(self.directory, name), message)
+
+    def subscribe(self, maxsize=1000):
+        self._ensure_listener()
+        return super().subscribe(maxsize)
+
+    def _messages(self, items, batch_size, prefix, suffix):
+        """
+        encode items as JSON lists of at most batch_size items, whose encoded
+        size is at most MAX_MESSAGE_SIZE. An item too large to fit on its own
+        is logged and dropped
+        :param items: JSON serializable items
+        :param batch_size: maximum number of items in a message
+        :param prefix: encoded JSON before the list of items
+        :param suffix: encoded JSON after the list of items
+        :return: generator of encoded messages
+        """
+        batch = []
+        size = len(prefix) + len(suffix)
+        for item in items:
+            encoded = json.dumps(item).encode()
+            if len(prefix) + len(encoded) + len(suffix) > \
+                    self.MAX_MESSAGE_SIZE:
+                LOGGER.error("notification of %d bytes is too large to send",
+                             len(encoded))
+                continue
+            # items are separated by a comma
+            if batch and (len(batch) == batch_size or
+                          size + len(encoded) + 1 > self.MAX_MESSAGE_SIZE):
+                yield prefix + b','.join(batch) + suffix
+                batch = []
+                size = len(prefix) + len(suffix)
+            size += len(encoded) + (1 if batch else 0)
+            batch.append(encoded)
+        if batch:
+            yield prefix + b','.join(batch) + suffix
+
+    def _send(self, path, message):
+        try:
+            self._sender.sendto(message, path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # the process that bound this socket has exited
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        except OSError as err:
+            # e.g. the receiver isn't keeping up. Waiters fall back to the
+            # next heartbeat, so don't fail the request that notified
+            LOGGER.warning("unable to send notification to %s: %s", path,
+                           err)
+
+    def _ensure_listener(self):
+        # sockets and threads don't survive a fork, each process needs its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._path = os.path.join(
+                self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock")
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            listener.bind(self._path)
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+            threading.Thread(target=self._listen, args=(listener,),
+                             name="notify-listener", daemon=True).start()
+            atexit.register(self._remove_socket, self._path)
+            self._pid = os.getpid()
+
+    def _listen(self, listener):
+        while True:
+            try:
+                message = json.loads(
+                    listener.recv(self.MAX_MESSAGE_SIZE))
+                if isinstance(message, dict):
+                    self.publish_local(message['events'])
+                else:
+                    self._notify_local(message)
+            except (OSError, ValueError, KeyError) as err:
+                LOGGER.error("error receiving notification: %s", err)
+
+    @staticmethod
+    def _remove_socket(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+_NOTIFIER = LocalNotifier()
+
+
+def configure_notifier(app):
+    """
+    set up the notifier selected in the app config
+    :param app: The flask app returned from app_factory
+    :return: None
+    """
+    global _NOTIFIER  # pylint: disable=W0603
+    if app.config['COMMAND_NOTIFIER'] == 'socket':
+        _NOTIFIER = SocketNotifier(app.config['COMMAND_NOTIFY_DIR'])
+    else:
+        _NOTIFIER = LocalNotifier()
+
+
+def notify(keys):
+    """ notify everyone waiting on any of the keys """
+    _NOTIFIER.notify(keys)
+
+
+def wait(key, timeout):
+    """
+    wait until a key is notified
+    :return: True if the key was notified, False if the wait timed out
+    """
+    return _NOTIFIER.wait(key, timeout)
+
+
+def publish(events):
+    """ deliver events to every subscriber """
+    _NOTIFIER.publish(events)
+
+
+def publish_local(events):
+    """ deliver events to the subscribers in this process only """
+    _NOTIFIER.publish_local(events)
+
+
+def subscribe(maxsize=1000):
+    """
+    start receiving published events
+    :return: Subscription, close it to stop receiving events
+    """
+    return _NOTIFIER.subscribe(maxsize)
+
+
+def has_subscribers():
+    """ :return: True if anyone in this process is subscribed to events """
+    return _NOTIFIER.has_subscribers()
+
+
+def notify_after_commit(session, keys):
+    """
+    notify keys once the session's current transaction commits. Nothing is
+    sent if the transaction is rolled back
+    :param session: sqlalchemy session
+    :param keys: iterable of keys
+    """
+    session.info.setdefault(_PENDING, set()).update(keys)
+
+
+def publish_after_commit(session, events):
+    """
+    publish events once the session's current transaction commits. Nothing is
+    published if the transaction is rolled back
+    :param session: sqlalchemy session
+    :param events: list of JSON serializable events
+    """
+    session.info.setdefault(_PENDING_EVENTS, []).extend(events)
+
+
+@event.listens_for(SESSION_FACTORY, 'after_commit')
+def _after_commit(session):
+    keys = session.info.pop(_PENDING, None)
+    if keys:
+        notify(keys)
+    events = session.info.pop(_PENDING_EVENTS, None)
+    if events:
+        publish(events)
+
+
+@event.listens_for(SESSION_FACTORY, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop(_PENDING, None)
+    session.info.pop(_PENDING_EVENTS, None)
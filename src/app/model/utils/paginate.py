@@ -4,6 +4,8 @@ Pagination helper for use with sqlalchemy
 # pylint: disable=R0913
 from math import ceil
 
+from sqlalchemy import tuple_
+
 
 class PaginationError(Exception):  # pylint: disable=R0903
     """ Exception class for pagniation errors """
@@ -120,3 +122,68 @@ def paginate(query, page=1, per_page=50, error_out=True, max_per_page=None, coun
         total = query.order_by(None).count()
 
     return Pagination(query, page, per_page, total, items)
+
+
+class KeysetPage:  # pylint: disable=R0903
+    """ one page of results from keyset_paginate """
+
+    def __init__(self, items, next_key):
+        """
+
+        :param items: the items for the current page
+        :param next_key: key of the last item on this page, to pass as after
+            to get the next page. None if this is the last page
+        """
+        self.items = items
+        self.next_key = next_key
+
+    @property
+    def has_next(self):
+        """True if a next page exists."""
+        return self.next_key is not None
+
+
+def keyset_paginate(query, key, after=None, limit=50, max_limit=None,
+                    descending=False):
+    """ A method to get a page of results from an unordered query using keyset
+    (seek) pagination. Rather than skipping the rows of previous pages with
+    OFFSET, the query continues after the key of the last row of the previous
+    page, so getting any page costs the same as getting the first one when
+    key is indexed.
+
+    :param query: the unlimited, unordered query, its rows must have an
+        attribute named after each column of key
+    :param key: unique column the results are ordered by, or a tuple of
+        columns that are unique together (compared as a row value)
+    :param after: key of the last item of the previous page (a tuple if key
+        is), None for the first page
+    :param limit: the number of items on a page, None for no limit
+    :param max_limit: will use the min of max_limit and limit if set
+    :param descending: if True order by key in descending order
+    :return: KeysetPage object
+    :raises PaginationError if limit is less than 1
+    """
+    if limit is not None and max_limit is not None:
+        limit = min(limit, max_limit)
+    if limit is not None and limit < 1:
+        raise PaginationError("limit must be at least 1")
+
+    columns = key if isinstance(key, tuple) else (key,)
+    if after is not None:
+        compared = key
+        if isinstance(key, tuple):
+            compared, after = tuple_(*key), tuple_(*after)
+        query = query.filter(compared < after if descending
+                             else compared > after)
+    query = query.order_by(*(c.desc() if descending else c for c in columns))
+    if limit is None:
+        return KeysetPage(query.all(), None)
+
+    # fetch one extra row to find out if there is a next page
+    items = query.limit(limit + 1).all()
+    if len(items) <= limit:
+        return KeysetPage(items, None)
+    items = items[:limit]
+    next_key = tuple(getattr(items[-1], c.key) for c in columns)
+    return KeysetPage(items, next_key if isinstance(key, tuple)
+                      else next_key[0])
@@ -0,0 +1,280 @@
+"""
+Write-behind buffer for frequently rewritten columns
+"""
+import atexit
+import os
+import threading
+import time
+
+from sqlalchemy import bindparam, event
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.utils.logging import get_module_logger
+
+LOGGER = get_module_logger()
+
+
+class FlushMetrics:  # pylint: disable=R0903
+    """ counters describing the work done by a WriteBehindBuffer """
+
+    def __init__(self):
+        self.buffered = 0       # number of updates added to the buffer
+        self.coalesced = 0      # updates that replaced a pending update
+        self.flushes = 0        # number of flushes that wrote rows
+        self.rows_written = 0   # rows written by those flushes
+        self.failures = 0       # flushes that failed
+        self.last_flush_seconds = 0.0   # duration of the last flush
+        self.max_staleness = 0.0        # oldest update seen at flush time
+
+    def as_dict(self):
+        """ return the metrics as a dictionary """
+        return dict(vars(self))
+
+
+class WriteBehindBuffer:
+    """
+    Buffers updates to a set of columns of a table and writes them to the
+    database in bulk, with a single executemany() UPDATE, every
+    flush_interval seconds from a background thread.
+
+    Updates are keyed by primary key. A newer update for a row replaces any
+    update already pending for it, so each row is written at most once per
+    flush. If version_column is given, a buffered update never overwrites a
+    row whose version_column is already newer (for example if the row was
+    written synchronously after the update was buffered).
+
+    Updates made by a transaction are added with add_after_commit() and only
+    reach the buffer once it commits. If a flush fails its updates are put
+    back, unless a newer update for the row has been buffered since, and the
+    next flush retries them.
+
+    The buffer is per-process. Each uWSGI worker gets its own buffer and
+    flush thread, which is started lazily on first use after the fork.
+    """
+
+    def __init__(self, table, columns, version_column=None, after_write=None):
+        """
+        :param table: table to write to
+        :param columns: names of the buffered columns
+        :param version_column: optional name of a (monotonically increasing)
+            buffered column used to avoid overwriting newer values
+        :param after_write: optional function called with the connection
+            and the primary keys of the rows after each flush writes rows, in
+            the same transaction
+        """
+        self.table = table
+        self.columns = list(columns)
+        self.version_column = version_column
+        self.after_write = after_write
+        self.enabled = False
+        self.flush_interval = 10
+        self.max_staleness = 30
+        self.metrics_interval = 0
+        self.metrics = FlushMetrics()
+
+        self._engine = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._oldest = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._last_metrics_log = time.monotonic()
+        # session.info key of the updates waiting for a transaction to commit
+        self._info_key = f"write_behind_{self.table.name}"
+
+        # bind parameters can't share names with the columns being updated
+        primary_key = self.table.primary_key.columns.values()[0]
+        where = primary_key == bindparam('b_pk')
+        if self.version_column is not None:
+            version = self.table.c[self.version_column]
+            where = where & (version < bindparam(f"b_{self.version_column}"))
+        self._statement = self.table.update().where(where).values(
+            {c: bindparam(f"b_{c}") for c in self.columns})
+        atexit.register(self.flush)
+
+    def listen(self, session_factory):
+        """
+        buffer the updates added with add_after_commit() when the sessions'
+        transactions commit, and drop them when they roll back
+        :param session_factory: sessionmaker of the sessions
+        """
+        event.listen(session_factory, 'after_commit', self._after_commit)
+        event.listen(session_factory, 'after_rollback', self._after_rollback)
+
+    def configure(self, engine, enabled, flush_interval, max_staleness,
+                  metrics_interval=0):
+        """
+        configure the buffer, normally called once when the app is created
+        :param engine: sqlalchemy engine used to write buffered updates
+        :param enabled: if False the buffer is not used
+        :param flush_interval: seconds between flushes
+        :param max_staleness: maximum age, in seconds, of a buffered update.
+            an update older than this is written by the next add() if the
+            flush thread has fallen behind
+        :param metrics_interval: seconds between logging the flush metrics,
+            0 to disable logging
+        """
+        self.stop()
+        self._engine = engine
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.max_staleness = max(max_staleness, flush_interval)
+        self.metrics_interval = metrics_interval
+
+    def add(self, key, values):
+        """
+        buffer an update for a row
+        :param key: primary key of the row
+        :param values: dictionary containing a value for every buffered column
+        """
+        self._ensure_thread()
+        now = time.monotonic()
+        with self._lock:
+            if key in self._pending:
+                self.metrics.coalesced += 1
+                _, buffered_at = self._pending[key]
+            else:
+                buffered_at = now
+            self._pending[key] = (values, buffered_at)
+            self.metrics.buffered += 1
+            if self._oldest is None:
+                self._oldest = now
+            overdue = now - self._oldest > self.max_staleness
+
+        if overdue:
+            # flush thread is not keeping up, don't let updates get older
+            # than max_staleness
+            self.flush()
+
+    def add_after_commit(self, session, key, values):
+        """
+        buffer an update for a row once the session's current transaction
+        commits. Nothing is buffered if the transaction is rolled back
+        :param session: sqlalchemy session, from the factory passed to listen()
+        :param key: primary key of the row
+        :param values: dictionary containing a value for every buffered column
+        """
+        session.info.setdefault(self._info_key, {})[key] = values
+
+    def pop_uncommitted(self, session, key):
+        """
+        remove and return the update the session's current transaction added
+        for a row, if any. Used when the row is about to be written by that
+        transaction
+        :param session: sqlalchemy session
+        :param key: primary key of the row
+        :return: dictionary of column values, None if nothing was added
+        """
+        return session.info.get(self._info_key, {}).pop(key, None)
+
+    def pop(self, key):
+        """
+        remove and return the update pending for a row, if any. Used when the
+        row is about to be written synchronously.
+        :param key: primary key of the row
+        :return: dictionary of column values, None if nothing is pending
+        """
+        with self._lock:
+            pending = self._pending.pop(key, None)
+        return pending[0] if pending else None
+
+    def flush(self):
+        """
+        write all pending updates to the database
+        :return: number of updates written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._oldest = None
+
+        if not pending or self._engine is None:
+            return 0
+
+        # rows are updated in primary key order, the same order rows are
+        # locked in elsewhere, so a flush can't deadlock with a request
+        now = time.monotonic()
+        params = []
+        for key, (values, buffered_at) in sorted(pending.items()):
+            self.metrics.max_staleness = max(self.metrics.max_staleness,
+                                             now - buffered_at)
+            row = {f"b_{c}": values[c] for c in self.columns}
+            row['b_pk'] = key
+            params.append(row)
+
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(self._statement, params)
+                if self.after_write is not None:
+                    self.after_write(conn, [p['b_pk'] for p in params])
+        except SQLAlchemyError as err:
+            self.metrics.failures += 1
+            LOGGER.error("unable to flush %d buffered updates to %s: %s",
+                         len(params), self.table.name, err)
+            self._restore(pending)
+            return 0
+
+        self.metrics.flushes += 1
+        self.metrics.rows_written += len(params)
+        self.metrics.last_flush_seconds = time.monotonic() - now
+        return len(params)
+
+    def _restore(self, pending):
+        """
+        put back the updates of a failed flush, to be retried by the next one.
+        Rows updated again since the flush started keep the newer update
+        :param pending: updates taken by the flush
+        """
+        with self._lock:
+            for key, update in pending.items():
+                self._pending.setdefault(key, update)
+            oldest = min(buffered_at for _, buffered_at in pending.values())
+            if self._oldest is None or oldest < self._oldest:
+                self._oldest = oldest
+
+    def _after_commit(self, session):
+        pending = session.info.pop(self._info_key, None)
+        for key, values in (pending or {}).items():
+            self.add(key, values)
+
+    def _after_rollback(self, session):
+        session.info.pop(self._info_key, None)
+
+    def stop(self):
+        """ stop the flush thread, writing any pending updates """
+        if self._thread is not None and self._pid == os.getpid():
+            self._stop.set()
+            self._wakeup.set()
+            self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def _ensure_thread(self):
+        # threads don't survive a fork, so check which process started it
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._stop.clear()
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(
+                        target=self._run,
+                        name=f"{self.table.name}-write-behind",
+                        daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            self._log_metrics()
+
+    def _log_metrics(self):
+        if not self.metrics_interval:
+            return
+        now = time.monotonic()
+        if now - self._last_metrics_log >= self.metrics_interval:
+            self._last_metrics_log = now
+            LOGGER.info("%s write-behind metrics: %s", self.table.name,
+                        self.metrics.as_dict())
@@ -0,0 +1,21 @@
+"""
+commands repairing data of databases created by older releases, the schema is
+upgraded with 'manage.py db upgrade'
+"""
+from flask import current_app
+from flask_script import Command
+
+from src.app.model import SESSION, migrate_sensor_status
+
+
+class MigrateSensorStatus(Command):
+    """
+    convert device sensor_status values stored as JSON encoded strings to JSON
+    objects (and the column to JSONB on PostgreSQL)
+    """
+    def run(self):  # pylint: disable=E0202
+        """ invoked by the command """
+        converted = migrate_sensor_status(SESSION.get_bind())
+        current_app.logger.info(
+            f"converted sensor_status of {converted} devices")
+        return 0
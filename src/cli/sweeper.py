@@ -0,0 +1,28 @@
+"""
+command recording devices that stopped sending heartbeats as DOWN
+"""
+from flask import current_app
+from flask_script import Command, Option
+
+from src.app.model import DOWN_SWEEPER
+
+
+class SweepDevices(Command):
+    """
+    record devices that stopped sending heartbeats as DOWN, every INTERVAL
+    seconds in the [SWEEPER] section of the config file. Use this instead of
+    the sweeper thread of the server processes (ENABLED = false)
+    """
+    option_list = (
+        Option('--once', action='store_true',
+               help="sweep once and exit"),
+    )
+
+    def run(self, once):  # pylint: disable=E0202,W0221
+        """ invoked by the command """
+        if once:
+            for name, _, down_since in DOWN_SWEEPER.sweep():
+                print(f"{name} DOWN since {down_since.isoformat()}")
+            return 0
+        DOWN_SWEEPER.run(current_app._get_current_object())  # pylint: disable=W0212
+        return 0
@@ -45,6 +45,72 @@ class Config:
     DOWN_DEVICE_THRESHOLD = int(_CFG.get('MAIN', 'DOWN_DEVICE_THRESHOLD'))
     STREAM_KEEP_ALIVE = int(_CFG.get('MAIN', 'STREAM_KEEP_ALIVE'))
 
+    # the recording time of a device is computed from when it started
+    # recording, its session status is only written when the duration it
+    # reports drifts from that by more than RECORDING_TIME_DRIFT seconds
+    RECORDING_TIME_DRIFT = _CFG.getint('MAIN', 'RECORDING_TIME_DRIFT',
+                                       fallback=10)
+
+    # ETags of session reads with fields computed from the current time (the
+    # recording times of RECORDING devices, START waves) change every
+    # TIMED_ETAG_INTERVAL seconds
+    TIMED_ETAG_INTERVAL = _CFG.getint('MAIN', 'TIMED_ETAG_INTERVAL',
+                                      fallback=10)
+
+    # seconds between the START waves of recording sessions created with a
+    # start_wave_size but no start_wave_interval
+    START_WAVE_INTERVAL = _CFG.getint('MAIN', 'START_WAVE_INTERVAL',
+                                      fallback=10)
+
+    # seconds the fleet summary (GET /api/device/summary) is cached for
+    SUMMARY_TTL = _CFG.getfloat('MAIN', 'SUMMARY_TTL', fallback=1.0)
+
+    # write-behind buffering of volatile device telemetry (load, free ram,
+    # uptime, ...). When enabled, heartbeats that don't change any session
+    # state only buffer their telemetry, which is written to the database in
+    # bulk every FLUSH_INTERVAL seconds. MAX_STALENESS bounds how old buffered
+    # telemetry can get before it is written and must be less than
+    # DOWN_DEVICE_THRESHOLD. Flush metrics are logged every METRICS_INTERVAL
+    # seconds (0 disables).
+    TELEMETRY_WRITE_BEHIND = _CFG.getboolean('TELEMETRY', 'WRITE_BEHIND',
+                                             fallback=False)
+    TELEMETRY_FLUSH_INTERVAL = _CFG.getint('TELEMETRY', 'FLUSH_INTERVAL',
+                                           fallback=10)
+    TELEMETRY_MAX_STALENESS = _CFG.getint('TELEMETRY', 'MAX_STALENESS',
+                                          fallback=30)
+    TELEMETRY_METRICS_INTERVAL = _CFG.getint('TELEMETRY', 'METRICS_INTERVAL',
+                                             fallback=300)
+
+    # devices can long-poll GET /api/device/<name>/commands to hear about new
+    # commands without waiting for their next heartbeat. Each poll holds a
+    # worker thread for up to MAX_WAIT seconds, so this is off by default.
+    # NOTIFIER is 'local' (single process) or 'socket', which uses unix
+    # sockets in NOTIFY_DIR to reach every worker process on this host
+    COMMAND_LONG_POLL = _CFG.getboolean('COMMANDS', 'LONG_POLL',
+                                        fallback=False)
+    COMMAND_MAX_WAIT = _CFG.getint('COMMANDS', 'MAX_WAIT', fallback=30)
+    COMMAND_NOTIFIER = _CFG.get('COMMANDS', 'NOTIFIER', fallback='local')
+    COMMAND_NOTIFY_DIR = _CFG.get('COMMANDS', 'NOTIFY_DIR',
+                                  fallback='/tmp/jax-mba-service-notify')
+
+    # Server-Sent Events stream of device and session state changes at
+    # GET /api/events. Each open stream holds a worker thread, so this is off
+    # by default. A comment is sent every KEEP_ALIVE seconds while nothing
+    # happens and a subscriber more than QUEUE_SIZE events behind is
+    # disconnected. Devices going DOWN are published by the [SWEEPER]. Events
+    # reach the streams of other worker processes through the NOTIFIER in the
+    # [COMMANDS] section
+    EVENTS_ENABLED = _CFG.getboolean('EVENTS', 'ENABLED', fallback=False)
+    EVENTS_KEEP_ALIVE = _CFG.getint('EVENTS', 'KEEP_ALIVE', fallback=15)
+    EVENTS_QUEUE_SIZE = _CFG.getint('EVENTS', 'QUEUE_SIZE', fallback=1000)
+
+    # devices whose last heartbeat is older than DOWN_DEVICE_THRESHOLD are
+    # recorded as DOWN every INTERVAL seconds by manage.py sweep_devices or,
+    # if ENABLED, by a thread in each server process. Every process sweeps,
+    # so ENABLED is only meant for servers running a single process
+    DOWN_SWEEPER = _CFG.getboolean('SWEEPER', 'ENABLED', fallback=False)
+    DOWN_SWEEP_INTERVAL = _CFG.getint('SWEEPER', 'INTERVAL', fallback=5)
+
     SMTP = _CFG.get('EMAIL', 'SMTP')
     REPLY_TO = _CFG.get('EMAIL', 'REPLY_TO')
 
@@ -74,6 +140,12 @@ class TestingConfig(Config):
                               os.path.join(BASEDIR,
                                            'jax-mba-service.test.sqlite.db')
 
+    # tests that exercise write-behind enable it explicitly
+    TELEMETRY_WRITE_BEHIND = False
+
+    # tests sweep DOWN devices explicitly
+    DOWN_SWEEPER = False
+
 
 class ProductionConfig(Config):
     """ Production Config. WARNING: BE CAREFUL """
@@ -3,6 +3,7 @@ Factories for the falsk app and the celery app
 """
 
 import logging
+import os
 
 from flask import Flask
 from flask_cors import CORS
@@ -11,6 +12,10 @@ from flask_migrate import Migrate
 from src.config import CONFIG_BY_NAME, DEFAULT_CONFIG
 from src.app.model import MA, init_db, BASE
 
+# alembic revisions upgrading databases created by older releases
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'migrations')
+
 
 def create_app(config_name=None, app=None, config_object=None):
     """
@@ -26,7 +31,7 @@ def create_app(config_name=None, app=None, config_object=None):
     app.config.from_object(conf)
     app.app_context().push()
     with app.app_context():
-        Migrate(app, BASE)
+        Migrate(app, BASE, directory=MIGRATIONS_DIR, render_as_batch=True)
         MA.init_app(app)
         app.config['db_engine'] = init_db(app)
         CORS(app)
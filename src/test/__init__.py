@@ -6,9 +6,39 @@ Base classes for use in the testing scripts
 #   Overriding init for TestCase breaks the library
 # pylint: disable=W0201
 
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event
+from flask_jwt_extended import create_access_token
 from flask_testing import TestCase, LiveServerTestCase
 from src.app import create_app
-from src.app.model import SESSION, drop_all
+from src.app.model import SESSION, ChangeCounter, drop_all
+
+
+@contextmanager
+def count_statements(engine):
+    """
+    context manager that records the SQL statements executed and the
+    transactions committed on an engine while it is active
+    :param engine: sqlalchemy engine
+    :return: dictionary with 'statements' and 'commits' lists
+    """
+    counts = {'statements': [], 'commits': []}
+
+    def before_cursor_execute(conn, cursor, statement, *args):  # pylint: disable=W0613
+        counts['statements'].append(statement)
+
+    def commit(conn):
+        counts['commits'].append(conn)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'commit', commit)
+    try:
+        yield counts
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        event.remove(engine, 'commit', commit)
 
 
 class BaseTestCase(TestCase):
@@ -28,6 +58,53 @@ class BaseTestCase(TestCase):
 class BaseDBTestCase(BaseTestCase):
     """ DB Test Specific Base Case """
 
+    @staticmethod
+    def auth_headers():
+        """
+        :return: headers authorizing a request as a test user
+        """
+        token = create_access_token({'id': 1, 'email': "test@jax.org"})
+        return {'Authorization': f"Bearer {token}"}
+
+    @staticmethod
+    def make_payload(name="TEST-DEVICE", recording=False, duration=0,
+                     session_id=None, ack_seq=None):
+        """ build a valid heartbeat payload """
+        payload = {
+            'timestamp': datetime.utcnow().isoformat(),
+            'name': name,
+            'sensor_status': {
+                'camera': {
+                    'recording': recording,
+                    'duration': duration,
+                    'fps': 30 if recording else 0
+                }
+            },
+            'system_info': {
+                "uptime": 128324,
+                "load": 0.66,
+                "total_ram": 8388608,
+                "free_ram": 7759462,
+                "free_disk": 1258291,
+                "total_disk": 2000000,
+                "release": "test device"
+            }
+        }
+        if session_id is not None:
+            payload['session_id'] = session_id
+        if ack_seq is not None:
+            payload['ack_seq'] = ack_seq
+        return payload
+
+    def assert_latest_revision(self, revision):
+        """
+        assert that a revision is the last one returned by the shard of the
+        change counter it is from
+        """
+        shards = ChangeCounter.SHARDS
+        self.assertEqual(ChangeCounter.get_revisions()[revision % shards],
+                         revision // shards)
+
     def tearDown(self):
         self.session.remove()
         drop_all(self.engine)
@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+
+import unittest
+from unittest import mock
+
+import src.app.model as model
+from src.app.controller.utils.pagination import encode_cursor
+from src.test import BaseDBTestCase
+
+
+class TestChanges(BaseDBTestCase):
+    """ tests for the change feed """
+
+    __endpoint = '/api/changes'
+
+    def setUp(self):
+        for i in range(3):
+            self.heartbeat(f"TEST-DEVICE{i}")
+        self.headers = self.auth_headers()
+
+    def heartbeat(self, name, **kwargs):
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload(name, **kwargs))
+        self.session.remove()
+
+    def changes(self, since=None):
+        query_string = {'since': since} if since else {}
+        response = self.client.get(self.__endpoint, query_string=query_string,
+                                   headers=self.headers)
+        self.assert200(response)
+        self.session.remove()
+        return response.json
+
+    def test_sync(self):
+        """ only what changed since the cursor is returned """
+        changes = self.changes()
+        self.assertEqual([d['name'] for d in changes['devices']],
+                         ["TEST-DEVICE0", "TEST-DEVICE1", "TEST-DEVICE2"])
+
+        unchanged = self.changes(changes['cursor'])
+        self.assertEqual(unchanged['devices'], [])
+        self.assertEqual(unchanged['recording_sessions'], [])
+        self.assertEqual(unchanged['device_statuses'], [])
+
+        # heartbeats that only rewrite the telemetry aren't changes
+        self.heartbeat("TEST-DEVICE1")
+        changes = self.changes(unchanged['cursor'])
+        self.assertEqual(changes['devices'], [])
+
+        self.heartbeat("TEST-DEVICE1", recording=True)
+        changes = self.changes(changes['cursor'])
+        self.assertEqual([d['name'] for d in changes['devices']],
+                         ["TEST-DEVICE1"])
+
+        device_id = model.Device.get_by_name("TEST-DEVICE2").id
+        session_id = model.RecordingSession.create(
+            [{'device_id': device_id, 'filename_prefix': "prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True).id
+        self.session.remove()
+
+        changes = self.changes(changes['cursor'])
+        self.assertEqual([d['name'] for d in changes['devices']],
+                         ["TEST-DEVICE2"])
+        self.assertEqual(changes['devices'][0]['session_id'], session_id)
+        self.assertEqual([s['id'] for s in changes['recording_sessions']],
+                         [session_id])
+        self.assertEqual(changes['device_statuses'], [{
+            'device_id': device_id,
+            'session_id': session_id,
+            'filename_prefix': "prefix",
+            'recording_time': 0,
+            'recording_started': None,
+            'status': 'PENDING',
+            'message': None
+        }])
+
+        model.RecordingSession.get_by_id(session_id).cancel()
+        self.session.remove()
+        changes = self.changes(changes['cursor'])
+        self.assertEqual(changes['recording_sessions'][0]['status'], 'CANCELED')
+        self.assertEqual(changes['device_statuses'][0]['status'], 'CANCELED')
+
+    def test_down(self):
+        """ devices that went DOWN are included without being changed """
+        cursor = self.changes()['cursor']
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = -60
+        changes = self.changes(cursor)
+        self.assertEqual({d['state'] for d in changes['devices']}, {'DOWN'})
+        self.assertEqual(len(changes['devices']), 3)
+        self.assertEqual(self.changes(changes['cursor'])['devices'], [])
+
+    def test_back_from_down(self):
+        """ devices that were DOWN are changed by their next heartbeat """
+        cursor = self.changes()['cursor']
+        # the device is DOWN when its heartbeat arrives
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = -60
+        self.heartbeat("TEST-DEVICE1")
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = 60
+        changes = self.changes(cursor)
+        self.assertEqual([(d['name'], d['state']) for d in changes['devices']],
+                         [("TEST-DEVICE1", 'IDLE')])
+
+    def test_shards(self):
+        """ revisions of every shard of the change counter are synchronized """
+        cursor = self.changes()['cursor']
+        names = []
+        for shard in range(model.ChangeCounter.SHARDS):
+            device = model.Device.get_by_name("TEST-DEVICE1")
+            device.location = f"ROOM-{shard}"
+            with mock.patch('random.randrange', return_value=shard):
+                self.session.commit()
+            self.session.remove()
+
+            changes = self.changes(cursor)
+            cursor = changes['cursor']
+            names.extend(d['location'] for d in changes['devices'])
+        self.assertEqual(names, [f"ROOM-{shard}" for shard in
+                                 range(model.ChangeCounter.SHARDS)])
+
+    def test_old_cursor(self):
+        """ cursors of the single revision counter get everything again """
+        cursor = encode_cursor({'revision': 1000, 'down_cutoff': None})
+        self.assertEqual(len(self.changes(cursor)['devices']), 3)
+
+    def test_invalid_cursor(self):
+        """ invalid cursors are rejected """
+        response = self.client.get(self.__endpoint,
+                                   query_string={'since': "not a cursor"},
+                                   headers=self.headers)
+        self.assert400(response)
+
+
+if __name__ == '__main__':
+    unittest.main()
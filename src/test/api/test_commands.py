@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+
+import tempfile
+import threading
+import time
+import unittest
+
+import src.app.model as model
+from src.app.model.utils import notify
+from src.app.model.utils.notify import LocalNotifier, SocketNotifier
+from src.test import BaseDBTestCase
+
+
+def create_session(device_id):
+    """ add a device to a new recording session """
+    model.RecordingSession.create(
+        [{'device_id': device_id, 'filename_prefix': "test_prefix"}],
+        duration=600, name="test session", fragment_hourly=True,
+        target_fps=30, apply_filter=True)
+    model.SESSION.remove()
+
+
+class TestNotifier(unittest.TestCase):
+    """ tests for the notifiers used to wake up long-polls """
+
+    def test_local_notifier(self):
+        """ waiters are woken by notify() and time out otherwise """
+        notifier = LocalNotifier()
+        self.assertFalse(notifier.wait(1, 0.05))
+
+        threading.Timer(0.1, notifier.notify, args=([1, 2],)).start()
+        self.assertTrue(notifier.wait(1, 5))
+
+        # notification for key 2 wasn't picked up yet, it is remembered
+        self.assertTrue(notifier.wait(2, 0))
+        self.assertFalse(notifier.wait(2, 0))
+
+    def test_socket_notifier(self):
+        """ notifications reach waiters using another notifier """
+        with tempfile.TemporaryDirectory() as directory:
+            waiter = SocketNotifier(directory)
+            sender = SocketNotifier(directory)
+            self.assertFalse(waiter.wait(1, 0))
+
+            threading.Timer(0.1, sender.notify, args=([1],)).start()
+            self.assertTrue(waiter.wait(1, 5))
+
+
+class TestDeviceCommands(BaseDBTestCase):
+    """ tests for the command long-poll endpoint """
+
+    __endpoint = '/api/device/TEST-DEVICE/commands'
+
+    def setUp(self):
+        self.app.config['COMMAND_LONG_POLL'] = True
+        self.client.post('/api/device/heartbeat', json=self.make_payload())
+        self.device_id = model.Device.get_by_name("TEST-DEVICE").id
+        self.session.remove()
+
+    def test_disabled(self):
+        """ 404 if long-polling isn't enabled """
+        self.app.config['COMMAND_LONG_POLL'] = False
+        self.assert404(self.client.get(self.__endpoint))
+
+    def test_unknown_device(self):
+        """ 404 for a device we haven't heard from """
+        self.assert404(self.client.get('/api/device/UNKNOWN/commands?wait=0'))
+
+    def test_no_command(self):
+        """ 204 once the wait expires """
+        response = self.client.get(self.__endpoint + '?wait=0')
+        self.assertStatus(response, 204)
+
+    def test_command_pending(self):
+        """ a command that became pending before the poll isn't missed """
+        create_session(self.device_id)
+        response = self.client.get(self.__endpoint + '?wait=0')
+        self.assert200(response)
+        self.assertTrue(response.json['pending'])
+
+    def test_missed_notification(self):
+        """ a pending command is found even if its notification was missed """
+        create_session(self.device_id)
+        notify.wait(self.device_id, 0)
+        response = self.client.get(self.__endpoint + '?wait=0')
+        self.assert200(response)
+
+        # until the device receives it
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload(ack_seq=0))
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload(ack_seq=1))
+        self.assertStatus(self.client.get(self.__endpoint + '?wait=0'), 204)
+
+    def test_held_start(self):
+        """ a START held back until the device's wave isn't pending """
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload("TEST-DEVICE2"))
+        second_id = model.Device.get_by_name("TEST-DEVICE2").id
+        self.session.remove()
+        model.RecordingSession.create(
+            [{'device_id': i, 'filename_prefix': "test_prefix"}
+             for i in (self.device_id, second_id)],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True, start_wave_size=1,
+            start_wave_interval=60)
+        model.SESSION.remove()
+        self.assert200(self.client.get(self.__endpoint + '?wait=0'))
+        self.assertStatus(
+            self.client.get('/api/device/TEST-DEVICE2/commands?wait=0'), 204)
+
+    def test_wake_up(self):
+        """ the poll returns as soon as a command becomes pending """
+        threading.Timer(0.2, create_session, args=(self.device_id,)).start()
+        start = time.monotonic()
+        response = self.client.get(self.__endpoint + '?wait=10')
+        self.assert200(response)
+        self.assertLess(time.monotonic() - start, 5)
+
+        # the device gets the command with its next heartbeat
+        response = self.client.post('/api/device/heartbeat',
+                                    json=self.make_payload())
+        self.assertEqual(response.json['command_name'], 'START')
+
+
+if __name__ == '__main__':
+    unittest.main()
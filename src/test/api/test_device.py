@@ -1,10 +1,19 @@
 #! /usr/bin/env python
 
-import unittest
 import json
+import threading
+import unittest
+from unittest import mock
+
+from datetime import datetime, timedelta
+from flask_restplus import marshal
 
-from datetime import datetime
 import src.app.model as model
+from src.app.controller import device_controller
+from src.app.controller.device_controller import SUMMARY_CACHE
+from src.app.controller.schemas import DEVICE_SCHEMA
+from src.app.controller.utils.device_cache import DeviceSnapshotCache
+from src.app.controller.utils.ttl_cache import TTLCache
 
 from src.test import BaseDBTestCase
 from src.utils.logging import get_module_logger
@@ -33,7 +42,7 @@ class TestDevice(BaseDBTestCase):
             total_ram=8388608,
             free_ram=7759462,
             load=0.66,
-            sensor_status=json.dumps(sensor_status),
+            sensor_status=sensor_status,
             total_disk=2000000,
             free_disk=1258291
         )
@@ -53,7 +62,7 @@ class TestDevice(BaseDBTestCase):
             total_ram=8388608,
             free_ram=7759462,
             load=0.66,
-            sensor_status=json.dumps(sensor_status),
+            sensor_status=sensor_status,
             total_disk=2000000,
             free_disk=1258291
         )
@@ -104,5 +113,262 @@ class TestDevice(BaseDBTestCase):
         self.assert404(response)
 
 
+class TestDeviceSnapshotCache(BaseDBTestCase):
+    """ tests for the cache used to render the device list """
+
+    def setUp(self):
+        for name, recording in [("TEST-DEVICE1", False), ("TEST-DEVICE2", True)]:
+            model.add_object(model.Device(
+                name=name,
+                last_update=datetime.utcnow(),
+                uptime=128324,
+                total_ram=8388608,
+                free_ram=7759462,
+                load=0.66,
+                sensor_status={'camera': {'recording': recording}},
+                total_disk=2000000,
+                free_disk=1258291,
+                release="fake device"
+            ))
+        self.cache = DeviceSnapshotCache(DEVICE_SCHEMA)
+
+    def render(self, recording=False):
+        page = model.Device.get_versions(recording=recording)
+        rendered = json.loads(self.cache.render(page.items, not recording))
+        self.session.remove()
+        return rendered
+
+    def expected(self):
+        expected = json.loads(json.dumps(
+            marshal(model.Device.get_devices(), DEVICE_SCHEMA)))
+        self.session.remove()
+        return expected
+
+    def test_render(self):
+        """ the cache renders devices the same way DEVICE_SCHEMA does """
+        self.assertEqual(self.render(), self.expected())
+        self.assertEqual(self.cache.misses, 2)
+
+        self.assertEqual(self.render(), self.expected())
+        self.assertEqual(self.cache.hits, 2)
+        self.assertEqual(self.cache.misses, 2)
+
+        self.assertEqual([d['name'] for d in self.render(recording=True)],
+                         ["TEST-DEVICE2"])
+
+    def test_invalidate(self):
+        """ only devices touched since they were rendered are rendered again """
+        self.render()
+        device = model.Device.get_by_name("TEST-DEVICE1")
+        device.last_update = datetime.utcnow()
+        device.load = 1.5
+        self.session.commit()
+        self.session.remove()
+
+        devices = self.render()
+        self.assertEqual(devices, self.expected())
+        self.assertEqual(devices[0]['system_info']['load'], 1.5)
+        self.assertEqual(self.cache.misses, 3)
+
+        model.Device.get_by_name("TEST-DEVICE2").session_id = 1
+        self.session.commit()
+        self.session.remove()
+        self.assertEqual(self.render()[1]['state'], 'BUSY')
+        self.assertEqual(self.cache.misses, 4)
+
+        self.session.query(model.Device).filter(
+            model.Device.name == "TEST-DEVICE1").delete()
+        self.session.commit()
+        self.assertEqual([d['name'] for d in self.render()], ["TEST-DEVICE2"])
+
+    def test_down(self):
+        """ DOWN is derived when the list is rendered, not cached """
+        self.assertEqual({d['state'] for d in self.render()}, {'IDLE'})
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = -60
+        self.assertEqual({d['state'] for d in self.render()}, {'DOWN'})
+        self.assertEqual(self.cache.misses, 2)
+
+
+class TestDeviceListPages(BaseDBTestCase):
+    """ tests for paging through and filtering the device list """
+
+    __endpoint = '/api/device'
+
+    def setUp(self):
+        now = datetime.utcnow()
+        for i in range(5):
+            model.add_object(model.Device(
+                name=f"TEST-DEVICE{i}",
+                location="ROOM-A/RACK-1" if i % 2 else "ROOM_B",
+                last_update=now - timedelta(hours=1) if i == 4 else now,
+                sensor_status={'camera': {'recording': False}}
+            ))
+        self.headers = self.auth_headers()
+
+    def get(self, **args):
+        return self.client.get(self.__endpoint, query_string=args,
+                               headers=self.headers)
+
+    def names(self, **args):
+        """ names of every device listed, following cursors """
+        names = []
+        while True:
+            response = self.get(**args)
+            self.assert200(response)
+            names.extend(d['name'] for d in response.json)
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor is None:
+                return names
+            args['cursor'] = cursor
+
+    def test_pages(self):
+        """ following the cursor visits every device once, in order """
+        response = self.get(limit=2)
+        self.assertEqual([d['name'] for d in response.json],
+                         ["TEST-DEVICE0", "TEST-DEVICE1"])
+        self.assertIn('X-Next-Cursor', response.headers)
+
+        self.assertEqual(self.names(limit=2),
+                         [f"TEST-DEVICE{i}" for i in range(5)])
+        self.assertNotIn('X-Next-Cursor', self.get().headers)
+
+    @mock.patch.object(device_controller, 'DEVICE_PAGE_SIZE', 2)
+    def test_default_limit(self):
+        """ without a limit or cursor every device is listed """
+        response = self.get()
+        self.assertEqual(len(response.json), 5)
+        self.assertNotIn('X-Next-Cursor', response.headers)
+
+        # a cursor without a limit gets pages of the default size
+        cursor = self.get(limit=1).headers['X-Next-Cursor']
+        response = self.get(cursor=cursor)
+        self.assertEqual([d['name'] for d in response.json],
+                         ["TEST-DEVICE1", "TEST-DEVICE2"])
+        self.assertIn('X-Next-Cursor', response.headers)
+
+    def test_filters(self):
+        """ filters are applied before paging """
+        self.assertEqual(self.names(limit=1, state='DOWN'), ["TEST-DEVICE4"])
+        self.assertEqual(self.names(limit=1, state='IDLE'),
+                         [f"TEST-DEVICE{i}" for i in range(4)])
+        self.assertEqual(self.names(state='BUSY'), [])
+        self.assertEqual(self.names(limit=1, location="ROOM-A"),
+                         ["TEST-DEVICE1", "TEST-DEVICE3"])
+        # LIKE wildcards in the prefix are matched literally
+        self.assertEqual(self.names(location="ROOM_"),
+                         ["TEST-DEVICE0", "TEST-DEVICE2", "TEST-DEVICE4"])
+        self.assertEqual(self.names(session_id=1), [])
+
+    def test_bad_arguments(self):
+        """ invalid cursors and filters are rejected """
+        self.assert400(self.get(cursor="not a cursor"))
+        self.assert400(self.get(state="ASLEEP"))
+        self.assert400(self.get(limit=0))
+
+
+class TestDeviceSummary(BaseDBTestCase):
+    """ tests for the fleet summary """
+
+    __endpoint = '/api/device/summary'
+
+    def setUp(self):
+        now = datetime.utcnow()
+        for i in range(4):
+            model.add_object(model.Device(
+                name=f"TEST-DEVICE{i}",
+                location="ROOM-A" if i % 2 else "ROOM-B",
+                last_update=now - timedelta(hours=1) if i == 3 else now,
+                sensor_status={'camera': {'recording': i == 1}},
+                total_disk=1000, free_disk=100 * i
+            ))
+        device_id = model.Device.get_by_name("TEST-DEVICE1").id
+        model.RecordingSession.create(
+            [{'device_id': device_id, 'filename_prefix': "prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        model.DeviceRecordingStatus.query.one().update_status(
+            model.DeviceRecordingStatus.Status.RECORDING)
+        self.session.remove()
+        SUMMARY_CACHE.clear()
+        self.headers = self.auth_headers()
+
+    def get(self, **args):
+        response = self.client.get(self.__endpoint, query_string=args,
+                                   headers=self.headers)
+        self.assert200(response)
+        return response.json
+
+    def test_summary(self):
+        """ devices are counted by state and their disk space added up """
+        summary = self.get()
+        self.assertEqual(summary['total'], {
+            'devices': 4, 'idle': 2, 'busy': 1, 'down': 1, 'recording': 1,
+            'pending': 0, 'camera_recording': 1, 'total_disk': 4000,
+            'free_disk': 600
+        })
+        self.assertIsNone(summary['locations'])
+        self.assertGreaterEqual(summary['compute_time'], 0)
+
+    def test_by_location(self):
+        """ each location is summarized separately """
+        locations = self.get(by_location=True)['locations']
+        self.assertEqual([l['location'] for l in locations],
+                         ["ROOM-A", "ROOM-B"])
+        self.assertEqual(
+            [(l['devices'], l['idle'], l['busy'], l['down']) for l in locations],
+            [(2, 0, 1, 1), (2, 2, 0, 0)])
+        self.assertEqual([l['free_disk'] for l in locations], [400, 200])
+
+    def test_cache(self):
+        """ the summary is cached for SUMMARY_TTL seconds """
+        self.app.config['SUMMARY_TTL'] = 60
+        summary = self.get()
+        model.add_object(model.Device(name="TEST-DEVICE4"))
+        self.assertEqual(self.get(), summary)
+
+        self.app.config['SUMMARY_TTL'] = 0
+        self.assertEqual(self.get()['total']['devices'], 5)
+
+
+class TestTTLCache(unittest.TestCase):
+    """ tests for the cache of the device summary """
+
+    def test_locks(self):
+        """ a slow computation only holds up requests for the same key """
+        cache = TTLCache()
+        computing = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append('slow')
+            computing.set()
+            release.wait(5)
+            calls.append('slow done')
+            return 'slow'
+
+        def fast():
+            calls.append('fast')
+            return 'fast'
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(cache.get('slow', 60, slow)))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(computing.wait(5))
+
+        # computed while the slow value is still being computed
+        self.assertEqual(cache.get('fast', 60, fast), 'fast')
+
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ['slow', 'slow'])
+        self.assertEqual(calls, ['slow', 'fast', 'slow done'])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,222 @@
+#! /usr/bin/env python
+
+import time
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+import src.app.model as model
+from src.test import BaseDBTestCase, count_statements
+
+
+class TestConditionalGet(BaseDBTestCase):
+    """ tests for ETags and If-None-Match on device and session reads """
+
+    def setUp(self):
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload("TEST-DEVICE1"))
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload("TEST-DEVICE2"))
+        self.device_id = model.Device.get_by_name("TEST-DEVICE1").id
+        self.session.remove()
+        self.headers = self.auth_headers()
+
+    def get(self, endpoint, etag=None):
+        headers = dict(self.headers)
+        if etag:
+            headers['If-None-Match'] = etag
+        with count_statements(self.engine) as counts:
+            response = self.client.get(endpoint, headers=headers)
+        self.statements = counts['statements']
+        self.session.remove()
+        return response
+
+    def assert_conditional(self, endpoint, statements=1):
+        """
+        check a second request for an unchanged resource gets a 304, with
+        only the given number of statements, None to not check it
+        """
+        response = self.get(endpoint)
+        self.assert200(response)
+        etag = response.headers['ETag']
+
+        response = self.get(endpoint, etag)
+        self.assertStatus(response, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.data, b'')
+        if statements is not None:
+            self.assertEqual(len(self.statements), statements,
+                             "\n".join(self.statements))
+        return etag
+
+    def test_device_list(self):
+        """ the device list ETag changes when a device sends a heartbeat """
+        etag = self.assert_conditional('/api/device')
+        self.assert200(self.get('/api/device?state=IDLE', etag))
+
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload("TEST-DEVICE2"))
+        self.session.remove()
+        response = self.get('/api/device', etag)
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_device_list_down(self):
+        """ devices going DOWN change the ETag without any write """
+        etag = self.assert_conditional('/api/device')
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = -60
+        response = self.get('/api/device', etag)
+        self.assert200(response)
+        self.assertEqual({d['state'] for d in response.json}, {'DOWN'})
+
+    def test_device(self):
+        """ a device's ETag only changes when that device changes """
+        endpoint = f'/api/device/{self.device_id}'
+        etag = self.assert_conditional(endpoint)
+
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload("TEST-DEVICE2"))
+        self.assertStatus(self.get(endpoint, etag), 304)
+
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload("TEST-DEVICE1"))
+        self.assert200(self.get(endpoint, etag))
+        self.assert404(self.get('/api/device/1234'))
+
+    def test_device_revision(self):
+        """ a device's ETag changes when it is edited or goes DOWN """
+        endpoint = f'/api/device/{self.device_id}'
+        etag = self.assert_conditional(endpoint)
+
+        model.Device.get_by_id(self.device_id).location = 'Room 1'
+        self.session.commit()
+        self.session.remove()
+        response = self.get(endpoint, etag)
+        self.assert200(response)
+        self.assertEqual(response.json['location'], 'Room 1')
+
+        etag = response.headers['ETag']
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = -60
+        response = self.get(endpoint, etag)
+        self.assert200(response)
+        self.assertEqual(response.json['state'], 'DOWN')
+
+    def test_recording_sessions(self):
+        """ session ETags change when a session is changed """
+        session = model.RecordingSession.create(
+            [{'device_id': self.device_id, 'filename_prefix': "prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        session_id = session.id
+        self.session.remove()
+
+        # the device is PENDING, nothing changes with time
+        list_etag = self.assert_conditional('/api/recording-session', None)
+        etag = self.assert_conditional(f'/api/recording-session/{session_id}',
+                                       None)
+
+        model.RecordingSession.get_by_id(session_id).cancel()
+        self.session.remove()
+        response = self.get('/api/recording-session', list_etag)
+        self.assert200(response)
+        self.assertEqual(response.json[0]['status'], 'CANCELED')
+        self.assert200(self.get(f'/api/recording-session/{session_id}', etag))
+
+        self.assert_conditional('/api/recording-session')
+        self.assert_conditional(f'/api/recording-session/{session_id}')
+        self.assert_conditional(f'/api/recording-session/{session_id}/devices')
+
+    def test_recording_time(self):
+        """ the ETag of an IN_PROGRESS session changes as it records """
+        session = model.RecordingSession.create(
+            [{'device_id': self.device_id, 'filename_prefix': "prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        session_id = session.id
+        status = session.device_statuses[0]
+        status.status = model.DeviceRecordingStatus.Status.RECORDING
+        status.recording_started = datetime.utcnow()
+        self.session.commit()
+        self.session.remove()
+
+        endpoints = ['/api/recording-session',
+                     f'/api/recording-session/{session_id}',
+                     f'/api/recording-session/{session_id}/devices']
+        etags = [self.assert_conditional(e, None) for e in endpoints]
+
+        # time passing changes recording_time without any write, like
+        # moving recording_started back without bumping the change counter
+        before = model.ChangeCounter.get_version()
+        self.session.execute(
+            update(model.DeviceRecordingStatus)
+            .where(model.DeviceRecordingStatus.session_id == session_id)
+            .values(recording_started=datetime.utcnow() -
+                    timedelta(seconds=60)))
+        self.session.commit()
+        self.assertEqual(model.ChangeCounter.get_version(), before)
+
+        for endpoint, etag in zip(endpoints, etags):
+            response = self.get(endpoint, etag)
+            self.assert200(response)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_time_bucket(self):
+        """ ETags of reads with recording times change with time """
+        session = model.RecordingSession.create(
+            [{'device_id': self.device_id, 'filename_prefix': "prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        session_id = session.id
+        status = session.device_statuses[0]
+        status.status = model.DeviceRecordingStatus.Status.RECORDING
+        status.recording_started = datetime.utcnow()
+        self.session.commit()
+        self.session.remove()
+
+        # a single query until the interval changes
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            session_etag = self.assert_conditional(
+                f'/api/recording-session/{session_id}')
+            archived_etag = self.assert_conditional(
+                '/api/recording-session?archived=true')
+
+        later = now + self.app.config['TIMED_ETAG_INTERVAL']
+        with mock.patch('time.time', return_value=later):
+            response = self.get(f'/api/recording-session/{session_id}',
+                                session_etag)
+            self.assert200(response)
+            self.assertNotEqual(response.headers['ETag'], session_etag)
+            # no archived session is recording, the list is the same
+            self.assertStatus(self.get(
+                '/api/recording-session?archived=true', archived_etag), 304)
+
+    def test_change_counter(self):
+        """ counters are incremented once by each transaction with changes """
+        before = model.ChangeCounter.get_version()
+        device = model.Device.get_by_id(self.device_id)
+        device.location = "ROOM-A"
+        device.last_update = datetime.utcnow()
+        self.session.commit()
+        self.assertEqual(model.ChangeCounter.get_version(),
+                         (before[0] + 1,))
+
+        # setting an attribute to its current value isn't a change
+        model.Device.get_by_id(self.device_id).location = "ROOM-A"
+        self.session.commit()
+        self.assertEqual(model.ChangeCounter.get_version(),
+                         (before[0] + 1,))
+
+        # neither is heartbeat telemetry
+        device = model.Device.get_by_id(self.device_id)
+        device.last_update = datetime.utcnow()
+        device.load = 2.0
+        self.session.commit()
+        self.assertEqual(model.ChangeCounter.get_version(),
+                         (before[0] + 1,))
+
+
+if __name__ == '__main__':
+    unittest.main()
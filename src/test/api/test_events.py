@@ -0,0 +1,209 @@
+#! /usr/bin/env python
+
+import json
+import tempfile
+import unittest
+
+
+import src.app.model as model
+from src.app.model.utils import notify
+from src.app.model.utils.notify import LocalNotifier, SocketNotifier
+from src.test import BaseDBTestCase
+
+
+def parse_events(chunk):
+    """ parse a chunk of a text/event-stream into (event, data) tuples """
+    events = []
+    for block in chunk.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines()
+                      if not line.startswith(":"))
+        if fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+class TestSubscriptions(unittest.TestCase):
+    """ tests for delivering published events to subscribers """
+
+    def test_local(self):
+        """ events are delivered to every subscriber until it unsubscribes """
+        notifier = LocalNotifier()
+        self.assertFalse(notifier.has_subscribers())
+        first = notifier.subscribe()
+        second = notifier.subscribe()
+        notifier.publish([1, 2])
+        self.assertEqual(first.get(0), [1, 2])
+        self.assertEqual(first.get(0), [])
+
+        second.close()
+        notifier.publish([3])
+        self.assertEqual(first.get(0), [3])
+        self.assertEqual(second.get(0), [1, 2])
+
+    def test_overflow(self):
+        """ subscribers that fall too far behind are dropped """
+        notifier = LocalNotifier()
+        subscription = notifier.subscribe(maxsize=2)
+        notifier.publish([1, 2])
+        self.assertFalse(subscription.overflowed)
+        notifier.publish([3])
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(subscription.get(0), [])
+
+    def test_socket(self):
+        """ events reach subscribers of another notifier """
+        with tempfile.TemporaryDirectory() as directory:
+            subscription = SocketNotifier(directory).subscribe()
+            SocketNotifier(directory).publish([{'event': 'test'}])
+            self.assertEqual(subscription.get(5), [{'event': 'test'}])
+
+    def test_socket_large_batch(self):
+        """ batches larger than a datagram are split, not truncated """
+        notifier = SocketNotifier("")
+        events = [{'event': 'test', 'data': "x" * 1000, 'id': i}
+                  for i in range(SocketNotifier.EVENT_BATCH_SIZE)]
+        messages = list(notifier._messages(  # pylint: disable=W0212
+            events, SocketNotifier.EVENT_BATCH_SIZE, b'{"events": [', b']}'))
+        self.assertGreater(len(messages), 1)
+        self.assertTrue(all(len(m) <= SocketNotifier.MAX_MESSAGE_SIZE
+                            for m in messages))
+        self.assertEqual([e for m in messages
+                          for e in json.loads(m)['events']], events)
+
+        with tempfile.TemporaryDirectory() as directory:
+            subscription = SocketNotifier(directory).subscribe()
+            SocketNotifier(directory).publish(events)
+            received = []
+            while len(received) < len(events):
+                batch = subscription.get(5)
+                self.assertTrue(batch)
+                received.extend(batch)
+            self.assertEqual(received, events)
+
+
+class TestEvents(BaseDBTestCase):
+    """ tests for the event stream """
+
+    __endpoint = '/api/events'
+
+    def setUp(self):
+        self.app.config['EVENTS_ENABLED'] = True
+        self.app.config['EVENTS_KEEP_ALIVE'] = 0
+        self.heartbeat("TEST-DEVICE")
+        self.device_id = model.Device.get_by_name("TEST-DEVICE").id
+        self.session.remove()
+        self.headers = self.auth_headers()
+
+    def heartbeat(self, name):
+        self.client.post('/api/device/heartbeat', json=self.make_payload(name))
+        self.session.remove()
+
+    def subscribe(self):
+        response = self.client.get(self.__endpoint, headers=self.headers,
+                                   buffered=False)
+        self.assert200(response)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.addCleanup(response.close)
+        stream = iter(response.response)
+        # nothing happened yet, the first chunk is always a keep-alive
+        self.assertEqual(next(stream), b": keep-alive\n\n")
+        return stream
+
+    def test_disabled(self):
+        """ 404 if the event stream isn't enabled """
+        self.app.config['EVENTS_ENABLED'] = False
+        self.assert404(self.client.get(self.__endpoint, headers=self.headers))
+
+    def test_keep_alive(self):
+        """ comments are sent while nothing happens """
+        stream = self.subscribe()
+        self.assertEqual(next(stream), b": keep-alive\n\n")
+
+    def test_session_events(self):
+        """ session, status and device state changes are streamed """
+        stream = self.subscribe()
+        self.heartbeat("NEW-DEVICE")
+        new_device_id = model.Device.get_by_name("NEW-DEVICE").id
+        self.session.remove()
+        self.assertEqual(parse_events(next(stream)), [
+            ('device', {'id': new_device_id, 'name': "NEW-DEVICE",
+                        'state': 'IDLE', 'session_id': None,
+                        'down_since': None})
+        ])
+
+        session = model.RecordingSession.create(
+            [{'device_id': self.device_id, 'filename_prefix': "prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        session_id = session.id
+        self.session.remove()
+        events = parse_events(next(stream))
+        self.assertIn(('session', {'id': session_id,
+                                   'status': 'IN_PROGRESS'}), events)
+        self.assertIn(('device_status', {
+            'device_id': self.device_id, 'session_id': session_id,
+            'status': 'PENDING', 'message': None}), events)
+        self.assertIn(('device', {'id': self.device_id,
+                                  'name': "TEST-DEVICE", 'state': 'BUSY',
+                                  'session_id': session_id,
+                                  'down_since': None}), events)
+
+        # heartbeats that don't change any state aren't streamed
+        self.heartbeat("NEW-DEVICE")
+        self.assertEqual(next(stream), b": keep-alive\n\n")
+
+        model.RecordingSession.get_by_id(session_id).cancel()
+        self.session.remove()
+        events = parse_events(next(stream))
+        self.assertIn(('session', {'id': session_id, 'status': 'CANCELED'}),
+                      events)
+        self.assertIn(('device_status', {
+            'device_id': self.device_id, 'session_id': session_id,
+            'status': 'CANCELED', 'message': None}), events)
+
+    def test_registered(self):
+        """ only devices that didn't exist yet are published as registered """
+        subscription = notify.subscribe()
+        self.addCleanup(subscription.close)
+        existing = model.Device.get_by_id(self.device_id)
+        revision = existing.revision
+        devices = model.Device.register({
+            "TEST-DEVICE": {'location': "here"},
+            "NEW-DEVICE": {'location': "there"}
+        })
+        self.session.commit()
+        self.assertEqual(sorted(devices), ["NEW-DEVICE", "TEST-DEVICE"])
+        self.assertEqual([(e['event'], e['data']['name'])
+                          for e in subscription.get(0)],
+                         [('device', "NEW-DEVICE")])
+        self.assertEqual(devices["TEST-DEVICE"].revision, revision)
+        self.assert_latest_revision(devices["NEW-DEVICE"].revision)
+
+    def test_rollback(self):
+        """ nothing is streamed for changes that are rolled back """
+        stream = self.subscribe()
+        model.Device.get_by_id(self.device_id).session_id = 1234
+        self.session.flush()
+        self.session.rollback()
+        self.assertEqual(next(stream), b": keep-alive\n\n")
+
+    def test_down(self):
+        """ devices going DOWN and coming back up are published once """
+        subscription = notify.subscribe()
+        self.addCleanup(subscription.close)
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = -60
+        model.DOWN_SWEEPER.sweep()
+        self.session.remove()
+        self.assertEqual([(e['event'], e['data']['state'])
+                          for e in subscription.get(0)],
+                         [('device', 'DOWN')])
+
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = 60
+        self.heartbeat("TEST-DEVICE")
+        self.assertEqual([(e['event'], e['data']['state'])
+                          for e in subscription.get(0)],
+                         [('device', 'IDLE')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,20 @@
 #! /usr/bin/env python
 
 import unittest
-from datetime import datetime
+import json
+from unittest import mock
+from datetime import datetime, timedelta, timezone
 
-from src.test import BaseDBTestCase
+from sqlalchemy.exc import OperationalError
+
+import src.app.model as model
+from src.app.model.utils import notify
+from src.app.controller.schemas import HEARTBEAT_SCHEMA
+from src.app.controller.utils.device_command import \
+    HEARTBEAT_STATEMENT_BUDGET, STATUS_CHANGE_STATEMENTS, \
+    SESSION_COMPLETION_STATEMENTS
+from src.app.controller.utils.payload import CompiledValidator, parse_timestamp
+from src.test import BaseDBTestCase, count_statements
 from src.utils.logging import get_module_logger
 
 LOGGER = get_module_logger()
@@ -137,5 +148,628 @@ class TestHeartbeat(BaseDBTestCase):
         self.assertStatus(response, 400)
 
 
+class TestHeartbeatParsing(unittest.TestCase):
+    """ tests for the precompiled heartbeat validation and parsing """
+
+    def test_compiled_validator_matches_jsonschema(self):
+        """ compiled checks accept and reject the same payloads """
+        validator = CompiledValidator(HEARTBEAT_SCHEMA)
+        make_payload = BaseDBTestCase.make_payload
+        payloads = [make_payload(), make_payload(recording=True, duration=5,
+                                                 session_id=1)]
+        for path, value in [(('name',), 5),
+                            (('session_id',), "1"),
+                            (('sensor_status', 'camera', 'recording'), 1),
+                            (('sensor_status', 'camera', 'fps'), True),
+                            (('system_info', 'load'), "0.5"),
+                            (('system_info', 'uptime'), 1.5)]:
+            payload = make_payload()
+            target = payload
+            for key in path[:-1]:
+                target = target[key]
+            target[path[-1]] = value
+            payloads.append(payload)
+        payload = make_payload()
+        del payload['system_info']['release']
+        payloads.extend([payload, [], "heartbeat"])
+
+        for payload in payloads:
+            self.assertEqual(validator._check(payload),  # pylint: disable=W0212
+                             validator._validator.is_valid(payload),  # pylint: disable=W0212
+                             payload)
+
+    def test_parse_timestamp(self):
+        """ ISO 8601 fast path, with dateutil for anything else """
+        expected = datetime(2020, 1, 2, 3, 4, 5, 123000)
+        self.assertEqual(parse_timestamp("2020-01-02T03:04:05.123"), expected)
+        self.assertEqual(parse_timestamp("2020-01-02T03:04:05.123Z"),
+                         expected.replace(tzinfo=timezone.utc))
+        self.assertEqual(parse_timestamp("2020-01-02T03:04:05.123+0000"),
+                         parse_timestamp("2020-01-02T03:04:05.123Z"))
+        self.assertEqual(parse_timestamp("Jan 2 2020 03:04:05.123"), expected)
+        with self.assertRaises(ValueError):
+            parse_timestamp("not a valid timestamp")
+
+
+class HeartbeatStatementTestCase(BaseDBTestCase):
+    """ base class for tests that count the statements a request issues """
+
+    def setUp(self):
+        self.statements = []
+        self.commits = []
+
+    def _post(self, endpoint, payload):
+        with count_statements(self.engine) as counts:
+            response = self.client.post(endpoint, json=payload)
+        self.statements = counts['statements']
+        self.commits = counts['commits']
+        return response
+
+
+class TestHeartbeatStatementBudget(HeartbeatStatementTestCase):
+    """
+    a heartbeat is processed as a single unit of work, check that it stays
+    within its documented statement budget and commits once
+    """
+
+    def _heartbeat(self, payload, budget=HEARTBEAT_STATEMENT_BUDGET):
+        response = self._post('/api/device/heartbeat', payload)
+        self.assertLessEqual(len(self.statements), budget,
+                             "\n".join(self.statements))
+        self.assertEqual(len(self.commits), 1)
+        return response
+
+    def test_session_lifecycle(self):
+        """ every heartbeat in a recording session stays within budget """
+
+        # first heartbeat registers the device, which takes an extra
+        # statement on SQLite
+        response = self._post('/api/device/heartbeat', self.make_payload())
+        self.assertStatus(response, 204)
+        self.assertLessEqual(len(self.statements),
+                             HEARTBEAT_STATEMENT_BUDGET + 1,
+                             "\n".join(self.statements))
+        self.assertEqual(len(self.commits), 1)
+
+        device = model.Device.get_by_name("TEST-DEVICE")
+        session = model.RecordingSession.create(
+            [{'device_id': device.id, 'filename_prefix': "test_prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        session_id = session.id
+        self.session.remove()
+
+        # device is PENDING and doesn't know about the session yet
+        response = self._heartbeat(self.make_payload())
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['command_name'], 'START')
+        self.assertEqual(
+            json.loads(response.json['parameters'])['session_id'], session_id)
+
+        # device joins the session
+        response = self._heartbeat(
+            self.make_payload(recording=True, duration=10,
+                              session_id=session_id),
+            HEARTBEAT_STATEMENT_BUDGET + STATUS_CHANGE_STATEMENTS)
+        self.assertStatus(response, 204)
+
+        # device is recording
+        response = self._heartbeat(
+            self.make_payload(recording=True, duration=20,
+                              session_id=session_id))
+        self.assertStatus(response, 204)
+
+        # device finished recording, which completes the session
+        response = self._heartbeat(
+            self.make_payload(recording=False, duration=600,
+                              session_id=session_id),
+            HEARTBEAT_STATEMENT_BUDGET + STATUS_CHANGE_STATEMENTS +
+            SESSION_COMPLETION_STATEMENTS)
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['command_name'], 'COMPLETE')
+
+        device = model.Device.get_by_name("TEST-DEVICE")
+        self.assertIsNone(device.session_id)
+        status = model.RecordingSession.get_by_id(session_id).device_statuses[0]
+        self.assertEqual(status.status, model.DeviceRecordingStatus.Status.COMPLETE)
+        self.assertEqual(status.recording_time, 600)
+        self.assertEqual(status.session.status,
+                         model.RecordingSession.Status.COMPLETE)
+
+
+
+class TestRecordingTime(HeartbeatStatementTestCase):
+    """
+    the recording time of a device is computed from when it started
+    recording rather than written by every heartbeat
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client.post('/api/device/heartbeat', json=self.make_payload())
+        device = model.Device.get_by_name("TEST-DEVICE")
+        session = model.RecordingSession.create(
+            [{'device_id': device.id, 'filename_prefix': "test_prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        self.session_id = session.id
+        self.session.remove()
+
+    def _recording(self, duration, **kwargs):
+        self._post('/api/device/heartbeat',
+                   self.make_payload(recording=True, duration=duration,
+                                     session_id=self.session_id, **kwargs))
+        return [s for s in self.statements
+                if s.startswith("UPDATE session_device_status")]
+
+    def _status(self):
+        status = model.DeviceRecordingStatus.query.one()
+        self.session.remove()
+        return status
+
+    def test_drift(self):
+        """ the status is only written when the reported time drifts """
+        self.assertEqual(len(self._recording(10)), 1)
+        status = self._status()
+        self.assertEqual(status.recording_time, 10)
+        started = status.recording_started
+
+        # steady heartbeats don't write anything
+        drift = self.app.config['RECORDING_TIME_DRIFT']
+        self.assertEqual(self._recording(10 + drift), [])
+        status = self._status()
+        self.assertEqual(status.recording_started, started)
+        self.assertEqual(status.reported_time, 10)
+
+        # the time is computed while the device is recording
+        later = datetime.now(timezone.utc) + timedelta(seconds=60)
+        self.assertIn(status.recording_time_at(later), (70, 71))
+
+        # the device's clock runs ahead
+        self.assertEqual(len(self._recording(11 + drift)), 1)
+        self.assertEqual(self._status().recording_time, 11 + drift)
+
+    def test_stopped(self):
+        """ the time is written when the device leaves RECORDING """
+        self._recording(100)
+        self._post('/api/device/heartbeat',
+                   self.make_payload(session_id=self.session_id))
+        status = self._status()
+        self.assertEqual(status.status,
+                         model.DeviceRecordingStatus.Status.COMPLETE)
+        self.assertEqual(status.recording_time, 0)
+
+        self.setUp()
+        self._recording(100)
+        model.RecordingSession.get_by_id(self.session_id).cancel()
+        self.session.remove()
+        status = model.DeviceRecordingStatus.query.filter_by(
+            session_id=self.session_id).one()
+        self.assertEqual(status.status,
+                         model.DeviceRecordingStatus.Status.CANCELED)
+        self.assertEqual(status.reported_time, 100)
+
+        # the device reports what it recorded until it stops, written when
+        # it drifts from the time last written
+        drift = self.app.config['RECORDING_TIME_DRIFT']
+        self.assertEqual(self._recording(100 + drift), [])
+        self.assertEqual(len(self._recording(101 + drift)), 1)
+        status = model.DeviceRecordingStatus.query.filter_by(
+            session_id=self.session_id).one()
+        self.assertEqual(status.recording_time, 101 + drift)
+
+    def test_duration_missing(self):
+        """ duration is optional in heartbeats from any status """
+        payload = self.make_payload(recording=True,
+                                    session_id=self.session_id)
+        del payload['sensor_status']['camera']['duration']
+
+        # PENDING, then RECORDING
+        for _ in range(2):
+            self.assertStatus(self._post('/api/device/heartbeat', payload),
+                              204)
+        self.assertEqual(self._status().status,
+                         model.DeviceRecordingStatus.Status.RECORDING)
+
+        model.RecordingSession.get_by_id(self.session_id).cancel()
+        self.session.remove()
+        response = self._post('/api/device/heartbeat', payload)
+        self.assert200(response)
+        self.assertEqual(response.json['command_name'], 'STOP')
+
+
+class TestHeartbeatBatch(HeartbeatStatementTestCase):
+    """ tests for the batched heartbeat endpoint """
+
+    __endpoint = '/api/device/heartbeats'
+
+    def test_batch(self):
+        """ one command per heartbeat, in order """
+        names = [f"TEST-DEVICE{i}" for i in range(3)]
+        response = self._post(self.__endpoint,
+                              [self.make_payload(name) for name in names])
+        self.assert200(response)
+        self.assertEqual([r['name'] for r in response.json], names)
+        self.assertTrue(all(r['command_name'] is None for r in response.json))
+        self.assertEqual(len(model.Device.get_devices()), 3)
+
+        device = model.Device.get_by_name("TEST-DEVICE1")
+        model.RecordingSession.create(
+            [{'device_id': device.id, 'filename_prefix': "test_prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        self.session.remove()
+
+        response = self._post(self.__endpoint,
+                              [self.make_payload(name) for name in names])
+        self.assert200(response)
+        self.assertEqual([r['command_name'] for r in response.json],
+                         [None, 'START', None])
+        self.assertEqual(len(self.commits), 1)
+
+    def test_batch_statement_count(self):
+        """ statement count doesn't depend on the size of the batch """
+        counts = []
+        for size in (5, 20):
+            payload = [self.make_payload(f"TEST-DEVICE{i}")
+                       for i in range(size)]
+            # register the devices, then send a regular heartbeat batch
+            self._post(self.__endpoint, payload)
+            response = self._post(self.__endpoint, payload)
+            self.assert200(response)
+            self.assertEqual(len(response.json), size)
+            counts.append(len(self.statements))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_batch_invalid_heartbeat(self):
+        """ the whole batch is rejected if any heartbeat is invalid """
+        payload = [self.make_payload("TEST-DEVICE1"),
+                   self.make_payload("TEST-DEVICE2")]
+        del payload[1]['name']
+        response = self.client.post(self.__endpoint, json=payload)
+        self.assert400(response)
+        self.assertEqual(len(model.Device.get_devices()), 0)
+
+
+class TestCommandQueue(HeartbeatStatementTestCase):
+    """ tests for devices that receive commands from their command queue """
+
+    __endpoint = '/api/device/heartbeat'
+
+    def setUp(self):
+        super().setUp()
+        self.client.post(self.__endpoint, json=self.make_payload(ack_seq=0))
+        self.device_id = model.Device.get_by_name("TEST-DEVICE").id
+        self.session.remove()
+
+    def _create_session(self):
+        session = model.RecordingSession.create(
+            [{'device_id': self.device_id, 'filename_prefix': "test_prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        session_id = session.id
+        self.session.remove()
+        return session_id
+
+    def _queued(self, response):
+        return [(c['seq'], c['command_name']) for c in response.json['commands']]
+
+    def test_idle(self):
+        """ idle devices with an empty queue skip the state machine """
+        response = self._post(self.__endpoint, self.make_payload(ack_seq=0))
+        self.assertStatus(response, 204)
+        self.assertFalse([s for s in self.statements if 'FROM device_command' in s])
+        self.assertFalse(
+            [s for s in self.statements if 'session_device_status' in s
+             and not s.startswith("SELECT device.")])
+
+    def test_session_lifecycle(self):
+        """ START and STOP are queued once and resent until acknowledged """
+        session_id = self._create_session()
+
+        for _ in range(2):
+            response = self._post(self.__endpoint,
+                                  self.make_payload(ack_seq=0))
+            self.assert200(response)
+            self.assertEqual(self._queued(response), [(1, 'START')])
+            self.assertEqual(response.json['command_name'], 'START')
+            self.assertEqual(
+                json.loads(response.json['parameters'])['session_id'],
+                session_id)
+            self.assertFalse([s for s in self.statements
+                              if 'FROM recording_session' in s
+                              and not s.startswith("SELECT device.")])
+
+        # device acknowledges START and joins the session
+        response = self._post(self.__endpoint, self.make_payload(
+            recording=True, duration=10, session_id=session_id, ack_seq=1))
+        self.assertStatus(response, 204)
+        status = model.RecordingSession.get_by_id(session_id).device_statuses[0]
+        self.assertEqual(status.status,
+                         model.DeviceRecordingStatus.Status.RECORDING)
+        self.session.remove()
+
+        # both a stream request and a cancel are delivered at once
+        model.Device.get_by_id(self.device_id).request_live_stream()
+        model.Device.get_by_id(self.device_id).request_live_stream()
+        model.RecordingSession.get_by_id(session_id).cancel()
+        self.session.remove()
+
+        response = self._post(self.__endpoint, self.make_payload(
+            recording=True, duration=20, session_id=session_id, ack_seq=1))
+        self.assert200(response)
+        self.assertEqual(self._queued(response), [(2, 'STREAM'), (3, 'STOP')])
+
+        response = self._post(self.__endpoint, self.make_payload(
+            recording=True, duration=20, session_id=session_id, ack_seq=3))
+        self.assertStatus(response, 204)
+
+    def test_cancel_before_start(self):
+        """ a START the device hasn't received is withdrawn on cancel """
+        session_id = self._create_session()
+        model.RecordingSession.get_by_id(session_id).cancel()
+        self.session.remove()
+
+        response = self._post(self.__endpoint, self.make_payload(ack_seq=0))
+        self.assert200(response)
+        self.assertEqual(self._queued(response), [(2, 'STOP')])
+
+    def test_legacy_device(self):
+        """ devices that don't send ack_seq drain their queue """
+        self._create_session()
+        response = self._post(self.__endpoint, self.make_payload())
+        self.assert200(response)
+        self.assertEqual(response.json['command_name'], 'START')
+        self.assertIsNone(response.json['commands'])
+
+        device = model.Device.get_by_id(self.device_id)
+        self.assertFalse(device.has_pending_commands())
+
+
+class TestDeviceRegistration(BaseDBTestCase):
+    """ tests for registering devices on their first heartbeat """
+
+    def test_register(self):
+        """ a new device is inserted with its heartbeat values """
+        response = self.client.post('/api/device/heartbeat',
+                                    json=self.make_payload())
+        self.assertStatus(response, 204)
+        self.session.remove()
+        device = model.Device.get_by_name("TEST-DEVICE")
+        self.assertEqual(device.release, "test device")
+        self.assertEqual(device.load, 0.66)
+
+    def test_register_existing(self):
+        """
+        registering a device that another request already inserted returns
+        the existing device instead of failing
+        """
+        self.client.post('/api/device/heartbeat', json=self.make_payload())
+        device_id = model.Device.get_by_name("TEST-DEVICE").id
+        self.session.remove()
+
+        devices = model.Device.register({
+            'TEST-DEVICE': {'release': "other release"},
+            'TEST-DEVICE2': {'release': "other release"}
+        })
+        self.session.commit()
+        self.assertEqual(devices['TEST-DEVICE'].id, device_id)
+        self.assertEqual(devices['TEST-DEVICE'].release, "test device")
+        self.assertEqual(devices['TEST-DEVICE2'].release, "other release")
+        self.assertEqual(len(model.Device.get_devices()), 2)
+
+
+class TestTelemetryWriteBehind(HeartbeatStatementTestCase):
+    """ tests for write-behind buffering of device telemetry """
+
+    def setUp(self):
+        super().setUp()
+        # long flush interval, nothing is written unless the test flushes
+        model.TELEMETRY_BUFFER.configure(self.engine, enabled=True,
+                                         flush_interval=3600,
+                                         max_staleness=3600)
+
+    def tearDown(self):
+        model.TELEMETRY_BUFFER.configure(self.engine, enabled=False,
+                                         flush_interval=10, max_staleness=30)
+        super().tearDown()
+
+    def _load(self):
+        self.session.remove()
+        return model.Device.get_by_name("TEST-DEVICE").load
+
+    def test_idle_heartbeat_buffered(self):
+        """ telemetry from an idle device is only written when flushed """
+        # a new device is written immediately
+        self.assertStatus(
+            self._post('/api/device/heartbeat', self.make_payload()), 204)
+        self.assertEqual(self._load(), 0.66)
+
+        for load in (1.0, 2.0):
+            payload = self.make_payload()
+            payload['system_info']['load'] = load
+            response = self._post('/api/device/heartbeat', payload)
+            self.assertStatus(response, 204)
+            self.assertFalse(
+                [s for s in self.statements if s.startswith("UPDATE")])
+        self.assertEqual(self._load(), 0.66)
+
+        # both heartbeats are coalesced into a single row update, which
+        # doesn't change the revision of the device
+        version = model.ChangeCounter.get_version()
+        revision = model.Device.get_by_name("TEST-DEVICE").revision
+        self.assertEqual(model.TELEMETRY_BUFFER.flush(), 1)
+        self.assertEqual(self._load(), 2.0)
+        self.assertEqual(model.Device.get_by_name("TEST-DEVICE").revision,
+                         revision)
+        self.assertEqual(model.ChangeCounter.get_version(), version)
+
+    def test_failed_flush_retried(self):
+        """ updates of a failed flush are written by the next one """
+        self._post('/api/device/heartbeat', self.make_payload())
+        device_id = model.Device.get_by_name("TEST-DEVICE").id
+        payload = self.make_payload()
+        payload['system_info']['load'] = 1.0
+        self._post('/api/device/heartbeat', payload)
+
+        failures = model.TELEMETRY_BUFFER.metrics.failures
+        error = OperationalError("UPDATE device", {}, Exception("locked"))
+        with mock.patch.object(model.TELEMETRY_BUFFER, 'after_write',
+                               side_effect=error):
+            self.assertEqual(model.TELEMETRY_BUFFER.flush(), 0)
+        self.assertEqual(self._load(), 0.66)
+        self.assertEqual(model.TELEMETRY_BUFFER.flush(), 1)
+        self.assertEqual(self._load(), 1.0)
+
+        # an update buffered while a flush fails isn't replaced by the
+        # older update put back
+        def newer_update(*args):  # pylint: disable=W0613
+            model.TELEMETRY_BUFFER.add(device_id, {
+                'last_update': datetime.utcnow(), 'load': 3.0,
+                'free_ram': 1, 'uptime': 1, 'free_disk': 1})
+            raise error
+
+        self._post('/api/device/heartbeat', payload)
+        with mock.patch.object(model.TELEMETRY_BUFFER, 'after_write',
+                               side_effect=newer_update):
+            self.assertEqual(model.TELEMETRY_BUFFER.flush(), 0)
+        self.assertEqual(model.TELEMETRY_BUFFER.flush(), 1)
+        self.assertEqual(self._load(), 3.0)
+        self.assertEqual(model.TELEMETRY_BUFFER.metrics.failures,
+                         failures + 2)
+
+    def test_rolled_back_heartbeat_not_buffered(self):
+        """ telemetry is only buffered once its heartbeat commits """
+        self._post('/api/device/heartbeat', self.make_payload())
+        self.session.remove()
+        model.Device.update_from_heartbeats([{
+            'name': "TEST-DEVICE", 'last_update': datetime.utcnow(),
+            'load': 5.0}])
+        self.session.rollback()
+        self.assertEqual(model.TELEMETRY_BUFFER.flush(), 0)
+        self.assertEqual(self._load(), 0.66)
+
+    def test_sensor_status_written_synchronously(self):
+        """ the camera state isn't buffered """
+        self._post('/api/device/heartbeat', self.make_payload())
+        payload = self.make_payload(recording=True, duration=10)
+        payload['system_info']['load'] = 2.0
+        self._post('/api/device/heartbeat', payload)
+        # the device row changed, so its telemetry is written along with it
+        self.assertEqual(self._load(), 2.0)
+        device = model.Device.get_by_name("TEST-DEVICE")
+        self.assertTrue(device.sensor_status['camera']['recording'])
+        self.assertIsNone(model.TELEMETRY_BUFFER.pop(device.id))
+
+    def test_session_change_written_synchronously(self):
+        """ heartbeats that change the device row also write telemetry """
+        self._post('/api/device/heartbeat', self.make_payload())
+        device = model.Device.get_by_name("TEST-DEVICE")
+        device_id = device.id
+        session = model.RecordingSession.create(
+            [{'device_id': device_id, 'filename_prefix': "test_prefix"}],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        session_id = session.id
+        self.session.remove()
+
+        self._post('/api/device/heartbeat', self.make_payload())
+        self._post('/api/device/heartbeat',
+                   self.make_payload(recording=True, duration=10,
+                                     session_id=session_id))
+
+        payload = self.make_payload(recording=False, duration=600,
+                                    session_id=session_id)
+        payload['system_info']['load'] = 3.0
+        response = self._post('/api/device/heartbeat', payload)
+        self.assertEqual(response.json['command_name'], 'COMPLETE')
+
+        self.assertEqual(self._load(), 3.0)
+        self.assertIsNone(model.TELEMETRY_BUFFER.pop(device_id))
+
+    def test_down_device_written_synchronously(self):
+        """ the first heartbeat from a DOWN device isn't buffered """
+        self._post('/api/device/heartbeat', self.make_payload())
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = -60
+        self.assertEqual(len(model.DOWN_SWEEPER.sweep()), 1)
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = 60
+
+        payload = self.make_payload()
+        payload['system_info']['load'] = 2.0
+        self._post('/api/device/heartbeat', payload)
+        self.assertEqual(self._load(), 2.0)
+        self.assertIsNone(model.Device.get_by_name("TEST-DEVICE").down_since)
+
+
+class TestDownSweeper(BaseDBTestCase):
+    """ tests for recording devices that stopped sending heartbeats """
+
+    def setUp(self):
+        for name in ("TEST-DEVICE1", "TEST-DEVICE2"):
+            self.client.post('/api/device/heartbeat',
+                             json=self.make_payload(name))
+        self.session.remove()
+
+    def test_sweep(self):
+        """ devices are recorded as DOWN once, until their next heartbeat """
+        self.assertEqual(model.DOWN_SWEEPER.sweep(), [])
+
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = -60
+        swept = model.DOWN_SWEEPER.sweep()
+        self.assertEqual([name for name, _, _ in swept],
+                         ["TEST-DEVICE1", "TEST-DEVICE2"])
+        self.assertEqual(model.DOWN_SWEEPER.sweep(), [])
+
+        device = model.Device.get_by_name("TEST-DEVICE1")
+        self.assertEqual(device.state(), model.Device.State.DOWN)
+        self.assert_latest_revision(device.revision)
+        self.assertEqual(device.down_since.replace(tzinfo=None),
+                         device.last_update.replace(tzinfo=None) -
+                         timedelta(seconds=60))
+        self.session.remove()
+
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = 60
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload("TEST-DEVICE1"))
+        self.session.remove()
+        self.assertIsNone(model.Device.get_by_name("TEST-DEVICE1").down_since)
+        self.assertIsNotNone(
+            model.Device.get_by_name("TEST-DEVICE2").down_since)
+
+    def test_sweep_errors(self):
+        """ database errors are logged, the sweeper keeps sweeping """
+        error = OperationalError("SELECT", {}, Exception("connection lost"))
+        with mock.patch.object(model.Device, 'sweep_down',
+                               side_effect=error), \
+                mock.patch.object(model.RecordingSession, 'repair_completion',
+                                  side_effect=error):
+            self.assertEqual(model.DOWN_SWEEPER.sweep(), [])
+
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = -60
+        self.assertEqual(len(model.DOWN_SWEEPER.sweep()), 2)
+
+    def test_sweep_events(self):
+        """ devices going DOWN and coming back up publish events """
+        self.app.config['EVENTS_ENABLED'] = True
+        subscription = notify.subscribe()
+        self.addCleanup(subscription.close)
+
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = -60
+        model.DOWN_SWEEPER.sweep()
+        events = subscription.get(0)
+        self.assertEqual(sorted((e['data']['name'], e['data']['state'])
+                                for e in events),
+                         [("TEST-DEVICE1", 'DOWN'), ("TEST-DEVICE2", 'DOWN')])
+        self.assertIsNotNone(events[0]['data']['down_since'])
+
+        self.app.config['DOWN_DEVICE_THRESHOLD'] = 60
+        self.client.post('/api/device/heartbeat',
+                         json=self.make_payload("TEST-DEVICE1"))
+        events = subscription.get(0)
+        self.assertEqual([(e['data']['name'], e['data']['state'],
+                           e['data']['down_since']) for e in events],
+                         [("TEST-DEVICE1", 'IDLE', None)])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,657 @@
+#! /usr/bin/env python
+
+import unittest
+from datetime import datetime, timedelta
+
+
+import src.app.model as model
+from src.test import BaseDBTestCase, count_statements
+
+Status = model.DeviceRecordingStatus.Status
+
+
+class TestSessionCompletion(BaseDBTestCase):
+    """ tests for completing recording sessions when their devices finish """
+
+    def setUp(self):
+        for name in ("TEST-DEVICE1", "TEST-DEVICE2"):
+            self.client.post('/api/device/heartbeat',
+                             json=self.make_payload(name))
+        self.device_ids = [model.Device.get_by_name(name).id
+                           for name in ("TEST-DEVICE1", "TEST-DEVICE2")]
+        self.session.remove()
+
+    def create_session(self, device_ids):
+        session = model.RecordingSession.create(
+            [{'device_id': device_id, 'filename_prefix': "prefix"}
+             for device_id in device_ids],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        session_id = session.id
+        self.session.remove()
+        return session_id
+
+    def session_status(self, session_id):
+        status = model.RecordingSession.get_by_id(session_id).status
+        self.session.remove()
+        return status
+
+    def finish(self, session_id, device_id, status):
+        model.DeviceRecordingStatus.query.filter_by(
+            session_id=session_id, device_id=device_id).one() \
+            .update_status(status)
+        self.session.remove()
+
+    def test_complete(self):
+        """ the session completes when its last device finishes """
+        session_id = self.create_session(self.device_ids)
+        self.finish(session_id, self.device_ids[0], Status.COMPLETE)
+        self.assertEqual(self.session_status(session_id),
+                         model.RecordingSession.Status.IN_PROGRESS)
+
+        self.finish(session_id, self.device_ids[1], Status.FAILED)
+        self.assertEqual(self.session_status(session_id),
+                         model.RecordingSession.Status.COMPLETE)
+
+    def test_no_devices_available(self):
+        """ a session none of whose devices could join completes at once """
+        busy_session_id = self.create_session(self.device_ids[:1])
+        session_id = self.create_session(self.device_ids[:1])
+        self.assertEqual(self.session_status(session_id),
+                         model.RecordingSession.Status.COMPLETE)
+        self.assertEqual(self.session_status(busy_session_id),
+                         model.RecordingSession.Status.IN_PROGRESS)
+
+    def test_repair(self):
+        """ sessions whose completion was missed are found with one query """
+        session_id = self.create_session(self.device_ids)
+        # bypass the ORM, as a missed completion would
+        table = model.DeviceRecordingStatus.__table__
+        self.session.execute(table.update().values(status=Status.COMPLETE))
+        self.session.commit()
+        self.assertEqual(self.session_status(session_id),
+                         model.RecordingSession.Status.IN_PROGRESS)
+
+        self.assertEqual(model.RecordingSession.repair_completion(),
+                         [session_id])
+        self.session.remove()
+        self.assertEqual(self.session_status(session_id),
+                         model.RecordingSession.Status.COMPLETE)
+
+        with count_statements(self.engine) as counts:
+            self.assertEqual(model.RecordingSession.repair_completion(), [])
+        self.assertEqual(len(counts['statements']), 1)
+        self.session.remove()
+
+    def test_list_is_read_only(self):
+        """ listing sessions doesn't write anything """
+        session_id = self.create_session(self.device_ids)
+        headers = self.auth_headers()
+        with count_statements(self.engine) as counts:
+            response = self.client.get(
+                '/api/recording-session',
+                headers=headers)
+        self.assert200(response)
+        self.assertEqual(response.json[0]['id'], session_id)
+        self.assertEqual(counts['commits'], [])
+        self.assertFalse([s for s in counts['statements']
+                          if not s.startswith("SELECT")])
+
+
+class TestStatusCounts(BaseDBTestCase):
+    """ tests for the device status counters of recording sessions """
+
+    def setUp(self):
+        self.device_ids = []
+        for name in ("TEST-DEVICE1", "TEST-DEVICE2", "TEST-DEVICE3"):
+            self.client.post('/api/device/heartbeat',
+                             json=self.make_payload(name))
+            self.device_ids.append(model.Device.get_by_name(name).id)
+        self.session.remove()
+
+        # the first device is busy, so it fails to join the second session
+        self.create_session(self.device_ids[:1])
+        self.session_id = self.create_session(self.device_ids)
+
+    def create_session(self, device_ids):
+        session = model.RecordingSession.create(
+            [{'device_id': device_id, 'filename_prefix': "prefix"}
+             for device_id in device_ids],
+            duration=600, name="test session", fragment_hourly=True,
+            target_fps=30, apply_filter=True)
+        session_id = session.id
+        self.session.remove()
+        return session_id
+
+    def counts(self):
+        session = model.RecordingSession.get_by_id(self.session_id)
+        counts = {status.name: getattr(session, session.counter(status))
+                  for status in Status}
+        self.session.remove()
+        return {name: count for name, count in counts.items() if count}
+
+    def set_status(self, device_id, status):
+        model.DeviceRecordingStatus.query.filter_by(
+            session_id=self.session_id, device_id=device_id).one() \
+            .update_status(status)
+        self.session.remove()
+
+    def test_transitions(self):
+        """ the counters follow every status change """
+        self.assertEqual(self.counts(), {'PENDING': 2, 'FAILED': 1})
+        self.set_status(self.device_ids[1], Status.RECORDING)
+        self.assertEqual(self.counts(),
+                         {'PENDING': 1, 'RECORDING': 1, 'FAILED': 1})
+        self.set_status(self.device_ids[1], Status.COMPLETE)
+        self.assertEqual(self.counts(),
+                         {'PENDING': 1, 'COMPLETE': 1, 'FAILED': 1})
+
+        model.RecordingSession.get_by_id(self.session_id).cancel()
+        self.session.remove()
+        self.assertEqual(self.counts(),
+                         {'COMPLETE': 1, 'FAILED': 1, 'CANCELED': 1})
+
+    def test_summary(self):
+        """ the summary list has the counters but not the device statuses """
+        headers = self.auth_headers()
+        with count_statements(self.engine) as counts:
+            response = self.client.get(
+                '/api/recording-session', query_string={'summary': True},
+                headers=headers)
+        self.assert200(response)
+        # the device list version and the sessions
+        self.assertEqual(len(counts['statements']), 2)
+        self.assertNotIn('device_statuses', response.json[0])
+        self.assertEqual(response.json[0]['id'], self.session_id)
+        self.assertEqual(response.json[0]['status_counts'], {
+            'pending': 2, 'recording': 0, 'complete': 0, 'failed': 1,
+            'canceled': 0})
+
+    def test_recount(self):
+        """ counters that don't match the statuses are corrected """
+        table = model.DeviceRecordingStatus.__table__
+        self.session.execute(table.update().where(
+            table.c.session_id == self.session_id).values(
+                status=Status.RECORDING))
+        self.session.commit()
+        self.assertEqual(self.counts(), {'PENDING': 2, 'FAILED': 1})
+
+        self.assertEqual(model.recount_statuses(self.engine), 1)
+        self.assertEqual(self.counts(), {'RECORDING': 3})
+        self.assertEqual(model.recount_statuses(self.engine), 0)
+
+
+class TestSessionDevices(BaseDBTestCase):
+    """ tests for listing the device statuses of a recording session """
+
+    def setUp(self):
+        self.device_ids = []
+        for name in ("TEST-DEVICE1", "TEST-DEVICE2", "TEST-DEVICE3"):
+            self.client.post('/api/device/heartbeat',
+                             json=self.make_payload(name))
+            self.device_ids.append(model.Device.get_by_name(name).id)
+        self.session.remove()
+
+        # the first device is busy, so it fails to join the second session
+        for device_ids in (self.device_ids[:1], self.device_ids):
+            session = model.RecordingSession.create(
+                [{'device_id': device_id, 'filename_prefix': "prefix"}
+                 for device_id in device_ids],
+                duration=600, name="test session", fragment_hourly=True,
+                target_fps=30, apply_filter=True)
+            self.session_id = session.id
+            self.session.remove()
+        model.DeviceRecordingStatus.query.filter_by(
+            session_id=self.session_id, device_id=self.device_ids[2]).one() \
+            .update_status(Status.RECORDING)
+        self.session.remove()
+
+        self.headers = self.auth_headers()
+
+    def list_devices(self, *statuses, session_id=None):
+        session_id = session_id or self.session_id
+        with count_statements(self.engine) as counts:
+            response = self.client.get(
+                f'/api/recording-session/{session_id}/devices',
+                query_string=[('status', s) for s in statuses],
+                headers=self.headers)
+        self.counts = counts
+        return response
+
+    def test_list(self):
+        """ every device is listed with a single query for the statuses """
+        response = self.list_devices()
+        self.assert200(response)
+        self.assertEqual([(s['device']['name'], s['status'])
+                          for s in response.json],
+                         [("TEST-DEVICE1", 'FAILED'),
+                          ("TEST-DEVICE2", 'PENDING'),
+                          ("TEST-DEVICE3", 'RECORDING')])
+        # the device list version and the statuses
+        self.assertEqual(len(self.counts['statements']), 2)
+
+    def test_status(self):
+        """ only devices in the requested statuses are listed """
+        response = self.list_devices('FAILED')
+        self.assert200(response)
+        self.assertEqual([s['device']['name'] for s in response.json],
+                         ["TEST-DEVICE1"])
+        self.assertIsNotNone(response.json[0]['message'])
+
+        response = self.list_devices('PENDING', 'RECORDING')
+        self.assertEqual([s['device']['name'] for s in response.json],
+                         ["TEST-DEVICE2", "TEST-DEVICE3"])
+        self.assertEqual(self.list_devices('COMPLETE').json, [])
+
+        self.assertEqual(
+            [d.name for d in model.DeviceRecordingStatus.get_recording(
+                self.session_id)], ["TEST-DEVICE3"])
+
+    def test_errors(self):
+        """ 404 for unknown sessions and 400 for unknown statuses """
+        self.assert404(self.list_devices(session_id=1234))
+        self.assert400(self.list_devices('BROKEN'))
+
+
+class TestBulkSessions(BaseDBTestCase):
+    """ tests for canceling and archiving many recording sessions at once """
+
+    __endpoint = '/api/recording-session/bulk'
+
+    def setUp(self):
+        self.device_ids = []
+        for name in ("TEST-DEVICE1", "TEST-DEVICE2", "TEST-DEVICE3"):
+            self.client.post('/api/device/heartbeat',
+                             json=self.make_payload(name))
+            self.device_ids.append(model.Device.get_by_name(name).id)
+        self.session.remove()
+
+        # one session per device, the second one is COMPLETE
+        self.session_ids = []
+        for device_id in self.device_ids:
+            session = model.RecordingSession.create(
+                [{'device_id': device_id, 'filename_prefix': "prefix"}],
+                duration=600, name=f"session {len(self.session_ids)}",
+                fragment_hourly=True, target_fps=30, apply_filter=True)
+            self.session_ids.append(session.id)
+            self.session.remove()
+        model.DeviceRecordingStatus.query.filter_by(
+            session_id=self.session_ids[1]).one() \
+            .update_status(Status.COMPLETE)
+        self.session.remove()
+
+        self.headers = self.auth_headers()
+
+    def post(self, **payload):
+        response = self.client.post(self.__endpoint, headers=self.headers,
+                                    json=payload)
+        self.session.remove()
+        return response
+
+    def sessions(self):
+        sessions = {s.id: (s.status.name, s.archived, s.pending_count,
+                           s.canceled_count)
+                    for s in model.RecordingSession.query}
+        self.session.remove()
+        return [sessions[session_id] for session_id in self.session_ids]
+
+    def test_ids(self):
+        """ sessions are canceled and archived by id """
+        version = model.Device.get_version()
+        with count_statements(self.engine) as counts:
+            response = self.post(session_ids=self.session_ids[:2],
+                                 cancel=True, archive=True)
+        self.assert200(response)
+        self.assertEqual(response.json, {'matched': 2, 'canceled': 1,
+                                         'archived': 2, 'stopped': 1})
+        self.assertEqual(len(counts['commits']), 1)
+        self.assertEqual(self.sessions(), [('CANCELED', True, 0, 1),
+                                           ('COMPLETE', True, 0, 0),
+                                           ('IN_PROGRESS', False, 1, 0)])
+        self.assertNotEqual(model.Device.get_version(), version)
+
+        # the device's START is replaced by a STOP
+        device = model.Device.get_by_id(self.device_ids[0])
+        self.assertEqual([c.name for c in
+                          model.DeviceCommand.get_pending(device)],
+                         [model.DeviceCommand.Name.STOP])
+        status = model.DeviceRecordingStatus.query.filter_by(
+            session_id=self.session_ids[0]).one()
+        self.assertEqual(status.status, Status.CANCELED)
+
+    def test_recording_time(self):
+        """ the time recorded by RECORDING devices is kept """
+        self.client.post('/api/device/heartbeat', json=self.make_payload(
+            "TEST-DEVICE1", recording=True, duration=5,
+            session_id=self.session_ids[0]))
+        # the device kept recording without drifting
+        model.DeviceRecordingStatus.query.filter_by(
+            session_id=self.session_ids[0]).update({
+                'recording_started':
+                    datetime.utcnow() - timedelta(seconds=1000)})
+        self.session.commit()
+        self.session.remove()
+        self.post(session_ids=self.session_ids, cancel=True)
+        statuses = {s.session_id: s for s in model.DeviceRecordingStatus.query}
+        self.assertEqual(statuses[self.session_ids[0]].status, Status.CANCELED)
+        self.assertIn(statuses[self.session_ids[0]].recording_time,
+                      (1000, 1001))
+        self.assertEqual(statuses[self.session_ids[2]].recording_time, 0)
+
+    def test_filters(self):
+        """ sessions are canceled and archived by filter """
+        response = self.post(status='COMPLETE', archive=True,
+                             created_before="2100-01-01T00:00:00Z")
+        self.assertEqual(response.json, {'matched': 1, 'canceled': 0,
+                                         'archived': 1, 'stopped': 0})
+        response = self.post(status='COMPLETE', archive=True)
+        self.assertEqual(response.json['archived'], 0)
+
+        # the sessions are archived before they are canceled
+        response = self.post(status='IN_PROGRESS', name="SESSION",
+                             cancel=True, archive=True)
+        self.assertEqual(response.json, {'matched': 2, 'canceled': 2,
+                                         'archived': 2, 'stopped': 2})
+        self.assertEqual(self.sessions(), [('CANCELED', True, 0, 1),
+                                           ('COMPLETE', True, 0, 0),
+                                           ('CANCELED', True, 0, 1)])
+
+    def test_bad_requests(self):
+        """ 400 without sessions or an action, or with invalid values """
+        self.assert400(self.post(cancel=True))
+        self.assert400(self.post(session_ids=self.session_ids))
+        self.assert400(self.post(status='BROKEN', cancel=True))
+        self.assert400(self.post(created_before="yesterday", cancel=True))
+        self.assertEqual(self.sessions(), [('IN_PROGRESS', False, 1, 0),
+                                           ('COMPLETE', False, 0, 0),
+                                           ('IN_PROGRESS', False, 1, 0)])
+
+
+class TestSessionLoading(BaseDBTestCase):
+    """ tests for loading recording sessions to marshal them """
+
+    def setUp(self):
+        for name in ("TEST-DEVICE1", "TEST-DEVICE2"):
+            self.client.post('/api/device/heartbeat',
+                             json=self.make_payload(name))
+        self.device_ids = [model.Device.get_by_name(name).id
+                           for name in ("TEST-DEVICE1", "TEST-DEVICE2")]
+        self.session.remove()
+        self.headers = self.auth_headers()
+
+    def create_sessions(self, count):
+        # only the first session gets the devices, the statuses of the others
+        # fail, but still reference the devices
+        for _ in range(count):
+            model.RecordingSession.create(
+                [{'device_id': device_id, 'filename_prefix': "prefix"}
+                 for device_id in self.device_ids],
+                duration=600, name="test session", fragment_hourly=True,
+                target_fps=30, apply_filter=True)
+            self.session.remove()
+
+    def list_sessions(self):
+        with count_statements(self.engine) as counts:
+            response = self.client.get('/api/recording-session',
+                                       headers=self.headers)
+        self.assert200(response)
+        for session in response.json:
+            self.assertEqual(
+                sorted(s['device']['name'] for s in session['device_statuses']),
+                ["TEST-DEVICE1", "TEST-DEVICE2"])
+        return len(response.json), len(counts['statements'])
+
+    def test_constant_statements(self):
+        """ the number of statements doesn't grow with the sessions listed """
+        self.create_sessions(1)
+        count, statements = self.list_sessions()
+        self.assertEqual(count, 1)
+
+        self.create_sessions(4)
+        self.assertEqual(self.list_sessions(), (5, statements))
+
+    def test_get_by_id(self):
+        """ a single session is loaded with its statuses and devices """
+        self.create_sessions(1)
+        session_id = model.RecordingSession.get()[0].id
+        self.session.remove()
+        with count_statements(self.engine) as counts:
+            response = self.client.get(
+                f'/api/recording-session/{session_id}', headers=self.headers)
+        self.assert200(response)
+        self.assertEqual(len(response.json['device_statuses']), 2)
+        self.assertLessEqual(len(counts['statements']), 3)
+
+        self.assert404(self.client.get('/api/recording-session/1234',
+                                       headers=self.headers))
+
+
+class TestSessionCreation(BaseDBTestCase):
+    """ tests for creating recording sessions """
+
+    __endpoint = '/api/recording-session'
+
+    def setUp(self):
+        self.device_ids = []
+        for name in ("TEST-DEVICE1", "TEST-DEVICE2", "TEST-DEVICE3"):
+            self.client.post('/api/device/heartbeat',
+                             json=self.make_payload(name))
+            self.device_ids.append(model.Device.get_by_name(name).id)
+        self.session.remove()
+        self.headers = self.auth_headers()
+
+    def create(self, device_ids):
+        payload = {
+            'device_spec': [{'device_id': i, 'filename_prefix': "prefix"}
+                            for i in device_ids],
+            'duration': 600, 'name': "test session", 'fragment_hourly': True,
+            'target_fps': 30, 'apply_filter': True
+        }
+        with count_statements(self.engine) as counts:
+            response = self.client.post(self.__endpoint, headers=self.headers,
+                                        json=payload)
+        self.session.remove()
+        return response, len(counts['statements'])
+
+    def test_constant_statements(self):
+        """ the number of statements doesn't grow with the devices """
+        response, statements = self.create(self.device_ids[:1])
+        self.assert200(response)
+        response, more_statements = self.create(self.device_ids[1:])
+        self.assert200(response)
+        self.assertEqual([(s['device']['name'], s['status'])
+                          for s in response.json['device_statuses']],
+                         [("TEST-DEVICE2", 'PENDING'),
+                          ("TEST-DEVICE3", 'PENDING')])
+        self.assertEqual(more_statements, statements)
+
+    def test_unknown_devices(self):
+        """ 400 listing the unknown devices, nothing is created """
+        response, statements = self.create([1234, self.device_ids[0], 1233])
+        self.assert400(response)
+        self.assertEqual(response.json['message'],
+                         "Invalid device IDs: [1233, 1234]")
+        self.assertEqual(statements, 1)
+        self.assertEqual(model.RecordingSession.get(), [])
+        self.assertIsNone(model.Device.get_by_id(self.device_ids[0]).session_id)
+
+
+class TestStartWaves(BaseDBTestCase):
+    """ tests for sending START to the devices of a session in waves """
+
+    __endpoint = '/api/recording-session'
+
+    def setUp(self):
+        self.names = ["TEST-DEVICE1", "TEST-DEVICE2", "TEST-DEVICE3"]
+        for name in self.names:
+            self.client.post('/api/device/heartbeat',
+                             json=self.make_payload(name))
+        self.device_ids = [model.Device.get_by_name(name).id
+                           for name in self.names]
+        self.session.remove()
+        self.headers = self.auth_headers()
+
+    def create(self, **waves):
+        payload = {
+            'device_spec': [{'device_id': i, 'filename_prefix': "prefix"}
+                            for i in self.device_ids],
+            'duration': 600, 'name': "test session", 'fragment_hourly': True,
+            'target_fps': 30, 'apply_filter': True
+        }
+        payload.update(waves)
+        response = self.client.post(self.__endpoint, headers=self.headers,
+                                    json=payload)
+        self.session.remove()
+        return response
+
+    def heartbeat(self, name, **kwargs):
+        response = self.client.post('/api/device/heartbeat',
+                                    json=self.make_payload(name, **kwargs))
+        self.session.remove()
+        return response
+
+    def reach(self, session_id, seconds):
+        """ move the session's creation back in time """
+        model.RecordingSession.query.filter_by(id=session_id).update(
+            {'creation_time': datetime.utcnow() - timedelta(seconds=seconds)})
+        self.session.commit()
+        self.session.remove()
+
+    def test_waves(self):
+        """ devices only get START once their wave is reached """
+        response = self.create(start_wave_size=1, start_wave_interval=60)
+        self.assert200(response)
+        session_id = response.json['id']
+        self.assertEqual(response.json['start_wave_size'], 1)
+        self.assertEqual(response.json['start_wave_interval'], 60)
+        self.assertEqual(response.json['start_waves']['total'], 3)
+        self.assertEqual(response.json['start_waves']['started'], 1)
+        self.assertIsNotNone(response.json['start_waves']['next_wave_time'])
+        self.assertEqual([s['start_wave'] for s in
+                          response.json['device_statuses']], [0, 1, 2])
+
+        self.assertEqual(self.heartbeat(self.names[0]).json['command_name'],
+                         'START')
+        self.assertStatus(self.heartbeat(self.names[1]), 204)
+        # the START stays queued for devices that acknowledge commands
+        self.assertStatus(self.heartbeat(self.names[2], ack_seq=0), 204)
+
+        # the second wave is reached
+        self.reach(session_id, 61)
+        self.assertEqual(self.heartbeat(self.names[1]).json['command_name'],
+                         'START')
+        self.assertStatus(self.heartbeat(self.names[2], ack_seq=0), 204)
+
+        # and the last one
+        self.reach(session_id, 121)
+        response = self.heartbeat(self.names[2], ack_seq=0)
+        self.assertEqual(response.json['command_name'], 'START')
+
+        response = self.client.get(f"{self.__endpoint}/{session_id}",
+                                   headers=self.headers)
+        self.assertEqual(response.json['start_waves'],
+                         {'total': 3, 'started': 3, 'next_wave_time': None})
+
+    def test_default_interval(self):
+        """ the interval defaults to START_WAVE_INTERVAL, waves are optional """
+        response = self.create(start_wave_size=1)
+        self.assertEqual(response.json['start_wave_interval'],
+                         self.app.config['START_WAVE_INTERVAL'])
+        self.assertEqual(response.json['start_waves']['total'], 3)
+        model.RecordingSession.get_by_id(response.json['id']).cancel()
+        self.session.remove()
+        for name in self.names:
+            self.heartbeat(name)
+
+        response = self.create()
+        self.assertIsNone(response.json['start_waves'])
+        self.assertEqual([s['start_wave'] for s in
+                          response.json['device_statuses']], [0, 0, 0])
+        self.assertEqual(self.heartbeat(self.names[2]).json['command_name'],
+                         'START')
+
+    def test_invalid(self):
+        """ 400 for waves of less than one device """
+        self.assert400(self.create(start_wave_size=0))
+        self.assertEqual(model.RecordingSession.get(), [])
+
+
+class TestArchivedSessions(BaseDBTestCase):
+    """ tests for listing archived recording sessions """
+
+    __endpoint = '/api/recording-session'
+
+    def setUp(self):
+        for name in ("TEST-DEVICE1", "TEST-DEVICE2"):
+            self.client.post('/api/device/heartbeat',
+                             json=self.make_payload(name))
+        self.device_ids = [model.Device.get_by_name(name).id
+                           for name in ("TEST-DEVICE1", "TEST-DEVICE2")]
+        self.session.remove()
+        self.headers = self.auth_headers()
+
+        # sessions alternate between the devices, all but the last are
+        # archived
+        self.session_ids = []
+        for i in range(6):
+            session = model.RecordingSession.create(
+                [{'device_id': self.device_ids[i % 2],
+                  'filename_prefix': "prefix"}],
+                duration=600, name=f"Session {i}_{'even' if i % 2 else 'odd'}",
+                fragment_hourly=True, target_fps=30, apply_filter=True)
+            self.session_ids.append(session.id)
+            if i < 5:
+                session.archive()
+            self.session.remove()
+
+    def list_archived(self, **args):
+        response = self.client.get(self.__endpoint, headers=self.headers,
+                                   query_string={'archived': True, **args})
+        self.assert200(response)
+        return [s['id'] for s in response.json], \
+            response.headers.get('X-Next-Cursor')
+
+    def test_pages(self):
+        """ archived sessions are listed newest first, a page at a time """
+        ids, cursor = self.list_archived(limit=2)
+        pages = [ids]
+        while cursor:
+            ids, cursor = self.list_archived(limit=2, cursor=cursor)
+            pages.append(ids)
+        archived = sorted(self.session_ids[:5], reverse=True)
+        self.assertEqual(pages, [archived[:2], archived[2:4], archived[4:]])
+
+        ids, cursor = self.list_archived()
+        self.assertEqual(ids, archived)
+        self.assertIsNone(cursor)
+
+    def test_filters(self):
+        """ archived sessions can be filtered, the filters apply to every page """
+        self.assertEqual(self.list_archived(name="ODD")[0],
+                         [self.session_ids[i] for i in (4, 2, 0)])
+        self.assertEqual(self.list_archived(name="%")[0], [])
+        self.assertEqual(self.list_archived(name="1_")[0],
+                         [self.session_ids[1]])
+
+        ids, cursor = self.list_archived(device_id=self.device_ids[1], limit=1)
+        self.assertEqual(ids, [self.session_ids[3]])
+        self.assertEqual(self.list_archived(device_id=self.device_ids[1],
+                                            limit=1, cursor=cursor),
+                         ([self.session_ids[1]], None))
+
+        self.assertEqual(self.list_archived(
+            created_before="2000-01-01T00:00:00Z")[0], [])
+        self.assertEqual(len(self.list_archived(
+            created_after="2000-01-01T00:00:00Z")[0]), 5)
+
+    def test_bad_args(self):
+        """ 400 for invalid cursors and limits """
+        for args in ({'cursor': "not a cursor"}, {'cursor': "ImEi"},
+                     {'limit': 0}):
+            self.assert400(self.client.get(
+                self.__endpoint, headers=self.headers,
+                query_string={'archived': True, **args}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+microbenchmark for heartbeat payload handling. compares the CPU time per
+heartbeat spent validating the payload and parsing its timestamp the way
+flask_restplus/dateutil do it with the precompiled validator and ISO 8601
+fast path used by the heartbeat endpoints, and measures the CPU time of a
+complete heartbeat request against the test configuration
+
+run from the repository root:
+    python -m src.test.benchmarks.heartbeat_payload
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+import dateutil.parser
+
+from src.app import create_app
+from src.app.controller import API
+from src.app.controller.schemas import HEARTBEAT_SCHEMA
+from src.app.controller.utils.payload import CompiledValidator, \
+    parse_timestamp
+from src.app.model import drop_all
+
+
+def make_payload(name="BENCHMARK-DEVICE"):
+    """ build a valid heartbeat payload """
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'name': name,
+        'sensor_status': {
+            'camera': {'recording': True, 'duration': 120, 'fps': 29.9}
+        },
+        'system_info': {
+            "uptime": 128324,
+            "load": 0.66,
+            "total_ram": 8388608,
+            "free_ram": 7759462,
+            "free_disk": 1258291,
+            "total_disk": 2000000,
+            "release": "benchmark"
+        }
+    }
+
+
+def cpu_per_call(func, iterations):
+    """ CPU time, in microseconds, per call of func """
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def restplus_parse(api, payload):
+    """ what the heartbeat endpoint used to do with each payload """
+    HEARTBEAT_SCHEMA.validate(payload, api.refresolver, api.format_checker)
+    dateutil.parser.parse(payload['timestamp'])
+
+
+def compiled_parse(validator, payload):
+    """ what the heartbeat endpoint does now """
+    validator.validate(payload)
+    parse_timestamp(payload['timestamp'])
+
+
+def benchmark_parsing(iterations):
+    app = create_app('test')
+    validator = CompiledValidator(HEARTBEAT_SCHEMA)
+    payload = make_payload()
+
+    with app.test_request_context():
+        before = cpu_per_call(lambda: restplus_parse(API, payload), iterations)
+        after = cpu_per_call(lambda: compiled_parse(validator, payload),
+                             iterations)
+
+    print(f"validate + parse timestamp, {iterations} iterations")
+    print(f"  flask_restplus/dateutil: {before:8.1f} us per heartbeat")
+    print(f"  compiled/fromisoformat:  {after:8.1f} us per heartbeat")
+    print(f"  speedup:                 {before / after:8.1f}x")
+
+
+def benchmark_requests(iterations):
+    app = create_app('test')
+    client = app.test_client()
+    payload = make_payload()
+    client.post('/api/device/heartbeat', json=payload)
+
+    def post():
+        payload['timestamp'] = datetime.utcnow().isoformat()
+        client.post('/api/device/heartbeat', json=payload)
+
+    try:
+        cpu = cpu_per_call(post, iterations)
+    finally:
+        drop_all(app.config['db_engine'])
+
+    print(f"heartbeat request, {iterations} iterations")
+    print(f"  {cpu:8.1f} us CPU per request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=5000,
+                        help="number of iterations (default %(default)s)")
+    args = parser.parse_args()
+
+    benchmark_parsing(args.iterations)
+    benchmark_requests(max(args.iterations // 10, 1))
+
+
+if __name__ == '__main__':
+    main()
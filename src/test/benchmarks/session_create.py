@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+benchmark for creating recording sessions. measures the SQL statements and
+wall time of POST /api/recording-session for sessions of 10, 100 and 1000
+devices against the test configuration, along with the time the endpoint
+used to spend looking up each device by id before creating the session
+
+run from the repository root:
+    python -m src.test.benchmarks.session_create
+"""
+
+import argparse
+import time
+
+from flask_jwt_extended import create_access_token
+
+from src.app import create_app
+from src.app.model import SESSION, Device, RecordingSession, drop_all
+from src.test import count_statements
+from src.test.benchmarks.heartbeat_payload import make_payload
+
+# heartbeats sent per request when registering the devices
+BATCH_SIZE = 500
+
+
+def register_devices(client, count):
+    """ register count devices, return their ids """
+    names = [f"BENCHMARK-DEVICE-{i:05}" for i in range(count)]
+    for start in range(0, count, BATCH_SIZE):
+        client.post('/api/device/heartbeats',
+                    json=[make_payload(n)
+                          for n in names[start:start + BATCH_SIZE]])
+    device_ids = [d.id for d in Device.get_devices()]
+    SESSION.remove()
+    return device_ids
+
+
+def create_session(client, headers, device_ids):
+    """ create a session with the devices, return the response """
+    return client.post('/api/recording-session', headers=headers, json={
+        'device_spec': [{'device_id': i, 'filename_prefix': "benchmark"}
+                        for i in device_ids],
+        'duration': 600,
+        'name': "benchmark",
+        'fragment_hourly': True,
+        'target_fps': 30,
+        'apply_filter': True
+    })
+
+
+def lookup_each(device_ids):
+    """ what the endpoint used to do to validate the device ids """
+    for device_id in device_ids:
+        Device.get_by_id(device_id)
+    SESSION.remove()
+
+
+def benchmark(sizes, iterations):
+    app = create_app('test')
+    app.config['DOWN_SWEEPER'] = False
+    client = app.test_client()
+    engine = app.config['db_engine']
+
+    try:
+        with app.app_context():
+            token = create_access_token({'id': 1, 'email': "bench@jax.org"})
+            headers = {'Authorization': f"Bearer {token}"}
+            all_ids = register_devices(client, max(sizes))
+
+            print(f"create recording session, {iterations} iterations")
+            print(f"  {'devices':>8} {'statements':>10} {'ms/session':>10} "
+                  f"{'ms/lookup':>10}")
+            for size in sizes:
+                device_ids = all_ids[:size]
+                elapsed = 0
+                for _ in range(iterations):
+                    with count_statements(engine) as counts:
+                        start = time.perf_counter()
+                        response = create_session(client, headers,
+                                                  device_ids)
+                        elapsed += time.perf_counter() - start
+                    assert response.status_code == 200, response.json
+                    # free the devices for the next iteration
+                    RecordingSession.get_by_id(response.json['id']).cancel()
+                    SESSION.remove()
+
+                start = time.perf_counter()
+                lookup_each(device_ids)
+                lookup = time.perf_counter() - start
+
+                print(f"  {size:8} {len(counts['statements']):10} "
+                      f"{elapsed / iterations * 1000:10.1f} "
+                      f"{lookup * 1000:10.1f}")
+    finally:
+        drop_all(engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=5,
+                        help="sessions created per size (default %(default)s)")
+    parser.add_argument('-s', '--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000],
+                        help="devices per session (default %(default)s)")
+    args = parser.parse_args()
+
+    benchmark(args.sizes, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
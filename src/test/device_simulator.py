@@ -90,9 +90,10 @@ class DeviceFaker(object):
             device['sim_session_info']['stream'] = True
             print(f"device {device['name']} stream")
 
-    def simulate_heartbeat(self, device, time_delta):
+    @staticmethod
+    def update_device(device, time_delta):
         """
-        generate a fake heartbeat message using random data for the
+        update a fake device's heartbeat message using random data for the
         non-fixed values
         """
 
@@ -124,6 +125,15 @@ class DeviceFaker(object):
                 device['sensor_status']['camera']['duration'] = device['sim_session_info']['duration']
                 device['sensor_status']['camera']['recording'] = False
 
+        return device
+
+    def simulate_heartbeat(self, device, time_delta):
+        """
+        generate a fake heartbeat message using random data for the
+        non-fixed values and send it to the server
+        """
+        self.update_device(device, time_delta)
+
         # now that we have all the values we need for the heartbeat endpoint
         # payload, we send the request
         endpoint = urljoin(self.server, 'api/device/heartbeat')
@@ -138,6 +148,27 @@ class DeviceFaker(object):
 
         return device
 
+    def simulate_heartbeats(self, devices, time_delta):
+        """
+        generate heartbeat messages for a batch of fake devices and send them
+        to the server in a single request, the way a gateway or relay would
+        """
+        for device in devices:
+            self.update_device(device, time_delta)
+
+        endpoint = urljoin(self.server, 'api/device/heartbeats')
+        result = requests.post(endpoint, json=devices)
+
+        if result.status_code == 200:
+            for device, command in zip(devices, result.json()):
+                if command['command_name']:
+                    self.process_command(device, command)
+        else:
+            print(f"WARNING: heartbeats returned {result.status_code}",
+                  file=sys.stderr)
+
+        return devices
+
 
 def main():
 
@@ -148,6 +179,9 @@ def main():
                         help="number of seconds between heartbeat messages")
     parser.add_argument('--host', default="http://localhost:5000",
                         help="server hostname")
+    parser.add_argument('-b', '--batch-size', type=int, default=0,
+                        help=("send heartbeats in batches of this many "
+                              "devices using the batched heartbeat endpoint"))
 
     args = parser.parse_args()
 
@@ -161,11 +195,19 @@ def main():
         while True:
             print(f"sending heartbeats from {len(devices)} devices")
 
-            devices = parallel(
-                delayed(device_faker.simulate_heartbeat)(device,
-                                                         args.time_delta)
-                for device in devices
-            )
+            if args.batch_size > 0:
+                batches = parallel(
+                    delayed(device_faker.simulate_heartbeats)(
+                        devices[i:i + args.batch_size], args.time_delta)
+                    for i in range(0, len(devices), args.batch_size)
+                )
+                devices = [device for batch in batches for device in batch]
+            else:
+                devices = parallel(
+                    delayed(device_faker.simulate_heartbeat)(device,
+                                                             args.time_delta)
+                    for device in devices
+                )
             print(f"sleeping {args.time_delta} seconds")
             time.sleep(args.time_delta)
 
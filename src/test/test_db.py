@@ -8,12 +8,20 @@ Tests related to database availability, creation, and interaction
 # pylint: disable=E1101
 
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from flask_migrate import downgrade, upgrade
+from sqlalchemy import select, tuple_
+
 from src.test import BaseDBTestCase
 from src.app import model
 
+# revision of the schema created by the release before the alembic revisions
+BASELINE_REVISION = '821391da8f7d'
+
 
 class DbConnectionTest(BaseDBTestCase):
     """ Is the database available ? """
@@ -44,7 +52,7 @@ class SqlalchemyDeviceModelTest(BaseDBTestCase):
             total_ram=8388608,
             free_ram=7759462,
             load=0.66,
-            sensor_status=json.dumps(sensor_status),
+            sensor_status=sensor_status,
             total_disk=2000000,
             free_disk=1258291
         )
@@ -64,7 +72,7 @@ class SqlalchemyDeviceModelTest(BaseDBTestCase):
             total_ram=8388608,
             free_ram=7759462,
             load=0.66,
-            sensor_status=json.dumps(sensor_status),
+            sensor_status=sensor_status,
             total_disk=2000000,
             free_disk=1258291
         )
@@ -87,6 +95,111 @@ class SqlalchemyDeviceModelTest(BaseDBTestCase):
         device = model.Device.get_by_id(1234)
         self.assertEqual(device, None)
 
+    def test_get_recording_devices(self):
+        """ camera recording filter is evaluated by the database """
+        devices = model.Device.get_recording_devices()
+        self.assertEqual([d.name for d in devices], ["TEST-DEVICE2"])
+
+    def test_state(self):
+        """ the state SQL expression matches the state of each device """
+        device = model.Device.get_by_name("TEST-DEVICE1")
+        device.last_update = datetime.utcnow() - timedelta(hours=1)
+        device = model.Device.get_by_name("TEST-DEVICE2")
+        device.session_id = 1
+        model.add_object(model.Device(name="TEST-DEVICE3",
+                                      last_update=datetime.utcnow()))
+
+        # the SQL expression of the hybrid method
+        states = dict(self.session.query(
+            model.Device.name,
+            model.Device.state()).all())  # pylint: disable=E1120
+        self.assertEqual(states, {d.name: d.state()
+                                  for d in model.Device.get_devices()})
+        self.assertEqual(set(states.values()), set(model.Device.State))
+
+        for state in model.Device.State:
+            devices = self.session.query(model.Device.name).filter(
+                model.Device.in_state(state)).all()
+            self.assertEqual([name for name, in devices],
+                             [n for n, s in states.items() if s == state])
+
+        self.assertEqual(model.Device.count_by_state(),
+                         dict.fromkeys(model.Device.State, 1))
+
+    def test_state_index(self):
+        """ finding devices in a state uses the index on last_update """
+        query = self.session.query(model.Device.id).filter(
+            model.Device.in_state(model.Device.State.DOWN))
+        statement = query.statement.compile(
+            self.engine, compile_kwargs={'literal_binds': True})
+        plan = self.engine.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+        self.assertIn("ix_device_last_update_session_id", str(plan))
+
+    def test_sweep_index(self):
+        """ the DOWN sweep only scans devices not already found DOWN """
+        query = self.session.query(model.Device.id).filter(
+            model.Device.down_since.is_(None),
+            model.Device.last_update < model.Device.down_cutoff())
+        statement = query.statement.compile(
+            self.engine, compile_kwargs={'literal_binds': True})
+        plan = self.engine.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+        self.assertIn("ix_device_live_last_update", str(plan))
+
+    def test_archived_session_index(self):
+        """ pages of archived sessions are read in order from an index """
+        session = model.RecordingSession
+        after = select([session.creation_time]).where(session.id == 1)
+        query = self.session.query(session.id).filter(
+            session.archived,
+            tuple_(session.creation_time, session.id) <
+            tuple_(after.as_scalar(), 1)
+        ).order_by(session.creation_time.desc(), session.id.desc())
+        statement = query.statement.compile(
+            self.engine, compile_kwargs={'literal_binds': True})
+        plan = self.engine.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+        self.assertIn("ix_recording_session_archived_creation_time", str(plan))
+        # no sort, the rows are read in index order
+        self.assertNotIn("TEMP B-TREE", str(plan))
+
+    def test_session_status_index(self):
+        """ statuses of a session are found by session and status """
+        status = model.DeviceRecordingStatus
+        query = self.session.query(status.device_id).filter(
+            status.session_id == 1,
+            status.status == status.Status.FAILED)
+        statement = query.statement.compile(
+            self.engine, compile_kwargs={'literal_binds': True})
+        plan = self.engine.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+        self.assertIn("ix_session_device_status_session_id_status", str(plan))
+
+    def test_migrate_sensor_status(self):
+        """ JSON encoded sensor status strings are converted to objects """
+        device = model.Device.get_by_name("TEST-DEVICE1")
+        sensor_status = device.sensor_status
+        device.sensor_status = json.dumps(sensor_status)
+        self.session.commit()
+
+        self.assertEqual(model.migrate_sensor_status(self.engine), 1)
+        self.session.expire_all()
+        device = model.Device.get_by_name("TEST-DEVICE1")
+        self.assertEqual(device.sensor_status, sensor_status)
+        self.assertEqual(model.migrate_sensor_status(self.engine), 0)
+
+    def test_migrations(self):
+        """ the alembic revisions upgrade the baseline schema to the models """
+        self.session.remove()
+        downgrade(revision=BASELINE_REVISION)
+        self.assertFalse(self.engine.dialect.has_table(
+            self.engine, model.DeviceCommand.__tablename__))
+        upgrade()
+
+        with self.engine.connect() as conn:
+            context = MigrationContext.configure(conn)
+            self.assertEqual(
+                compare_metadata(context, model.BASE.metadata), [])
+        device = model.Device.get_by_name("TEST-DEVICE1")
+        self.assertEqual(device.acked_seq, 0)
+
     def test_delete_model(self):
         """ Test that the entry can be deleted """
         self.session.query(model.Device).delete()
@@ -95,6 +208,7 @@ class SqlalchemyDeviceModelTest(BaseDBTestCase):
         self.assertEqual(len(devices), 0)
 
     def tearDown(self):
+        self.session.query(model.DeviceCommand).delete()
         self.session.query(model.Device).delete()
         self.session.commit()
         self.session.remove()
@@ -118,7 +232,7 @@ class SqlalchemyRecordingSessionModelTest(BaseDBTestCase):
             total_ram=8388608,
             free_ram=7759462,
             load=0.66,
-            sensor_status=json.dumps(sensor_status),
+            sensor_status=sensor_status,
             total_disk=2000000,
             free_disk=1258291
         )
@@ -131,7 +245,7 @@ class SqlalchemyRecordingSessionModelTest(BaseDBTestCase):
             total_ram=8388608,
             free_ram=7759462,
             load=0.66,
-            sensor_status=json.dumps(sensor_status),
+            sensor_status=sensor_status,
             total_disk=2000000,
             free_disk=1258291
         )
@@ -144,7 +258,7 @@ class SqlalchemyRecordingSessionModelTest(BaseDBTestCase):
             total_ram=8388608,
             free_ram=7759462,
             load=0.66,
-            sensor_status=json.dumps(sensor_status),
+            sensor_status=sensor_status,
             total_disk=2000000,
             free_disk=1258291
         )
@@ -153,6 +267,7 @@ class SqlalchemyRecordingSessionModelTest(BaseDBTestCase):
         self.session.commit()
 
     def tearDown(self):
+        self.session.query(model.DeviceCommand).delete()
         self.session.query(model.Device).delete()
         self.session.query(model.DeviceRecordingStatus).delete()
         self.session.query(model.RecordingSession).delete()
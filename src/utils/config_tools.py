@@ -43,7 +43,33 @@ def create_empty_config():
         'FLASK_SECRET': '',
         'JWT_SECRET': '',
         'DOWN_DEVICE_THRESHOLD': 60,
-        'STREAM_KEEP_ALIVE': 10
+        'STREAM_KEEP_ALIVE': 10,
+        'SUMMARY_TTL': 1.0
+    }
+
+    config_dict['TELEMETRY'] = {
+        'WRITE_BEHIND': 'false',
+        'FLUSH_INTERVAL': 10,
+        'MAX_STALENESS': 30,
+        'METRICS_INTERVAL': 300
+    }
+
+    config_dict['COMMANDS'] = {
+        'LONG_POLL': 'false',
+        'MAX_WAIT': 30,
+        'NOTIFIER': 'local',
+        'NOTIFY_DIR': '/tmp/jax-mba-service-notify'
+    }
+
+    config_dict['EVENTS'] = {
+        'ENABLED': 'false',
+        'KEEP_ALIVE': 15,
+        'QUEUE_SIZE': 1000
+    }
+
+    config_dict['SWEEPER'] = {
+        'ENABLED': 'false',
+        'INTERVAL': 5
     }
 
     config_dict['EMAIL'] = {